@@ -1,19 +1,92 @@
 import glob
 import os
 import json
+import io
+import time
+import threading
+import numpy as np
 import pandas as pd
-from flask import Flask, request
+from flask import Flask, request, Response, stream_with_context, g
 from datetime import datetime
 from dotenv import load_dotenv
 
 from load_data import load_data
-from preprocess_data import preprocess_data, save_processed_data, save_scalar, save_encoder
-from train_model import load_processed_data, train_model, export_model, export_model_perormance
-from host_model import get_model_evaluation_metrics, move_model_from_stage_to_prod, compare_model_performances
-from consume_model import predict_using_pretrained_model
+from pipelines import run_load_and_process_data, run_train_model, run_build_score_index, publish_model
+from pipeline_dag import run_pipeline_dag
+from jobs import submit_job, get_job, list_jobs
+from consume_model import predict_using_pretrained_model, predict_using_scoring_kernel, predict_columns_using_pretrained_model, predict_batch_using_pretrained_model, get_artifact_cache_stats, get_prod_model_version, warm_up_prod_artifacts, get_readiness, select_input_columns, INPUT_DTYPE_MAPPING
+from score_index import start_score_index_refresher, refresh_score_index, lookup_customer_score, get_score_index_stats
+from prediction_cache import feature_fingerprints, get_cached_predictions, store_predictions, get_prediction_cache_stats
+from schema import numpy_dtype
+from request_schema import parse_predict_request, RequestValidationError
+from metrics import observe, increment_counter, render_prometheus
 
 app = Flask(__name__)
 
+BATCH_PREDICT_CHUNK_SIZE = int(os.getenv("BATCH_PREDICT_CHUNK_SIZE", "10000"))
+BATCH_PREDICT_MAX_CHUNK_SIZE = int(os.getenv("BATCH_PREDICT_MAX_CHUNK_SIZE", "50000"))
+
+def start_serving_warmup():
+    """Function to load and test-score the production model and load the score index in the background.
+
+    /ready reports 503 until the model is warm, so traffic is only routed once the first
+    prediction no longer pays for the downloads.
+    """
+
+    def warm_up():
+        warm_up_prod_artifacts(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/")
+        )
+        start_score_index_refresher(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo")
+        )
+
+    threading.Thread(target=warm_up, name="serving-warmup", daemon=True).start()
+
+def preload_serving_artifacts():
+    """Function to load and test-score the production model and load the score index without starting any thread.
+
+    Called by the gunicorn master before it forks the workers (gunicorn.conf.py), which
+    then start with the artifacts in memory and only start their watcher threads.
+    """
+
+    warm_up_prod_artifacts(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        interval=0
+    )
+    try:
+        refresh_score_index(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo")
+        )
+    except Exception as e:
+        print(f"ERROR: Failed to load the score index. Details: {e}")
+
+# Under gunicorn the server hooks start the warmup instead (gunicorn.conf.py).
+if os.getenv("SERVING_WARMUP", "1") != "0" and os.getenv("SERVING_WARMUP_ON_IMPORT", "1") != "0":
+    start_serving_warmup()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # The route pattern, not the path, keeps /jobs/<job_id> to a single series.
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    if "request_start" in g:
+        # Streamed responses (/predict_batch) are timed until their first byte.
+        observe("churn_http_request_duration_seconds", time.perf_counter() - g.request_start, endpoint=endpoint)
+    increment_counter("churn_http_requests_total", endpoint=endpoint, status=response.status_code)
+    return response
+
 @app.route('/')
 def hello_world():
     # Get the current date and time
@@ -28,6 +101,12 @@ def hello_world():
 
     return response
 
+@app.route('/ready', methods=['GET'])
+def ready_api():
+    readiness = get_readiness()
+    return Response(json.dumps(readiness), status=200 if readiness["ready"] else 503, mimetype="application/json")
+
+
 @app.route('/load_data', methods=['GET'])
 def load_data_api():
 
@@ -40,206 +119,176 @@ def load_data_api():
     if raw_data.empty is True:
         return "No data loaded."
     else:
-        return f"Loaded {len(raw_data)} records."
+        json_object = {
+            "messages": [f"Loaded {len(raw_data)} records."],
+            "ingestion_report": raw_data.attrs.get("ingestion_report", [])
+        }
+        return json.dumps(json_object)
 
-@app.route('/lnp_data', methods=['GET'])
-def preprocess_data_api():
+def is_wait_requested() -> bool:
+    """Function to check if the caller asked to run a pipeline inline (wait=true) instead of as a background job."""
 
-    messages = ["Load and Process Data"]
-    raw_data = load_data(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        raw_data_folder_path=os.getenv("RAW_DATA_FOLDER_PATH", "data/raw/")
-    )
+    return request.args.get("wait", "false").lower() in ("1", "true", "yes")
 
-    if raw_data.empty is True:
-        messages.append("No data loaded.")
-        return "\n".join(messages)
-    messages.append(f"Loaded {len(raw_data)} records.")
 
-    processed_data, scaler, le = preprocess_data(
-        df=raw_data, input_scalar=None, input_encoder=None
-    )
+def get_int_arg(name: str, default) -> int:
+    """Function to read an integer query parameter, raising ValueError with a message for the caller when it is not one."""
 
-    if processed_data.empty is True:
-        messages.append("No data after preprocessing.")
-        return "\n".join(messages)
-    messages.append(f"Loaded {len(raw_data)} records. After preprocessing data has {len(processed_data)} records.")
+    value = request.args.get(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer, got {value!r}.") from None
 
-    outcome, msg = save_processed_data(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
-        df=processed_data
-    )
-    if outcome:
-        messages.append("Processed data saved successfully.")
-    else:
-        messages.append(msg)
-        return "\n".join(messages)
-    
-    save_scalar_outcome, save_scalar_message = save_scalar(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
-        scaler=scaler
-    )
-    if save_scalar_outcome:
-        messages.append("Scalar saved successfully.")
-    else:
-        messages.append(save_scalar_message)
-        return "\n".join(messages)
-    
-    save_encoder_outcome, save_encoder_message = save_encoder(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
-        encoder=le
-    )
-    if save_encoder_outcome:
-        messages.append("Encoder saved successfully.")
-    else:
-        messages.append(save_encoder_message)
-        return "\n".join(messages)
 
+def pipeline_response(outcome: bool, messages: list):
+    """Function to format the result of a pipeline run inline like the original synchronous endpoints."""
+
+    if outcome is False:
+        return "\n".join(messages)
     json_object = {"messages": messages}
     return json.dumps(json_object)
 
-@app.route('/train', methods=['GET'])
-def train_model_api():
 
-    messages = ["Train Model Started"]
-    load_processed_data_outcome, load_msg, df = load_processed_data(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        processed_data_file_path=os.getenv("PROCESSED_DATA_FILE_PATH", "gs://customer-churn-demo/data/processed/processed_data.csv")
-    )
-    if load_processed_data_outcome is False:
-        return "No data loaded."
-    messages.append(f"Processed data loaded successfully. Loaded {len(df)} records.")
+def submit_job_response(pipeline: str, params: dict):
+    """Function to submit a pipeline as a background job and return its id right away."""
 
-    train_model_outcome, train_msg, model, X_test, y_test = train_model(
-        df=df,
-        algorithm="logistic_regression"
-    )
-    if train_model_outcome is False:
-        messages.append(train_msg)
-        return "\n".join(messages)
-    messages.append(f"Model trained successfully.{train_msg}")
+    job, coalesced = submit_job(pipeline, **params)
+    json_object = {
+        "job_id": job["job_id"],
+        "pipeline": pipeline,
+        "status": job["status"],
+        "coalesced": coalesced,
+        "status_url": f"/jobs/{job['job_id']}",
+    }
+    return Response(json.dumps(json_object), status=202, mimetype="application/json")
 
-    timestamp = f"{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    
-    export_model_outcome, export_model_msg = export_model(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
-        algorithm="logistic_regression",
-        timestamp=timestamp,
-        model=model
-    )
-    if export_model_outcome is False:
-        messages.append(export_model_msg)
-        return "\n".join(messages)
-    messages.append(f"Model exported successfully.{export_model_msg}")
+@app.route('/lnp_data', methods=['GET'])
+def preprocess_data_api():
 
-    export_model_perormance_outcome, export_model_perormance_msg = export_model_perormance(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
-        algorithm="logistic_regression",
-        timestamp=timestamp,
-        model=model,
-        X_test=X_test,
-        y_test=y_test
-    )
-    if export_model_perormance_outcome is False:
-        messages.append(export_model_perormance_msg)
-        return "\n".join(messages)
-    messages.append(f"Model evaluation exported successfully.{export_model_perormance_msg}")
+    try:
+        params = {
+            "mode": request.args.get("mode", os.getenv("LNP_DATA_MODE", "incremental")),
+            "chunk_size": get_int_arg("chunk_size", os.getenv("PREPROCESS_CHUNK_SIZE", "0")),
+        }
+    except ValueError as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+    if is_wait_requested():
+        outcome, messages = run_load_and_process_data(**params)
+        return pipeline_response(outcome, messages)
+    return submit_job_response("lnp_data", params)
 
+@app.route('/train', methods=['GET'])
+def train_model_api():
 
-    json_object = {"messages": messages}
-    return json.dumps(json_object)
-    
+    try:
+        params = {
+            "mode": request.args.get("mode", os.getenv("TRAIN_MODE", "in_memory")),
+            "epochs": get_int_arg("epochs", os.getenv("TRAIN_EPOCHS", "5")),
+        }
+    except ValueError as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+    if is_wait_requested():
+        outcome, messages = run_train_model(**params)
+        return pipeline_response(outcome, messages)
+    return submit_job_response("train", params)
+
+def submit_score_index_build() -> str:
+    """Function to start rescoring the customer base with a newly published model, returning a status message."""
+
+    if os.getenv("SCORE_INDEX_ON_PUBLISH", "1") == "0":
+        return "Score index not rebuilt (SCORE_INDEX_ON_PUBLISH=0)."
+    try:
+        job, coalesced = submit_job("score_index")
+        return f"Score index rebuild {'already running' if coalesced else 'started'}: /jobs/{job['job_id']}"
+    except Exception as e:
+        return f"ERROR: Failed to start the score index rebuild, run /build_score_index. Details: {e}"
 
 @app.route('/publish', methods=['GET'])
 def publish_model_api():
 
-    messages = ["Publish Model Started"]
-    prod_eval_load_outcome,prod_model_evaluation_df, prod_model_evaluation_blob = get_model_evaluation_metrics(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/")
-    )
+    outcome, messages, promoted = publish_model()
+    if promoted:
+        messages.append(submit_score_index_build())
 
-    stage_eval_load_outcome, stage_model_evaluation_df, stage_model_evaluation_blob = get_model_evaluation_metrics(
-        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-        model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/")
-    )
+    json_object = {"messages": messages}
+    return json.dumps(json_object)
+    
+
+@app.route('/run_pipeline', methods=['GET'])
+def run_pipeline_api():
 
-    if prod_model_evaluation_df.empty is True:
-        messages.append("No production model evaluation data found so publishing the latest stage model as is.")
-        movement_outcome, movement_messgae, live_model = move_model_from_stage_to_prod(
+    params = {
+        "force": request.args.get("force", "false").lower() in ("1", "true", "yes"),
+    }
+    if is_wait_requested():
+        outcome, messages = run_pipeline_dag(**params)
+        return pipeline_response(outcome, messages)
+    return submit_job_response("pipeline", params)
+
+def get_cacheable_model_version(fingerprints):
+    """Function to get the production model version the prediction cache is keyed by, None when rows cannot be cached."""
+
+    if not fingerprints:
+        return None
+    try:
+        return get_prod_model_version(
             project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
             bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-            stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
-            stage_eval_blob=stage_model_evaluation_blob,
-            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/")
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/")
         )
-        messages.append("Stage model promoted to production successfully.")
-        messages.append(f"Current Model Served in Production:{live_model}")
-    else:
-        messages.append("Production model evaluation data found. Comparing stage and production model evaluations.")
-        do_promote_new_model_to_prod, comparison_message = compare_model_performances(
-            prod_model_evaluation_df=prod_model_evaluation_df,
-            stage_model_evaluation_df=stage_model_evaluation_df,
-            comparison_metric=["Accuracy", "F1-Score"]
-        )
-        messages.append(comparison_message)
-        if do_promote_new_model_to_prod:
-            messages.append("Promoting stage model to production.")
-            movement_outcome, movement_messgae, live_model = move_model_from_stage_to_prod(
-                project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
-                bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
-                stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
-                stage_eval_blob=stage_model_evaluation_blob,
-                prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/")
-            )
-            messages.append("Stage model promoted to production successfully.")
-            messages.append(f"Current Model Served in Production:{live_model}")
-        else:
-            messages.append("Stage model is not bettter, so NOT promoted to production.")
-            messages.append(f"Current Model Served in Production:SAME AS BEFORE")
+    except Exception as e:
+        print(f"ERROR: Failed to resolve the production model version, prediction cache skipped. Details: {e}")
+        return None
 
-    json_object = {"messages": messages}
-    return json.dumps(json_object)
-    
 
 @app.route('/predict', methods=['GET'])
 def predict_api():
     query_string_params = request.args.to_dict(flat=False)
     print(query_string_params)
-    df = pd.DataFrame(query_string_params)
+
+    # Fast path: score the typed query string values with the compiled scoring kernel, no DataFrame needed.
+    try:
+        input_columns = {
+            col: np.asarray(values, dtype=numpy_dtype(col))
+            for col, values in query_string_params.items()
+        }
+    except (ValueError, TypeError) as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+    user_input = [dict(zip(input_columns, row)) for row in zip(*(values.tolist() for values in input_columns.values()))]
+
+    # Repeated customers are answered from the prediction cache of the current production model.
+    fingerprints = feature_fingerprints(input_columns)
+    model_version = get_cacheable_model_version(fingerprints)
+    if model_version is not None:
+        cached_results = get_cached_predictions(model_version, fingerprints)
+        if cached_results is not None:
+            return f"User Input Data: {user_input}, Predictions: {np.asarray([prediction for prediction, probability in cached_results])}"
+
+    kernel_result = predict_using_scoring_kernel(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        input_columns=input_columns
+    )
+    if kernel_result is not None:
+        predictions, probabilities, valid = kernel_result
+        if not valid.all():
+            return f"User Input Data: {user_input}, Predictions: None (missing values or unknown categories in input)"
+        if model_version is not None:
+            store_predictions(model_version, fingerprints, list(zip(predictions.tolist(), probabilities.tolist())))
+        return f"User Input Data: {user_input}, Predictions: {predictions}"
 
     # Define the desired types in a dictionary
-    dtype_mapping = {
-        'CustomerID': 'int32',
-        'Age': 'int32',
-        'Gender': 'object',
-        'Tenure': 'int32',
-        'Usage Frequency': 'int32',
-        'Support Calls': 'int32',
-        'Payment Delay': 'int32',
-        'Subscription Type': 'object',
-        'Contract Length': 'object',
-        'Total Spend': 'float32',
-        'Last Interaction': 'int32',
-        'Churn': 'int32'
-    }
+    dtype_mapping = INPUT_DTYPE_MAPPING
 
-    # Apply the conversion
-    df = df.astype(dtype_mapping)
+    # Apply the conversion, a missing column or a value of the wrong type is the caller's error.
+    try:
+        df = select_input_columns(pd.DataFrame(query_string_params)).astype(dtype_mapping)
+    except (ValueError, TypeError) as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
 
     userInput_df, processed_input, predictions = predict_using_pretrained_model(
         project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
@@ -248,9 +297,195 @@ def predict_api():
         processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
         userInput_df=df
     )
+    # Not cached: this path has no probabilities, and cached results must carry them for POST /predict.
     return f"User Input Data: {userInput_df.to_dict(orient='records')}, Predictions: {predictions}"
 
 
+@app.route('/predict', methods=['POST'])
+def predict_typed_api():
+    """Typed /predict: a JSON, msgpack or Arrow IPC body validated against the request schema, answered with JSON."""
+
+    try:
+        input_columns = parse_predict_request(request.get_data(), (request.mimetype or "").lower())
+    except RequestValidationError as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+
+    num_records = len(next(iter(input_columns.values())))
+    customer_ids = input_columns["CustomerID"].tolist() if "CustomerID" in input_columns else None
+    fingerprints = feature_fingerprints(input_columns)
+    model_version = get_cacheable_model_version(fingerprints)
+    cached_results = get_cached_predictions(model_version, fingerprints) if model_version is not None else None
+
+    if cached_results is not None:
+        predictions = [prediction for prediction, probability in cached_results]
+        probabilities = [probability for prediction, probability in cached_results]
+        valid = [True] * num_records
+    else:
+        location = dict(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/")
+        )
+        result = predict_using_scoring_kernel(input_columns=input_columns, **location)
+        if result is None:
+            result = predict_columns_using_pretrained_model(input_columns=input_columns, **location)
+        if result is None:
+            return Response(json.dumps({"error": "Failed to make predictions, see the service logs."}), status=503, mimetype="application/json")
+
+        predictions, probabilities, valid = result
+        probabilities = np.where(np.isnan(probabilities), None, np.round(probabilities, 6)).tolist()
+        predictions = predictions.tolist()
+        valid = valid.tolist()
+        # Rows that could not be scored have no result, and models without predict_proba no
+        # probability, so only cache when every row got both.
+        if model_version is not None and all(valid) and None not in probabilities:
+            store_predictions(model_version, fingerprints, list(zip(predictions, probabilities)))
+
+    body = {
+        "model_version": model_version,
+        "records": num_records,
+        "cached": cached_results is not None,
+        "customer_ids": customer_ids,
+        # Rows with unseen categories are not valid; their prediction and probability are null.
+        "predictions": [prediction if row_valid else None for prediction, row_valid in zip(predictions, valid)],
+        "probabilities": [probability if row_valid else None for probability, row_valid in zip(probabilities, valid)],
+        "valid": valid,
+    }
+    return Response(json.dumps(body), mimetype="application/json")
+
+
+def read_batch_input_chunks(stream, content_type: str, chunk_size: int):
+    """Function to read a batch request body as DataFrame chunks of at most chunk_size records."""
+
+    if content_type in ("text/csv", "application/csv"):
+        yield from pd.read_csv(stream, chunksize=chunk_size)
+    elif content_type in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        text_stream = io.TextIOWrapper(stream, encoding="utf-8")
+        yield from pd.read_json(text_stream, lines=True, chunksize=chunk_size)
+    elif content_type == "application/json":
+        # A JSON array has to be parsed as a whole, only the scoring is chunked.
+        records = json.load(stream)
+        if not isinstance(records, list):
+            raise ValueError("JSON body must be an array of records.")
+        for start in range(0, len(records), chunk_size):
+            yield pd.DataFrame.from_records(records[start:start + chunk_size])
+    else:
+        raise ValueError(f"Unsupported content type: {content_type}. Use text/csv, application/json or application/x-ndjson.")
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch_api():
+    content_type = (request.mimetype or "").lower()
+    output_format = request.args.get("format", "ndjson").lower()
+    if output_format not in ("ndjson", "csv"):
+        return Response(json.dumps({"error": f"Unsupported output format: {output_format}"}), status=400, mimetype="application/json")
+    try:
+        chunk_size = min(get_int_arg("chunk_size", BATCH_PREDICT_CHUNK_SIZE), BATCH_PREDICT_MAX_CHUNK_SIZE)
+    except ValueError as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+    if chunk_size <= 0:
+        return Response(json.dumps({"error": "chunk_size must be positive."}), status=400, mimetype="application/json")
+
+    stats = {"records": 0, "predictions": 0}
+    try:
+        results = predict_batch_using_pretrained_model(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+            input_chunks=read_batch_input_chunks(request.stream, content_type, chunk_size),
+            stats=stats
+        )
+    except Exception as e:
+        print(f"ERROR: Failed to load production model for batch prediction. Details: {e}")
+        return Response(json.dumps({"error": f"Failed to load production model. Details: {e}"}), status=500, mimetype="application/json")
+
+    def generate():
+        header = True
+        error = None
+        try:
+            for result in results:
+                if output_format == "csv":
+                    yield result.to_csv(index=False, header=header)
+                    header = False
+                else:
+                    yield result.to_json(orient="records", lines=True)
+        except Exception as e:
+            print(f"ERROR: Batch prediction failed. Details: {e}")
+            error = f"Batch prediction failed. Details: {e}"
+        # Headers are already sent, so the outcome is reported in-band as the last line:
+        # a status record for NDJSON, a comment line for CSV.
+        status = {
+            "records": stats["records"],
+            "predictions": stats["predictions"],
+            "dropped": stats["records"] - stats["predictions"],
+            "complete": error is None,
+            "error": error,
+        }
+        if output_format == "csv":
+            yield f"# status: {json.dumps(status)}\n"
+        else:
+            yield json.dumps({"status": status}) + "\n"
+
+    mimetype = "text/csv" if output_format == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@app.route('/artifact_cache', methods=['GET'])
+def artifact_cache_api():
+    return json.dumps(get_artifact_cache_stats())
+
+
+@app.route('/build_score_index', methods=['GET'])
+def build_score_index_api():
+
+    if is_wait_requested():
+        outcome, messages = run_build_score_index()
+        return pipeline_response(outcome, messages)
+    return submit_job_response("score_index", {})
+
+
+@app.route('/score/<int:customer_id>', methods=['GET'])
+def customer_score_api(customer_id):
+    # Loaded once per process and refreshed in the background, lookups only read the memory-mapped index.
+    start_score_index_refresher(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo")
+    )
+    score = lookup_customer_score(customer_id)
+    if score is None:
+        return Response(json.dumps({"error": f"No score for CustomerID {customer_id}"}), status=404, mimetype="application/json")
+    return Response(json.dumps(score), mimetype="application/json")
+
+
+@app.route('/score_index', methods=['GET'])
+def score_index_api():
+    return json.dumps(get_score_index_stats())
+
+
+@app.route('/prediction_cache', methods=['GET'])
+def prediction_cache_api():
+    return json.dumps(get_prediction_cache_stats())
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs_api():
+    return Response(json.dumps({"jobs": list_jobs()}), mimetype="application/json")
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_api(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return Response(json.dumps({"error": f"Unknown job: {job_id}"}), status=404, mimetype="application/json")
+    return Response(json.dumps(job), mimetype="application/json")
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 # This block must be at the same level of indentation as the import statement and app = Flask(__name__)
 if __name__ == '__main__':
     # Get the port from the environment variable, defaulting to 8080 if not found
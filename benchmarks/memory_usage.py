@@ -0,0 +1,96 @@
+"""Compare the memory footprint of loading and preprocessing with compact and default types.
+
+Writes a synthetic raw CSV to a local temporary directory, then loads and preprocesses it
+in a fresh process per setting (COMPACT_DTYPES=1 and COMPACT_DTYPES=0) so the peak RSS
+of one run does not leak into the other.
+
+    python benchmarks/memory_usage.py --rows 1000000 --output memory_usage.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+def run_pipeline(raw_path: str) -> dict:
+    """Function to load and preprocess one raw CSV file and report memory after every stage."""
+
+    import pandas as pd
+    from schema import get_parse_dtypes, log_memory_usage
+    from preprocess_data import preprocess_data
+
+    stages = [log_memory_usage("start")]
+    with contextlib.redirect_stdout(io.StringIO()) as captured:
+        raw_data = pd.read_csv(raw_path, dtype=get_parse_dtypes())
+        stages.append(log_memory_usage("load raw file", raw_data))
+        processed_data, scaler, encoder = preprocess_data(raw_data)
+        stages.append(log_memory_usage("preprocess complete", processed_data))
+
+    # preprocess_data logs its own stages, keep them in pipeline order.
+    preprocess_stages = [line for line in captured.getvalue().splitlines() if line.startswith("[memory] preprocess:")]
+    return {
+        "stages": stages,
+        "preprocess_log": preprocess_stages,
+        "raw_dtypes": {col: str(dtype) for col, dtype in raw_data.dtypes.items()},
+        "processed_dtypes": {col: str(dtype) for col, dtype in processed_data.dtypes.items()},
+    }
+
+
+def run_setting(raw_path: str, compact: bool) -> dict:
+    """Function to run the pipeline in a subprocess with compact types switched on or off."""
+
+    env = dict(os.environ, COMPACT_DTYPES="1" if compact else "0")
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", raw_path],
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", help="Optional path of a JSON results file.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_pipeline(args.worker)))
+        return
+
+    from synthetic_data import make_churn_data
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        raw_path = os.path.join(directory, "raw_data.csv")
+        make_churn_data(args.rows).to_csv(raw_path, index=False)
+        for name, compact in (("compact", True), ("default", False)):
+            results[name] = run_setting(raw_path, compact)
+
+    print(f"{'stage':<24}{'compact df MB':>15}{'default df MB':>15}{'compact peak MB':>17}{'default peak MB':>17}")
+    for compact_stage, default_stage in zip(results["compact"]["stages"], results["default"]["stages"]):
+        def megabytes(value):
+            return f"{value / 1e6:.1f}" if value is not None else "-"
+        print(
+            f"{compact_stage['stage']:<24}"
+            f"{megabytes(compact_stage['dataframe_bytes']):>15}"
+            f"{megabytes(default_stage['dataframe_bytes']):>15}"
+            f"{megabytes(compact_stage['peak_rss_bytes']):>17}"
+            f"{megabytes(default_stage['peak_rss_bytes']):>17}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"rows": args.rows, "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Benchmark every pipeline stage, from raw files to predictions, on synthetic churn data.
+
+For every dataset size a fresh process runs load, preprocess, save, train, export,
+publish and predict against a local directory bucket (STORAGE_BACKEND=local), and
+records wall time, throughput and the process RSS after each stage.
+
+    python benchmarks/pipeline.py --rows 10000,100000,1000000 --output pipeline_results.json
+
+Sizes up to 10M rows work; peak memory grows roughly linearly with the row count.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+PROJECT_ID = "benchmark"
+BUCKET_NAME = "customer-churn-benchmark"
+RAW_DATA_FOLDER_PATH = "data/raw/"
+PROCESSED_DATA_FOLDER_PATH = "data/processed/"
+STAGE_MODEL_FOLDER_PATH = "model/stage/"
+PROD_MODEL_FOLDER_PATH = "model/prod/"
+
+
+def run_stage(results: list, stage: str, records: int, function, *args, **kwargs):
+    """Function to run one stage with its output silenced and record time, throughput and memory."""
+
+    from schema import get_rss_bytes
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    current_rss, peak_rss = get_rss_bytes()
+    results.append({
+        "stage": stage,
+        "records": records,
+        "seconds": round(seconds, 4),
+        "records_per_second": round(records / seconds, 1) if seconds > 0 else None,
+        "rss_bytes": current_rss,
+        "peak_rss_bytes": peak_rss,
+    })
+    return value
+
+
+def check_outcome(outcome, stage: str):
+    """Function to stop the benchmark when a stage reports a failure."""
+
+    if outcome is False or (isinstance(outcome, tuple) and outcome[0] is False):
+        raise RuntimeError(f"Stage {stage} failed: {outcome}")
+
+
+def run_pipeline(rows: int, num_files: int, predict_requests: int) -> list:
+    """Function to run all stages once on rows synthetic records, inside the worker process."""
+
+    import numpy as np
+    from synthetic_data import make_churn_data
+    from storage_backend import get_storage_backend
+    from load_data import load_data
+    from preprocess_data import preprocess_data, save_processed_data, save_scalar, save_encoder
+    from train_model import load_processed_data, train_model, export_model, export_model_perormance, export_scoring_kernel
+    from host_model import get_model_evaluation_metrics, move_model_from_stage_to_prod
+    from consume_model import predict_using_pretrained_model, predict_using_scoring_kernel, predict_batch_using_pretrained_model, INPUT_DTYPE_MAPPING
+
+    results = []
+    backend = get_storage_backend(PROJECT_ID, BUCKET_NAME)
+
+    def write_raw_files():
+        raw_df = make_churn_data(rows)
+        for index, part in enumerate(np.array_split(np.arange(rows), num_files)):
+            backend.write_bytes(f"{RAW_DATA_FOLDER_PATH}raw_{index:03d}.csv", raw_df.iloc[part].to_csv(index=False).encode())
+        return raw_df.head(predict_requests)
+
+    sample_df = run_stage(results, "generate_raw_files", rows, write_raw_files)
+    raw_data = run_stage(results, "load_data", rows, load_data, PROJECT_ID, BUCKET_NAME, RAW_DATA_FOLDER_PATH)
+    processed_data, scaler, encoder = run_stage(results, "preprocess_data", rows, preprocess_data, raw_data)
+    del raw_data
+
+    def save_outputs(processed_df):
+        outcome = save_processed_data(PROJECT_ID, BUCKET_NAME, PROCESSED_DATA_FOLDER_PATH, processed_df)
+        check_outcome(outcome, "save_processed_data")
+        check_outcome(save_scalar(PROJECT_ID, BUCKET_NAME, PROCESSED_DATA_FOLDER_PATH, scaler), "save_scalar")
+        check_outcome(save_encoder(PROJECT_ID, BUCKET_NAME, PROCESSED_DATA_FOLDER_PATH, encoder), "save_encoder")
+
+    run_stage(results, "save_processed_data", len(processed_data), save_outputs, processed_data)
+    del processed_data
+
+    outcome, msg, df = run_stage(
+        results, "load_processed_data", rows, load_processed_data,
+        PROJECT_ID, BUCKET_NAME, f"gs://{BUCKET_NAME}/{PROCESSED_DATA_FOLDER_PATH}processed_data.csv"
+    )
+    check_outcome(outcome, "load_processed_data")
+    train_result = run_stage(results, "train_model", len(df), train_model, df)
+    check_outcome(train_result[0], "train_model")
+    _, _, model, X_test, y_test = train_result
+    del df
+
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+
+    def export_all():
+        check_outcome(export_model(PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, "logistic_regression", timestamp, model), "export_model")
+        check_outcome(export_model_perormance(
+            PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, "logistic_regression", timestamp, model, X_test, y_test
+        ), "export_model_perormance")
+        check_outcome(export_scoring_kernel(
+            PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH, "logistic_regression", timestamp, model, X_test
+        ), "export_scoring_kernel")
+
+    run_stage(results, "export_model", len(X_test), export_all)
+
+    def publish():
+        outcome, stage_evaluation_df, stage_evaluation_blob = get_model_evaluation_metrics(PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH)
+        check_outcome(outcome, "get_model_evaluation_metrics")
+        check_outcome(move_model_from_stage_to_prod(
+            PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, stage_evaluation_blob, PROD_MODEL_FOLDER_PATH
+        ), "move_model_from_stage_to_prod")
+
+    run_stage(results, "publish_model", 1, publish)
+
+    sample_df = sample_df[list(INPUT_DTYPE_MAPPING)].astype(INPUT_DTYPE_MAPPING)
+    single_rows = [sample_df.iloc[[index]] for index in range(len(sample_df))]
+
+    def predict_single_rows():
+        for row in single_rows:
+            predict_using_pretrained_model(PROJECT_ID, BUCKET_NAME, PROD_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH, row)
+
+    def predict_single_rows_with_kernel():
+        for row in single_rows:
+            predict_using_scoring_kernel(
+                PROJECT_ID, BUCKET_NAME, PROD_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH,
+                {col: row[col].to_numpy() for col in row.columns}
+            )
+
+    # The first request fills the artifact cache, time it separately from the warm requests.
+    run_stage(results, "predict_cold_start", 1, predict_using_pretrained_model,
+              PROJECT_ID, BUCKET_NAME, PROD_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH, single_rows[0])
+    run_stage(results, "predict_single_row", len(single_rows), predict_single_rows)
+    run_stage(results, "predict_single_row_kernel", len(single_rows), predict_single_rows_with_kernel)
+
+    batch_rows = min(rows, 1_000_000)
+
+    def predict_batch():
+        batch_df = make_churn_data(batch_rows, seed=11)
+        chunks = (batch_df.iloc[start:start + 10_000] for start in range(0, batch_rows, 10_000))
+        for result in predict_batch_using_pretrained_model(
+                PROJECT_ID, BUCKET_NAME, PROD_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH, chunks):
+            pass
+
+    run_stage(results, "predict_batch", batch_rows, predict_batch)
+    return results
+
+
+def run_size(rows: int, num_files: int, predict_requests: int) -> list:
+    """Function to benchmark one dataset size in a fresh process with its own local bucket."""
+
+    with tempfile.TemporaryDirectory() as storage_root:
+        env = dict(os.environ, STORAGE_BACKEND="local", LOCAL_STORAGE_ROOT=storage_root)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(rows),
+             "--files", str(num_files), "--predict-requests", str(predict_requests)],
+            env=env, capture_output=True, text=True
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark of {rows} rows failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000,1000000", help="Comma separated dataset sizes.")
+    parser.add_argument("--files", type=int, default=8, help="Number of raw CSV files the dataset is split into.")
+    parser.add_argument("--predict-requests", type=int, default=200, help="Number of single row predictions to time.")
+    parser.add_argument("--output", help="Optional path of a JSON results file.")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_pipeline(args.worker, args.files, args.predict_requests)))
+        return
+
+    runs = []
+    for rows in (int(value) for value in args.rows.split(",")):
+        results = run_size(rows, args.files, args.predict_requests)
+        runs.append({"rows": rows, "stages": results})
+
+        print(f"\n{rows} rows")
+        print(f"{'stage':<28}{'seconds':>10}{'records/s':>14}{'rss MB':>10}{'peak MB':>10}")
+        for result in results:
+            records_per_second = f"{result['records_per_second']:.0f}" if result["records_per_second"] else "-"
+            print(
+                f"{result['stage']:<28}"
+                f"{result['seconds']:>10.3f}"
+                f"{records_per_second:>14}"
+                f"{(result['rss_bytes'] or 0) / 1e6:>10.1f}"
+                f"{result['peak_rss_bytes'] / 1e6:>10.1f}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "python": sys.version.split()[0],
+                "files": args.files,
+                "predict_requests": args.predict_requests,
+                "runs": runs,
+            }, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
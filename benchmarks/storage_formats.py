@@ -0,0 +1,103 @@
+"""Compare CSV and columnar (Parquet, Arrow IPC) storage of processed data.
+
+Writes the same processed dataset in every format to a local temporary directory
+and reports file size, write time, full load time and projected load time.
+
+    python benchmarks/storage_formats.py --rows 1000000 --output storage_formats.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess_data import preprocess_data, write_processed_data
+from train_model import load_processed_data
+from synthetic_data import make_churn_data
+
+FORMATS = {
+    "csv": ("processed_data.csv", None),
+    "parquet_snappy": ("processed_data.parquet", "snappy"),
+    "parquet_zstd": ("processed_data.parquet", "zstd"),
+    "arrow_zstd": ("processed_data.arrow", "zstd"),
+    "arrow_lz4": ("processed_data.arrow", "lz4"),
+}
+PROJECTED_COLUMNS = ["Age", "Support Calls", "Contract Length", "Churn"]
+
+
+def benchmark_format(df, directory: str, name: str, file_name: str, compression: str, row_group_size: int, repeats: int):
+    """Function to measure size, write time and load times of one storage format."""
+
+    path = os.path.join(directory, f"{name}_{file_name}")
+    start = time.perf_counter()
+    write_processed_data(df, path, compression=compression, row_group_size=row_group_size)
+    write_seconds = time.perf_counter() - start
+
+    def timed_load(columns):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                outcome, msg, loaded = load_processed_data("local", "local", path, columns=columns)
+            timings.append(time.perf_counter() - start)
+            if outcome is False:
+                raise RuntimeError(msg)
+        return min(timings), loaded
+
+    load_seconds, loaded = timed_load(None)
+    projected_load_seconds, projected = timed_load(PROJECTED_COLUMNS)
+
+    return {
+        "format": name,
+        "compression": compression,
+        "bytes": os.path.getsize(path),
+        "write_seconds": round(write_seconds, 4),
+        "load_seconds": round(load_seconds, 4),
+        "projected_load_seconds": round(projected_load_seconds, 4),
+        "loaded_dtypes": {col: str(dtype) for col, dtype in loaded.dtypes.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Optional path of a JSON results file.")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        processed_df, scaler, encoder = preprocess_data(make_churn_data(args.rows))
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (file_name, compression) in FORMATS.items():
+            results.append(benchmark_format(
+                processed_df, directory, name, file_name, compression, args.row_group_size, args.repeats
+            ))
+
+    csv_result = results[0]
+    print(f"{'format':<16}{'MB':>10}{'size vs csv':>13}{'load s':>10}{'speedup':>9}{'projected s':>13}")
+    for result in results:
+        print(
+            f"{result['format']:<16}"
+            f"{result['bytes'] / 1e6:>10.2f}"
+            f"{result['bytes'] / csv_result['bytes']:>13.2f}"
+            f"{result['load_seconds']:>10.3f}"
+            f"{csv_result['load_seconds'] / result['load_seconds']:>9.1f}"
+            f"{result['projected_load_seconds']:>13.3f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"rows": args.rows, "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+
+def make_churn_data(num_rows: int, seed: int = 7, first_customer_id: int = 1) -> pd.DataFrame:
+    """Function to generate a synthetic raw churn dataset with the same schema as the Kaggle files.
+
+    Value ranges follow the original training data, and Churn depends on support calls,
+    payment delay, contract length and recent activity so models have a signal to learn.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    support_calls = rng.integers(0, 11, num_rows)
+    payment_delay = rng.integers(0, 31, num_rows)
+    last_interaction = rng.integers(1, 31, num_rows)
+    contract_length = rng.choice(["Annual", "Monthly", "Quarterly"], num_rows, p=[0.4, 0.2, 0.4])
+
+    churn_logit = (
+        -2.0
+        + 0.35 * support_calls
+        + 0.08 * payment_delay
+        + 1.5 * (contract_length == "Monthly")
+        + 0.02 * last_interaction
+    )
+    churn = (rng.random(num_rows) < 1.0 / (1.0 + np.exp(-churn_logit))).astype(int)
+
+    return pd.DataFrame({
+        'CustomerID': np.arange(first_customer_id, first_customer_id + num_rows),
+        'Age': rng.integers(18, 66, num_rows),
+        'Gender': rng.choice(["Female", "Male"], num_rows),
+        'Tenure': rng.integers(1, 61, num_rows),
+        'Usage Frequency': rng.integers(1, 31, num_rows),
+        'Support Calls': support_calls,
+        'Payment Delay': payment_delay,
+        'Subscription Type': rng.choice(["Basic", "Premium", "Standard"], num_rows),
+        'Contract Length': contract_length,
+        'Total Spend': rng.uniform(100, 1000, num_rows).round(2),
+        'Last Interaction': last_interaction,
+        'Churn': churn,
+    })
@@ -0,0 +1,144 @@
+import os
+import json
+import pickle
+import numpy as np
+import pandas as pd
+
+# Per-column categorical mapping fitted once by /lnp_data and applied unchanged afterwards
+# (incremental ingestion, /predict, batch scoring). The code of a value is its position in
+# the sorted classes of its column, the same codes LabelEncoder produced. The mapping is
+# stored as encoder.json next to scaler.pkl; encoder.pkl of earlier builds is still read.
+#
+# UNSEEN_CATEGORY_POLICY decides what happens to a value that was not seen during the fit:
+#   drop          - the row is dropped, like a row with missing values (default).
+#   error         - preprocessing fails with a ValueError naming the unseen values.
+#   most_frequent - the value is encoded as the most frequent class of the column.
+UNSEEN_CATEGORY_POLICY = os.getenv("UNSEEN_CATEGORY_POLICY", "drop")
+UNSEEN_CATEGORY_POLICIES = ("drop", "error", "most_frequent")
+
+ENCODER_FILE_NAME = "encoder.json"
+LEGACY_ENCODER_FILE_NAME = "encoder.pkl"
+ENCODER_FORMAT_VERSION = 1
+
+
+class CategoricalEncoder:
+    """Sorted classes and most frequent class of every categorical column, with the unseen-category policy."""
+
+    def __init__(self, column_classes: dict, most_frequent: dict = None, unseen_policy: str = None):
+        unseen_policy = unseen_policy or UNSEEN_CATEGORY_POLICY
+        if unseen_policy not in UNSEEN_CATEGORY_POLICIES:
+            raise ValueError(f"Unknown unseen category policy {unseen_policy}. Use one of {UNSEEN_CATEGORY_POLICIES}.")
+        # column_classes_ is the attribute name the scoring kernel export always read.
+        self.column_classes_ = {col: sorted(classes) for col, classes in column_classes.items()}
+        self.most_frequent_ = dict(most_frequent or {})
+        self.unseen_policy = unseen_policy
+        self._categories = {col: pd.Index(classes) for col, classes in self.column_classes_.items()}
+
+    @classmethod
+    def fit_counts(cls, column_counts: dict, unseen_policy: str = None):
+        """Function to build an encoder from the value counts (value -> count) of every column."""
+
+        column_classes = {col: list(counts) for col, counts in column_counts.items()}
+        # Ties go to the smallest class, so the result does not depend on the order of the data.
+        most_frequent = {
+            col: min(counts, key=lambda value: (-counts[value], value))
+            for col, counts in column_counts.items() if counts
+        }
+        return cls(column_classes, most_frequent, unseen_policy)
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, columns, unseen_policy: str = None):
+        """Function to fit the classes of the given columns of a DataFrame."""
+
+        column_counts = {}
+        for col in columns:
+            counts = df[col].value_counts(sort=False)
+            column_counts[col] = {value: int(count) for value, count in counts.items() if count > 0}
+        return cls.fit_counts(column_counts, unseen_policy)
+
+    def unseen_code(self, col: str) -> int:
+        """Function to get the code unseen values of a column are encoded as, -1 when they are not encoded."""
+
+        if self.unseen_policy != "most_frequent" or col not in self.most_frequent_:
+            return -1
+        return self.column_classes_[col].index(self.most_frequent_[col])
+
+    def codes(self, col: str, values) -> np.ndarray:
+        """Function to look up the codes of the values of a column, -1 for values not seen during the fit."""
+
+        if col not in self._categories:
+            raise ValueError(f"No fitted classes for categorical column {col}, rerun /lnp_data.")
+        # A hash lookup of every value in the fitted classes, no refitting.
+        return self._categories[col].get_indexer(values)
+
+    def transform(self, df: pd.DataFrame, columns, code_dtype) -> pd.DataFrame:
+        """Function to replace the given categorical columns with their codes, applying the unseen-category policy.
+
+        Works in place unless rows have to be dropped, so callers must use the returned DataFrame.
+        """
+
+        codes = {col: self.codes(col, df[col]) for col in columns}
+        keep = np.ones(len(df), dtype=bool)
+        for col, col_codes in codes.items():
+            unseen = col_codes < 0
+            if not unseen.any():
+                continue
+            if self.unseen_policy == "error":
+                unseen_values = sorted(map(str, pd.unique(np.asarray(df[col])[unseen])))
+                raise ValueError(f"Unseen categories in column {col}: {unseen_values}")
+            unseen_code = self.unseen_code(col)
+            if unseen_code >= 0:
+                col_codes[unseen] = unseen_code
+            else:
+                keep &= ~unseen
+
+        if not keep.all():
+            print(f"Dropped {int((~keep).sum())} records with unseen categories.")
+            df = df[keep].copy()
+        for col, col_codes in codes.items():
+            df[col] = col_codes[keep].astype(code_dtype)
+        return df
+
+    def to_dict(self) -> dict:
+        return {
+            "format_version": ENCODER_FORMAT_VERSION,
+            "unseen_policy": self.unseen_policy,
+            "columns": {
+                col: {"classes": classes, "most_frequent": self.most_frequent_.get(col)}
+                for col, classes in self.column_classes_.items()
+            },
+        }
+
+
+def dump_encoder(encoder: CategoricalEncoder) -> bytes:
+    """Function to serialize an encoder to compact JSON."""
+
+    return json.dumps(encoder.to_dict(), separators=(",", ":")).encode()
+
+
+def load_encoder_payload(payload: bytes, file_name: str = ENCODER_FILE_NAME) -> CategoricalEncoder:
+    """Function to deserialize an encoder written by dump_encoder, or a pickled encoder of earlier builds.
+
+    The unseen-category policy is the one configured in this process; the stored policy only
+    records the one in force when the encoder was fitted.
+    """
+
+    if file_name.endswith(".pkl"):
+        legacy = pickle.loads(payload)
+        if not hasattr(legacy, "column_classes_"):
+            raise ValueError("Encoder has no per-column classes, rerun /lnp_data.")
+        return CategoricalEncoder(legacy.column_classes_)
+
+    return encoder_from_dict(json.loads(payload))
+
+
+def encoder_from_dict(layout: dict) -> CategoricalEncoder:
+    """Function to build an encoder from the dict written by CategoricalEncoder.to_dict."""
+
+    if layout["format_version"] != ENCODER_FORMAT_VERSION:
+        raise ValueError(f"Unsupported encoder format version: {layout['format_version']}")
+    columns = layout["columns"]
+    return CategoricalEncoder(
+        {col: entry["classes"] for col, entry in columns.items()},
+        {col: entry["most_frequent"] for col, entry in columns.items() if entry["most_frequent"] is not None},
+    )
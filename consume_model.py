@@ -1,75 +1,450 @@
 import pandas as pd
+import numpy as np
 import os
+import io
+import hashlib
+import time
+import threading
 import joblib
 import pickle
-from google.cloud import storage
 from preprocess_data import preprocess_data
+from categorical_encoding import ENCODER_FILE_NAME, LEGACY_ENCODER_FILE_NAME, load_encoder_payload
+from scoring_kernel import load_scoring_kernel, score_with_kernel
+from model_bundle import get_bundle_name, fetch_model_bundle, remove_stale_bundle_copies
+from schema import COMPACT_DTYPES
+from storage_backend import get_storage_backend, StorageObject
+from model_registry import get_registered_version
+from metrics import timed_span, increment_counter, print_dataframe
 
-def predict_using_pretrained_model(
+# Process-wide cache of the production artifacts (model, scaler, encoder, scoring kernel).
+# Artifacts are revalidated against their GCS blob generation at most once per
+# refresh interval and only re-downloaded when the generation has changed. Models
+# published with a model bundle are served from it alone, memory-mapped (model_bundle.py).
+ARTIFACT_CACHE_REFRESH_SECONDS = float(os.getenv("ARTIFACT_CACHE_REFRESH_SECONDS", "60"))
+
+# Types of the raw input columns accepted by the prediction endpoints, in training column order.
+# These are the compact types of schema.py, so request data is held as narrowly as training data.
+INPUT_DTYPE_MAPPING = dict(COMPACT_DTYPES)
+
+_artifact_cache_lock = threading.Lock()
+_artifact_reload_lock = threading.Lock()
+_artifact_cache = {
+    "location": None,
+    "validated_at": 0.0,
+    "generations": {},
+    "artifacts": {},
+    "model_version": None,
+}
+_artifact_watcher = {
+    "pid": None,
+    "location": None,
+    "thread": None,
+}
+_readiness = {
+    "ready": False,
+    "warmed_up_at": None,
+    "error": None,
+}
+_artifact_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "reloads": 0,
+    "revalidations": 0,
+}
+
+
+def _registered_blob(artifact: dict):
+    """Function to turn an artifact recorded in the model registry into a StorageObject, None if not recorded."""
+
+    return None if artifact is None else StorageObject(name=artifact["name"], size=None, generation=artifact["generation"])
+
+
+def resolve_prod_artifact_blobs(backend, prod_model_folder_path: str, processed_data_folder_path: str):
+    """Function to resolve the current production artifact blobs and their generations.
+
+    The production version of the model registry is resolved with one read; the prod folder
+    is only listed when the registry has no production version yet.
+    """
+
+    version_id, entry = get_registered_version(backend, "production")
+    if entry is not None and entry["prod"]:
+        prod_artifacts = entry["prod"]
+        model_blob = _registered_blob(prod_artifacts["model"])
+        bundle_blob = _registered_blob(prod_artifacts.get("bundle"))
+        kernel_blob = _registered_blob(prod_artifacts.get("kernel"))
+    else:
+        blobs = {blob.name: blob for blob in backend.list(prod_model_folder_path)}
+        # The production model is the one of the latest promoted evaluation, as in /publish;
+        # the prod folder keeps every earlier model as a backup.
+        evaluation_blobs = [blob for name, blob in blobs.items() if name.endswith('.csv')]
+        model_blob = None
+        if evaluation_blobs:
+            latest_evaluation = max(evaluation_blobs, key=lambda blob: blob.time_created)
+            model_blob = blobs.get(latest_evaluation.name.replace("_evaluation_", "_").replace(".csv", ".joblib"))
+        if model_blob is None:
+            model_blob = max((blob for name, blob in blobs.items() if name.endswith('.joblib')), key=lambda blob: blob.time_created)
+        bundle_blob = blobs.get(get_bundle_name(model_blob.name))
+        # The scoring kernel is exported next to the model and is optional; the listing above already covers it.
+        model_folder, model_file_name = model_blob.name.rsplit("/", 1)
+        kernel_file_name = model_file_name.replace("model_", "model_kernel_", 1).replace(".joblib", ".npz")
+        kernel_blob = blobs.get(f"{model_folder}/{kernel_file_name}")
+
+    return resolve_model_artifact_blobs(backend, processed_data_folder_path, model_blob, kernel_blob, bundle_blob)
+
+
+def resolve_model_artifact_blobs(backend, processed_data_folder_path: str, model_blob, kernel_blob=None, bundle_blob=None):
+    """Function to get the blobs serving a model needs: its bundle alone, or the model, kernel, scaler and encoder."""
+
+    # A model bundle holds everything else too, so it is the only artifact to fetch.
+    if bundle_blob is not None:
+        return {"bundle": bundle_blob}
+
+    scalar_path = f"{processed_data_folder_path}scaler.pkl"
+    encoder_path = f"{processed_data_folder_path}{ENCODER_FILE_NAME}"
+    scalar_blob = backend.stat(scalar_path)
+    encoder_blob = backend.stat(encoder_path) or backend.stat(f"{processed_data_folder_path}{LEGACY_ENCODER_FILE_NAME}")
+    if scalar_blob is None or encoder_blob is None:
+        raise FileNotFoundError(f"Missing {scalar_path} or {encoder_path} in bucket {backend.bucket_name}")
+
+    return {
+        "model": model_blob,
+        "scaler": scalar_blob,
+        "encoder": encoder_blob,
+        "kernel": kernel_blob,
+    }
+
+
+def _load_artifact(backend, name: str, blob, bundle_dir: str = None):
+    """Function to download a single artifact at a pinned generation and deserialize it."""
+
+    if blob is None:
+        return None
+    if name == "bundle":
+        print(f"Loading model bundle {blob.name} (generation {blob.generation})...")
+        with timed_span("unpickle", artifact=name):
+            return fetch_model_bundle(backend, blob, local_dir=bundle_dir)
+    print(f"Downloading {name} from {blob.name} (generation {blob.generation})...")
+    payload = backend.read_bytes(blob.name, generation=blob.generation)
+    with timed_span("unpickle", artifact=name):
+        if name == "model":
+            return joblib.load(io.BytesIO(payload))
+        if name == "kernel":
+            return load_scoring_kernel(payload)
+        if name == "encoder":
+            return load_encoder_payload(payload, blob.name)
+        return pickle.loads(payload)
+
+
+def load_model_artifacts(backend, blobs: dict, bundle_dir: str = None) -> dict:
+    """Function to load the blobs of resolve_model_artifact_blobs into model, scaler, encoder and kernel, outside the cache."""
+
+    artifacts = {name: _load_artifact(backend, name, blob, bundle_dir) for name, blob in blobs.items()}
+    if "bundle" in artifacts:
+        artifacts.update(artifacts["bundle"])
+    return artifacts
+
+
+def _refresh_prod_artifacts(location: tuple, refresh_interval: float, force: bool = False, verify: bool = False):
+    """Function to revalidate the production artifacts and swap in a new bundle when any blob generation changed.
+
+    Changed artifacts are downloaded without holding the cache lock, so requests keep being
+    served from the current bundle until the new one is complete; the bundle is then replaced
+    as a whole. verify test-scores a new bundle first and keeps the current one if that fails.
+    """
+
+    project_id, bucket_name, prod_model_folder_path, processed_data_folder_path = location
+    # One reload at a time; requests waiting here find the bundle it loaded.
+    with _artifact_reload_lock:
+        with _artifact_cache_lock:
+            cache = dict(_artifact_cache)
+        is_fresh = (time.monotonic() - cache["validated_at"]) < refresh_interval
+        if not force and cache["location"] == location and cache["artifacts"] and is_fresh:
+            with _artifact_cache_lock:
+                _artifact_cache_stats["hits"] += 1
+            return cache["artifacts"]
+
+        backend = get_storage_backend(project_id, bucket_name)
+        blobs = resolve_prod_artifact_blobs(backend, prod_model_folder_path, processed_data_folder_path)
+
+        if cache["location"] != location:
+            cache["generations"] = {}
+            cache["artifacts"] = {}
+        # Only keep what the current blobs still consist of, e.g. when switching to or from a bundle.
+        generations = {name: key for name, key in cache["generations"].items() if name in blobs}
+        artifacts = {name: artifact for name, artifact in cache["artifacts"].items() if name in blobs}
+        reloaded = 0
+        for name, blob in blobs.items():
+            blob_key = (blob.name, blob.generation) if blob is not None else (None, None)
+            if generations.get(name) == blob_key and name in artifacts:
+                continue
+            artifacts[name] = _load_artifact(backend, name, blob)
+            generations[name] = blob_key
+            reloaded += 1
+        if "bundle" in artifacts:
+            # Requests use the model, scaler, encoder and kernel of the bundle like separately loaded ones.
+            artifacts.update(artifacts["bundle"])
+
+        if reloaded and verify:
+            test_score_artifacts(artifacts)
+
+        with _artifact_cache_lock:
+            _artifact_cache_stats["revalidations"] += 1
+            if reloaded:
+                _artifact_cache_stats["misses"] += 1
+                _artifact_cache_stats["reloads"] += reloaded
+            else:
+                _artifact_cache_stats["hits"] += 1
+            _artifact_cache["location"] = location
+            _artifact_cache["generations"] = generations
+            _artifact_cache["artifacts"] = artifacts
+            _artifact_cache["model_version"] = hashlib.sha1(repr(sorted(generations.items())).encode()).hexdigest()[:16]
+            _artifact_cache["validated_at"] = time.monotonic()
+        if reloaded:
+            print(f"Artifact cache reloaded {reloaded} artifact(s): {generations}")
+            if "bundle" in blobs:
+                remove_stale_bundle_copies(blobs["bundle"].generation)
+        return artifacts
+
+
+def _get_prod_artifacts(
         project_id: str,
         bucket_name: str,
         prod_model_folder_path: str,
         processed_data_folder_path: str,
-        userInput_df: pd.DataFrame):
-    
-    """Function to make predictions using a pre-trained model."""
-    
-    print("--- Configuration ---")
-    print(f"Project ID: {project_id}")
-    print(f"Bucket Name: {bucket_name}")
-    print(f"Prod Model Folder Path: {prod_model_folder_path}")
-    print(f"Processed Data Folder Path: {processed_data_folder_path}")
-    print("---------------------")
+        refresh_interval: float = None):
 
-    try:
-        # Load the pre-trained model from GCS
-        storage_client = storage.Client(project=project_id)
-        bucket = storage_client.bucket(bucket_name)
+    """Function to get all production artifacts from the in-process cache, revalidating when stale.
+
+    While the artifact watcher runs in this process it keeps the bundle current, so requests
+    never revalidate or download themselves.
+    """
+
+    if refresh_interval is None:
+        refresh_interval = ARTIFACT_CACHE_REFRESH_SECONDS
+    location = (project_id, bucket_name, prod_model_folder_path, processed_data_folder_path)
+
+    with _artifact_cache_lock:
+        artifacts = _artifact_cache["artifacts"]
+        is_current = _artifact_cache["location"] == location and artifacts
+        is_fresh = (time.monotonic() - _artifact_cache["validated_at"]) < refresh_interval
+        if is_current and (is_fresh or _is_artifact_watcher_running(location)):
+            _artifact_cache_stats["hits"] += 1
+            return artifacts
+
+    return _refresh_prod_artifacts(location, refresh_interval)
+
+
+def load_prod_artifacts(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        refresh_interval: float = None):
+
+    """Function to get the production model, scaler and encoder from the in-process cache."""
+
+    artifacts = _get_prod_artifacts(
+        project_id, bucket_name, prod_model_folder_path, processed_data_folder_path, refresh_interval
+    )
+    return artifacts["model"], artifacts["scaler"], artifacts["encoder"]
+
+
+def load_prod_scoring_kernel(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        refresh_interval: float = None):
 
-        blobs = bucket.list_blobs(prefix=prod_model_folder_path)
-        model_blob_name = [blob.name for blob in blobs if blob.name.endswith('.joblib')][0]
-        print(f"model_blob_name: {model_blob_name}")
+    """Function to get the production scoring kernel from the in-process cache, None if none is published."""
 
-        model_blob = bucket.blob(model_blob_name)
+    artifacts = _get_prod_artifacts(
+        project_id, bucket_name, prod_model_folder_path, processed_data_folder_path, refresh_interval
+    )
+    return artifacts["kernel"]
 
-        print("Downloading model file...")
-        local_file_path = "modelFile.joblib"
 
-        with open(local_file_path, "wb") as file:
-            model_blob.download_to_file(file)
+def get_prod_model_version(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        refresh_interval: float = None):
+
+    """Function to get an identifier of the production artifacts served, which changes whenever any of them is replaced."""
+
+    _get_prod_artifacts(
+        project_id, bucket_name, prod_model_folder_path, processed_data_folder_path, refresh_interval
+    )
+    with _artifact_cache_lock:
+        return _artifact_cache["model_version"]
+
+
+def get_artifact_cache_stats():
+    """Function to get the artifact cache counters and the cached blob generations."""
+
+    with _artifact_cache_lock:
+        stats = dict(_artifact_cache_stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["refresh_interval_seconds"] = ARTIFACT_CACHE_REFRESH_SECONDS
+        stats["generations"] = {
+            name: {"blob": blob_name, "generation": generation}
+            for name, (blob_name, generation) in _artifact_cache["generations"].items()
+        }
+        return stats
+
 
-        model = joblib.load(local_file_path)
-        print("Model loaded successfully for prediction.")
+def clear_artifact_cache():
+    """Function to drop all cached artifacts so the next call reloads them."""
 
-        #load scaler and encoder
-        scalar_path = f"{processed_data_folder_path}scaler.pkl"
-        encoder_path = f"{processed_data_folder_path}encoder.pkl"
-        print(f"Loading scaler from {scalar_path}")
-        print(f"Loading encoder from {encoder_path}")
+    with _artifact_cache_lock:
+        _artifact_cache["location"] = None
+        _artifact_cache["validated_at"] = 0.0
+        _artifact_cache["generations"] = {}
+        _artifact_cache["artifacts"] = {}
+        _artifact_cache["model_version"] = None
 
-        scalar_blob = bucket.blob(scalar_path)
-        local_file_path = "scalerFile.pkl"
 
-        with open(local_file_path, "wb") as file:
-            scalar_blob.download_to_file(file)
+def test_score_artifacts(artifacts: dict):
+    """Function to score one synthetic row with a loaded bundle, raising if the model, scaler, encoder or kernel cannot."""
 
-        with open(local_file_path, "rb") as file:
-            preloaded_scaler = pickle.load(file)
+    encoder = artifacts["encoder"]
+    column_classes = encoder.column_classes_
+    row = {}
+    for col, dtype in INPUT_DTYPE_MAPPING.items():
+        if dtype == 'category':
+            row[col] = [column_classes[col][0]] if col in column_classes else ["unknown"]
+        else:
+            row[col] = [1]
+    sample_df = pd.DataFrame(row).astype(INPUT_DTYPE_MAPPING)
 
-        print("scaler loaded successfully for prediction.")
+    processed_input, scaler1, encoder1 = preprocess_data(
+        df=sample_df,
+        input_scalar=artifacts["scaler"],
+        input_encoder=encoder
+    )
+    predictions = artifacts["model"].predict(processed_input.drop('Churn', axis=1))
+    if len(predictions) != 1:
+        raise ValueError(f"Test scoring returned {len(predictions)} predictions for 1 row.")
+    if artifacts["kernel"] is not None:
+        kernel_predictions, probabilities, valid = score_with_kernel(
+            artifacts["kernel"], {col: sample_df[col].to_numpy() for col in sample_df.columns}
+        )
+        if not valid.all():
+            raise ValueError("Scoring kernel rejected the test row.")
+
+
+def _is_artifact_watcher_running(location: tuple) -> bool:
+    watcher = _artifact_watcher
+    return (
+        watcher["pid"] == os.getpid()
+        and watcher["location"] == location
+        and watcher["thread"] is not None
+        and watcher["thread"].is_alive()
+    )
+
+
+def _watch_prod_artifacts(location: tuple, interval: float):
+    """Function run by the artifact watcher thread: revalidate every interval and swap in verified new bundles."""
 
-        encoder_blob = bucket.blob(encoder_path)
-        local_file_path = "encoderFile.pkl"
+    while True:
+        time.sleep(interval)
+        try:
+            _refresh_prod_artifacts(location, interval, force=True, verify=True)
+            _set_ready()
+        except Exception as e:
+            # The current bundle stays in service.
+            print(f"ERROR: Artifact watcher failed to refresh the production artifacts. Details: {e}")
 
-        with open(local_file_path, "wb") as file:
-            encoder_blob.download_to_file(file)
 
-        with open(local_file_path, "rb") as file:
-            preloaded_encoder = pickle.load(file)
+def _set_ready(error: str = None):
+    """Function to record the outcome of a warmup; once ready, a process stays ready on its current bundle."""
 
-        print("encoder loaded successfully for prediction.")
+    with _artifact_cache_lock:
+        if error is None and _artifact_cache["artifacts"] and not _readiness["ready"]:
+            _readiness["ready"] = True
+            _readiness["warmed_up_at"] = time.time()
+        _readiness["error"] = error
 
-        print(f"user input data:{userInput_df}")
+
+def warm_up_prod_artifacts(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        interval: float = None):
+
+    """Function to load and test-score the production artifacts, then start the artifact watcher thread.
+
+    Readiness is reported once a bundle has passed the test scoring. The watcher is started
+    even when the warmup fails (e.g. no model is published yet), and makes the process ready
+    as soon as it loads one. Once per process; a forked process starts its own watcher. With
+    a refresh interval of 0 no watcher is started and every request revalidates instead.
+    """
+
+    interval = ARTIFACT_CACHE_REFRESH_SECONDS if interval is None else interval
+    location = (project_id, bucket_name, prod_model_folder_path, processed_data_folder_path)
+    with _artifact_cache_lock:
+        if _artifact_watcher["pid"] == os.getpid() and _artifact_watcher["location"] == location:
+            return _readiness["ready"]
+        _artifact_watcher.update(pid=os.getpid(), location=location, thread=None)
+
+    try:
+        start = time.perf_counter()
+        with timed_span("warmup"):
+            artifacts = _refresh_prod_artifacts(location, interval, force=True)
+            test_score_artifacts(artifacts)
+        _set_ready()
+        print(f"Production artifacts warmed up in {time.perf_counter() - start:.3f}s.")
+    except Exception as e:
+        _set_ready(error=f"{type(e).__name__}: {e}")
+        print(f"ERROR: Failed to warm up the production artifacts. Details: {e}")
+
+    if interval > 0:
+        thread = threading.Thread(target=_watch_prod_artifacts, args=(location, interval), name="artifact-watcher", daemon=True)
+        thread.start()
+        _artifact_watcher["thread"] = thread
+    return _readiness["ready"]
+
+
+def get_readiness():
+    """Function to get whether the production artifacts are loaded and verified, with the served model version."""
+
+    with _artifact_cache_lock:
+        readiness = dict(_readiness)
+        readiness["model_version"] = _artifact_cache["model_version"]
+        readiness["watcher_running"] = _is_artifact_watcher_running(_artifact_watcher["location"])
+        return readiness
+
+
+def predict_using_pretrained_model(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        userInput_df: pd.DataFrame):
+    
+    """Function to make predictions using a pre-trained model."""
+    
+    print("--- Configuration ---")
+    print(f"Project ID: {project_id}")
+    print(f"Bucket Name: {bucket_name}")
+    print(f"Prod Model Folder Path: {prod_model_folder_path}")
+    print(f"Processed Data Folder Path: {processed_data_folder_path}")
+    print("---------------------")
+
+    try:
+        # Load the pre-trained model, scaler and encoder (served from the in-process cache)
+        model, preloaded_scaler, preloaded_encoder = load_prod_artifacts(
+            project_id=project_id,
+            bucket_name=bucket_name,
+            prod_model_folder_path=prod_model_folder_path,
+            processed_data_folder_path=processed_data_folder_path
+        )
+        print("Model, scaler and encoder loaded successfully for prediction.")
+
+        print_dataframe("user input data:", userInput_df)
         #preprocess user input
         processed_input, scaler1,encoder1 = preprocess_data(
             df=userInput_df, 
@@ -77,13 +452,189 @@ def predict_using_pretrained_model(
             input_encoder=preloaded_encoder
         )
         processed_input = processed_input.drop('Churn', axis=1)
-        print(f"Processed user input data:{processed_input}")
+        print_dataframe("Processed user input data:", processed_input)
 
         # Make predictions
-        predictions = model.predict(processed_input)
+        with timed_span("predict", path="sklearn"):
+            predictions = model.predict(processed_input)
+        increment_counter("churn_predictions_total", len(predictions), path="sklearn")
         print(f"Predictions made successfully. Predictions: {predictions}")
         return userInput_df, processed_input, predictions
     except Exception as e:
         print(f"ERROR: Failed to make predictions. Details: {e}")
         return pd.DataFrame(), pd.DataFrame(), None
-    
\ No newline at end of file
+
+
+def predict_using_scoring_kernel(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        input_columns: dict):
+
+    """Function to score raw input columns with the production scoring kernel.
+
+    Returns predictions, probabilities and the valid row mask, or None when the
+    production model was published without a scoring kernel (or scoring failed),
+    in which case callers fall back to predict_using_pretrained_model.
+    """
+
+    try:
+        kernel = load_prod_scoring_kernel(
+            project_id=project_id,
+            bucket_name=bucket_name,
+            prod_model_folder_path=prod_model_folder_path,
+            processed_data_folder_path=processed_data_folder_path
+        )
+        if kernel is None:
+            return None
+        with timed_span("predict", path="kernel"):
+            predictions, probabilities, valid = score_with_kernel(kernel, input_columns)
+        increment_counter("churn_predictions_total", int(valid.sum()), path="kernel")
+        return predictions, probabilities, valid
+    except Exception as e:
+        print(f"ERROR: Failed to make predictions with the scoring kernel. Details: {e}")
+        return None
+
+
+def predict_columns_using_pretrained_model(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        input_columns: dict):
+
+    """Function to score typed input columns (name -> 1-D array) with the production model and preprocess_data.
+
+    The fallback of predict_using_scoring_kernel for models published without a scoring
+    kernel, with the same result: predictions, probabilities (NaN when the model has no
+    predict_proba) and the valid row mask; None when scoring failed.
+    """
+
+    try:
+        artifacts = _get_prod_artifacts(
+            project_id, bucket_name, prod_model_folder_path, processed_data_folder_path
+        )
+        size = len(next(iter(input_columns.values())))
+        # The row position stands in for CustomerID: no row is dropped as a duplicate of
+        # another one and every result maps back to its row.
+        chunk = pd.DataFrame({col: values for col, values in input_columns.items() if col != 'CustomerID'})
+        chunk['CustomerID'] = np.arange(size)
+        result = score_input_chunk(artifacts, chunk)
+
+        valid = np.zeros(size, dtype=bool)
+        predictions = np.zeros(size, dtype=np.int64)
+        probabilities = np.full(size, np.nan)
+        if result is not None:
+            positions = result['CustomerID'].to_numpy()
+            valid[positions] = True
+            predictions[positions] = result['Prediction'].to_numpy()
+            if 'Probability' in result.columns:
+                probabilities[positions] = result['Probability'].to_numpy()
+        return predictions, probabilities, valid
+    except Exception as e:
+        print(f"ERROR: Failed to make predictions. Details: {e}")
+        return None
+
+
+def predict_batch_using_pretrained_model(
+        project_id: str,
+        bucket_name: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        input_chunks,
+        stats: dict = None):
+
+    """Function to score an iterable of input DataFrame chunks with the production model.
+
+    Artifacts are resolved once up front; the returned generator then yields one
+    result DataFrame (CustomerID, Prediction, Probability) per input chunk, so
+    only a single chunk is held in memory at a time. Chunks are scored with the
+    scoring kernel when one is published, otherwise with preprocess_data + sklearn.
+    The number of input records and predictions is added up in stats, if given.
+    """
+
+    stats = stats if stats is not None else {}
+    stats.setdefault("records", 0)
+    stats.setdefault("predictions", 0)
+
+    artifacts = _get_prod_artifacts(
+        project_id, bucket_name, prod_model_folder_path, processed_data_folder_path
+    )
+
+    def score_chunks():
+        for chunk in input_chunks:
+            if chunk.empty is True:
+                continue
+            stats["records"] += len(chunk)
+            result = score_input_chunk(artifacts, chunk)
+            if result is not None:
+                stats["predictions"] += len(result)
+                yield result
+
+    return score_chunks()
+
+
+def select_input_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Function to select the raw input columns of a request, filling in the Churn label, before the cast to INPUT_DTYPE_MAPPING."""
+
+    # Churn is a label, callers scoring new customers do not have it.
+    df = df.assign(Churn=df['Churn'].fillna(0) if 'Churn' in df.columns else 0)
+    missing_columns = [col for col in INPUT_DTYPE_MAPPING if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+    return df[list(INPUT_DTYPE_MAPPING)]
+
+
+def score_input_chunk(artifacts: dict, chunk: pd.DataFrame):
+    """Function to score one raw input DataFrame with loaded artifacts, returning CustomerID, Prediction and Probability.
+
+    Scores with the scoring kernel when there is one, otherwise with preprocess_data +
+    sklearn. Returns None when no row of the chunk is valid.
+    """
+
+    model, preloaded_scaler, preloaded_encoder = artifacts["model"], artifacts["scaler"], artifacts["encoder"]
+    kernel = artifacts["kernel"]
+
+    # Rows with missing values are dropped before the cast, like preprocess_data does;
+    # one empty integer cell would otherwise fail the whole chunk.
+    chunk = select_input_columns(chunk).dropna()
+    if chunk.empty is True:
+        return None
+    chunk = chunk.astype(INPUT_DTYPE_MAPPING)
+
+    if kernel is not None:
+        with timed_span("predict", path="batch_kernel"):
+            predictions, probabilities, valid = score_with_kernel(
+                kernel, {col: chunk[col].to_numpy() for col in chunk.columns}
+            )
+        result = pd.DataFrame({
+            'CustomerID': chunk['CustomerID'].to_numpy()[valid],
+            'Prediction': predictions[valid],
+            'Probability': probabilities[valid],
+        })
+        increment_counter("churn_predictions_total", len(result), path="batch_kernel")
+        print(f"Scored batch chunk of {len(chunk)} records with the scoring kernel, {len(result)} predictions.")
+        return result
+
+    processed_input, scaler1, encoder1 = preprocess_data(
+        df=chunk,
+        input_scalar=preloaded_scaler,
+        input_encoder=preloaded_encoder
+    )
+    if processed_input.empty is True:
+        return None
+    processed_input = processed_input.drop('Churn', axis=1)
+
+    # preprocess_data keeps the input index, so rows dropped as invalid or
+    # duplicate are simply absent from the result.
+    with timed_span("predict", path="batch_sklearn"):
+        result = pd.DataFrame({
+            'CustomerID': chunk.loc[processed_input.index, 'CustomerID'].to_numpy(),
+            'Prediction': model.predict(processed_input),
+        })
+        if hasattr(model, 'predict_proba'):
+            result['Probability'] = model.predict_proba(processed_input)[:, 1]
+    increment_counter("churn_predictions_total", len(result), path="batch_sklearn")
+    print(f"Scored batch chunk of {len(chunk)} records, {len(result)} predictions.")
+    return result
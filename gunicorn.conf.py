@@ -0,0 +1,58 @@
+import os
+import gc
+import multiprocessing
+from dotenv import load_dotenv
+
+# Production serving: gunicorn preforks GUNICORN_WORKERS worker processes (default one per
+# core), each serving GUNICORN_THREADS requests at a time. The app is imported and the
+# production artifacts and score index are loaded once in the master, before the workers
+# are forked, so every worker starts warm and shares the loaded model pages copy-on-write
+# instead of loading its own copy. gc.freeze() keeps the garbage collector from touching
+# (and so copying) those pages in the workers. Threads do not survive a fork, so every
+# worker starts its own artifact watcher and score index refresher after the fork.
+# Background job state is kept in the bucket (jobs.py), so the workers share /jobs, the
+# coalescing of duplicate submissions and the JOB_MAX_WORKERS limit.
+#
+#     gunicorn app:app
+#
+# picks this file up from the working directory. A HUP signal restarts the workers
+# gracefully; workers are also recycled after GUNICORN_MAX_REQUESTS requests (0, never).
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# Batch predictions stream for as long as their input, so requests get more than the default 30s.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+accesslog = "-"
+# Worker heartbeats go to memory instead of a container overlay filesystem.
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+# The warmup is started by the hooks below instead of when app.py is imported.
+os.environ["SERVING_WARMUP_ON_IMPORT"] = "0"
+SERVING_WARMUP = os.getenv("SERVING_WARMUP", "1") != "0"
+
+
+def on_starting(server):
+    if not preload_app:
+        return
+    if SERVING_WARMUP:
+        from app import preload_serving_artifacts
+        preload_serving_artifacts()
+    # Everything allocated so far is shared with the workers; keep the collector off it.
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if SERVING_WARMUP:
+        # Finds the artifacts inherited from the master in place and only starts the threads.
+        from app import start_serving_warmup
+        start_serving_warmup()
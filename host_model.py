@@ -1,13 +1,21 @@
 import pandas as pd
-from google.cloud import storage
+from storage_backend import get_storage_backend, StorageObject
+from model_registry import get_registered_version, get_model_version_id, record_promotion
+from metrics import print_dataframe
 
 def get_model_evaluation_metrics(
         project_id: str,
         bucket_name: str,
         model_folder_path: str,
+        registry_pointer: str = None,
     ):
 
-    """Function to load model evaluation data from GCS bucket."""
+    """Function to load model evaluation data from storage.
+
+    With registry_pointer (latest or production) the evaluation of the version the model
+    registry points at is read directly; the folder is only scanned for the most recent
+    evaluation when the registry does not know that pointer yet.
+    """
     if not all([project_id, bucket_name, model_folder_path]):
         print("Error: Missing one or more required environment variables.")
         return pd.DataFrame()
@@ -19,26 +27,34 @@ def get_model_evaluation_metrics(
     print("---------------------")
 
     try:
-        #1. Read most recent evaluation CSV files from the specified GCS folder
-        storage_client = storage.Client(project=project_id)
-        bucket = storage_client.bucket(bucket_name)
-        blobs = bucket.list_blobs(prefix=model_folder_path)
-        
+        #1. Read most recent evaluation CSV files from the specified folder
+        backend = get_storage_backend(project_id, bucket_name)
         latest_blob = None
-        latest_creation_time = None
-        for blob in blobs:
-            if blob.name.endswith(".csv"):
-                if latest_blob is None or blob.time_created > latest_creation_time:
-                    latest_blob = blob
-                    latest_creation_time = blob.time_created
+        if registry_pointer is not None:
+            version_id, entry = get_registered_version(backend, registry_pointer)
+            artifacts = entry and entry["stage" if registry_pointer == "latest" else "prod"]
+            if artifacts and artifacts["evaluation"]:
+                evaluation = artifacts["evaluation"]
+                latest_blob = StorageObject(name=evaluation["name"], size=None, generation=evaluation["generation"])
+                print(f"Model registry {registry_pointer} version: {version_id}")
 
         if latest_blob is None:
-            print(f"No model evaluation CSV files found in GCS folder: {model_folder_path}")
+            blobs = backend.list(model_folder_path)
+            latest_creation_time = None
+            for blob in blobs:
+                if blob.name.endswith(".csv"):
+                    if latest_blob is None or blob.time_created > latest_creation_time:
+                        latest_blob = blob
+                        latest_creation_time = blob.time_created
+
+        if latest_blob is None:
+            print(f"No model evaluation CSV files found in folder: {model_folder_path}")
             return True, pd.DataFrame(), None
         
-        df = pd.read_csv(f"gs://{bucket_name}/{latest_blob.name}")
+        with backend.open_read(latest_blob.name, generation=latest_blob.generation) as file:
+            df = pd.read_csv(file)
         print(f"Loaded model evaluation data from {latest_blob.name}.")
-        print(f"Loaded Model Evaluation Data:\n{df}")
+        print_dataframe("Loaded Model Evaluation Data:\n", df)
         return True, df, latest_blob
     except Exception as e:
         print(f"ERROR: Failed to load model evaluation data from {model_folder_path}. Details: {e}")
@@ -80,16 +96,35 @@ def move_model_from_stage_to_prod(
         print(f"Prod Eval Blob Name: {prod_eval_blob_name}")
         print(f"Prod Model Blob Name: {prod_model_blob_name}")
 
-        storage_client = storage.Client(project=project_id)
-        bucket = storage_client.bucket(bucket_name)
-        stage_model_blob = bucket.blob(stage_model_blob_name)
+        backend = get_storage_backend(project_id, bucket_name)
 
-        bucket.copy_blob(stage_model_blob, bucket, prod_model_blob_name)
+        prod_artifacts = {"kernel": None, "bundle": None}
+        prod_artifacts["model"] = backend.copy(stage_model_blob_name, prod_model_blob_name)
         print(f"Moved model file from {stage_model_blob_name} to {prod_model_blob_name}")
         
-        bucket.copy_blob(stage_eval_blob, bucket, prod_eval_blob_name)
+        # The scoring kernel is optional, models exported without one are served by sklearn.
+        stage_kernel_blob_name = stage_eval_blob_name.replace("_evaluation_", "_kernel_").replace(".csv", ".npz")
+        if backend.stat(stage_kernel_blob_name) is not None:
+            prod_kernel_blob_name = stage_kernel_blob_name.replace("stage", "prod")
+            prod_artifacts["kernel"] = backend.copy(stage_kernel_blob_name, prod_kernel_blob_name)
+            print(f"Moved scoring kernel from {stage_kernel_blob_name} to {prod_kernel_blob_name}")
+
+        # So is the model bundle; serving falls back to the model, scaler and encoder files without it.
+        stage_bundle_blob_name = stage_eval_blob_name.replace("_evaluation_", "_bundle_").replace(".csv", ".bundle")
+        if backend.stat(stage_bundle_blob_name) is not None:
+            prod_bundle_blob_name = stage_bundle_blob_name.replace("stage", "prod")
+            prod_artifacts["bundle"] = backend.copy(stage_bundle_blob_name, prod_bundle_blob_name)
+            print(f"Moved model bundle from {stage_bundle_blob_name} to {prod_bundle_blob_name}")
+
+        # Serving without a registry follows the latest production evaluation, so it is copied last, once the model files are in place.
+        prod_artifacts["evaluation"] = backend.copy(stage_eval_blob_name, prod_eval_blob_name)
         print(f"Moved evaluation file from {stage_eval_blob.name} to {prod_eval_blob_name}")
 
+        # Switching the production pointer is what makes serving pick the new model up.
+        version_id = get_model_version_id(stage_eval_blob_name)
+        record_promotion(backend, version_id, prod_artifacts)
+        print(f"Model registry production version: {version_id}")
+
         # Donot deleet, keep it for backup.
 
         return True, "Model and evaluation files moved successfully.", prod_model_blob_name
@@ -119,7 +154,7 @@ def compare_model_performances(
                 print(f"for measure {metric}, Production model is NOT better than satge model. Not promoting the model.")
                 return False, f"for measure {metric}, Production model is NOT better than satge model. Not promoting the model."
         
-        print(f"Model Performance Comparison:\n{df_result}")
+        print_dataframe("Model Performance Comparison:\n", df_result)
         return True, "Production model performance is better than stage model performance."
 
     except Exception as e:
@@ -0,0 +1,255 @@
+import json
+
+from load_data import list_raw_files, load_raw_files
+from preprocess_data import preprocess_data, save_processed_data, load_scalar, load_encoder
+from categorical_encoding import ENCODER_FILE_NAME
+from storage_backend import get_storage_backend
+
+# The ingestion manifest records, for every raw blob that has been processed, the generation
+# and checksum it had and the processed file its records ended up in. A full rebuild folds all
+# raw files into the base processed file; incremental runs append one partition per new raw
+# file under <processed folder>/partitions/, preprocessed with the scaler and encoder of the
+# last full rebuild.
+MANIFEST_FILE_NAME = "ingestion_manifest.json"
+MANIFEST_VERSION = 1
+PARTITIONS_FOLDER_NAME = "partitions/"
+
+
+def empty_ingestion_manifest() -> dict:
+    """Function to create a manifest with no processed files."""
+
+    return {
+        "version": MANIFEST_VERSION,
+        "base": None,
+        "scaler_generation": None,
+        "encoder_generation": None,
+        "partitions": [],
+        "files": {},
+    }
+
+
+def load_ingestion_manifest(
+        project_id: str,
+        bucket_name: str,
+        processed_data_folder_path: str):
+    """Function to load the ingestion manifest from storage, an empty manifest if none was written yet."""
+
+    backend = get_storage_backend(project_id, bucket_name)
+    try:
+        return json.loads(backend.read_bytes(f"{processed_data_folder_path}{MANIFEST_FILE_NAME}"))
+    except FileNotFoundError:
+        return empty_ingestion_manifest()
+
+
+def save_ingestion_manifest(
+        project_id: str,
+        bucket_name: str,
+        processed_data_folder_path: str,
+        manifest: dict):
+    """Function to save the ingestion manifest to storage."""
+
+    backend = get_storage_backend(project_id, bucket_name)
+    blob_name = f"{processed_data_folder_path}{MANIFEST_FILE_NAME}"
+    try:
+        backend.write_bytes(blob_name, json.dumps(manifest, indent=2).encode(), content_type="application/json")
+        return True, f"SUCCESS: Ingestion manifest saved to {backend.uri(blob_name)}"
+    except Exception as e:
+        return False, f"ERROR: Failed to save ingestion manifest to {backend.uri(blob_name)}. Details: {e}"
+
+
+def raw_file_fingerprint(blob) -> dict:
+    """Function to describe the version of a raw blob as recorded in the manifest."""
+
+    return {"generation": str(blob.generation), "md5": blob.md5_hash, "size": blob.size}
+
+
+def partition_blob_name(raw_blob_name: str, raw_data_folder_path: str, processed_data_folder_path: str, file_name: str) -> str:
+    """Function to derive the processed partition blob name of a raw file."""
+
+    stem = raw_blob_name[len(raw_data_folder_path):] if raw_blob_name.startswith(raw_data_folder_path) else raw_blob_name
+    stem = stem[:-len(".csv")].replace("/", "__")
+    extension = file_name.rsplit(".", 1)[-1]
+    return f"{processed_data_folder_path}{PARTITIONS_FOLDER_NAME}processed_data_{stem}.{extension}"
+
+
+def get_processed_partition_paths(bucket_name: str, manifest: dict) -> list:
+    """Function to get the gs:// paths of the incremental partitions listed in the manifest."""
+
+    return [f"gs://{bucket_name}/{partition}" for partition in manifest["partitions"]]
+
+
+def plan_incremental_ingestion(manifest: dict, csv_blobs: list, scaler_generation, encoder_generation) -> dict:
+    """Function to work out which raw files an incremental run has to process.
+
+    Files whose records live in the base processed file cannot be replaced in place, so
+    changing or removing one of them (or refitting the scaler / encoder) requires a full
+    rebuild, reported in full_rebuild_reason.
+    """
+
+    plan = {"to_process": [], "unchanged": [], "removed_partitions": [], "full_rebuild_reason": None}
+
+    if manifest["base"] is None:
+        plan["full_rebuild_reason"] = "No full build is recorded in the ingestion manifest."
+        return plan
+    if (manifest["scaler_generation"], manifest["encoder_generation"]) != (str(scaler_generation), str(encoder_generation)):
+        plan["full_rebuild_reason"] = "Scaler or encoder changed since the last full build."
+        return plan
+
+    listed_names = set()
+    for blob in csv_blobs:
+        listed_names.add(blob.name)
+        entry = manifest["files"].get(blob.name)
+        if entry is None:
+            plan["to_process"].append(blob)
+            continue
+        fingerprint = raw_file_fingerprint(blob)
+        if (entry["generation"], entry["md5"]) == (fingerprint["generation"], fingerprint["md5"]):
+            plan["unchanged"].append(blob.name)
+        elif entry["partition"] == manifest["base"]:
+            plan["full_rebuild_reason"] = f"{blob.name} changed after it was folded into the base processed data."
+            return plan
+        else:
+            plan["to_process"].append(blob)
+
+    for name, entry in manifest["files"].items():
+        if name in listed_names:
+            continue
+        if entry["partition"] == manifest["base"]:
+            plan["full_rebuild_reason"] = f"{name} was removed after it was folded into the base processed data."
+            return plan
+        plan["removed_partitions"].append(entry["partition"])
+
+    return plan
+
+
+def _get_generation(backend, blob_name: str):
+    """Function to get the current generation of a blob, None if it does not exist."""
+
+    blob = backend.stat(blob_name)
+    return None if blob is None else blob.generation
+
+
+def record_full_rebuild(
+        project_id: str,
+        bucket_name: str,
+        processed_data_folder_path: str,
+        csv_blobs: list,
+        base_file_name: str,
+        ingestion_report: list):
+    """Function to reset the manifest after a full rebuild folded csv_blobs into the base file.
+
+    Partitions of earlier incremental runs are deleted since their records are now in the base.
+    """
+
+    try:
+        previous_manifest = load_ingestion_manifest(project_id, bucket_name, processed_data_folder_path)
+        backend = get_storage_backend(project_id, bucket_name)
+
+        base = f"{processed_data_folder_path}{base_file_name}"
+        records = {report["file"]: report["records"] for report in ingestion_report}
+        manifest = empty_ingestion_manifest()
+        manifest["base"] = base
+        manifest["scaler_generation"] = str(_get_generation(backend, f"{processed_data_folder_path}scaler.pkl"))
+        manifest["encoder_generation"] = str(_get_generation(backend, f"{processed_data_folder_path}{ENCODER_FILE_NAME}"))
+        for blob in csv_blobs:
+            manifest["files"][blob.name] = dict(raw_file_fingerprint(blob), partition=base, records=records.get(blob.name))
+
+        for partition in previous_manifest["partitions"]:
+            if partition != base:
+                backend.delete(partition)
+                print(f"Deleted stale partition {partition}.")
+
+        return save_ingestion_manifest(project_id, bucket_name, processed_data_folder_path, manifest)
+    except Exception as e:
+        return False, f"ERROR: Failed to record full rebuild in the ingestion manifest. Details: {e}"
+
+
+def run_incremental_ingestion(
+        project_id: str,
+        bucket_name: str,
+        raw_data_folder_path: str,
+        processed_data_folder_path: str,
+        file_name: str):
+    """Function to preprocess only new or changed raw files into processed partitions.
+
+    Returns (outcome, messages, needs_full_rebuild). When needs_full_rebuild is True nothing
+    was written and the caller has to run the full load and preprocess instead.
+    """
+
+    messages = []
+    try:
+        manifest = load_ingestion_manifest(project_id, bucket_name, processed_data_folder_path)
+        csv_blobs = list_raw_files(project_id, bucket_name, raw_data_folder_path)
+
+        backend = get_storage_backend(project_id, bucket_name)
+        scaler_generation = _get_generation(backend, f"{processed_data_folder_path}scaler.pkl")
+        encoder_generation = _get_generation(backend, f"{processed_data_folder_path}{ENCODER_FILE_NAME}")
+
+        plan = plan_incremental_ingestion(manifest, csv_blobs, scaler_generation, encoder_generation)
+        if plan["full_rebuild_reason"] is not None:
+            messages.append(f"Full rebuild required: {plan['full_rebuild_reason']}")
+            return True, messages, True
+
+        messages.append(
+            f"Found {len(csv_blobs)} raw files: {len(plan['to_process'])} new or changed, "
+            f"{len(plan['unchanged'])} unchanged, {len(plan['removed_partitions'])} removed."
+        )
+
+        if not plan["to_process"] and not plan["removed_partitions"]:
+            messages.append("No new or changed raw files, processed data is up to date.")
+            return True, messages, False
+
+        if plan["to_process"]:
+            scaler_outcome, scaler_msg, scaler = load_scalar(project_id, bucket_name, processed_data_folder_path)
+            encoder_outcome, encoder_msg, encoder = load_encoder(project_id, bucket_name, processed_data_folder_path)
+            if scaler_outcome is False or encoder_outcome is False:
+                messages.extend([msg for outcome, msg in ((scaler_outcome, scaler_msg), (encoder_outcome, encoder_msg)) if outcome is False])
+                return False, messages, False
+
+            raw_data = load_raw_files(project_id, bucket_name, plan["to_process"])
+            processed_data, scaler, encoder = preprocess_data(df=raw_data, input_scalar=scaler, input_encoder=encoder, log_memory=True)
+
+            # preprocess_data keeps the input index, so each raw file's records are a contiguous index range.
+            offset = 0
+            for blob, report in zip(plan["to_process"], raw_data.attrs["ingestion_report"]):
+                rows = processed_data.loc[(processed_data.index >= offset) & (processed_data.index < offset + report["records"])]
+                offset += report["records"]
+
+                partition = partition_blob_name(blob.name, raw_data_folder_path, processed_data_folder_path, file_name)
+                partition_folder, partition_file_name = partition.rsplit("/", 1)
+                if rows.empty is False:
+                    outcome, msg = save_processed_data(
+                        project_id=project_id,
+                        bucket_name=bucket_name,
+                        processed_data_folder_path=f"{partition_folder}/",
+                        df=rows,
+                        file_name=partition_file_name
+                    )
+                    if outcome is False:
+                        messages.append(msg)
+                        return False, messages, False
+                    if partition not in manifest["partitions"]:
+                        manifest["partitions"].append(partition)
+                elif partition in manifest["partitions"]:
+                    backend.delete(partition)
+                    manifest["partitions"].remove(partition)
+
+                manifest["files"][blob.name] = dict(raw_file_fingerprint(blob), partition=partition, records=len(rows))
+                messages.append(f"Processed {blob.name} into {partition} ({len(rows)} records).")
+
+        for partition in plan["removed_partitions"]:
+            backend.delete(partition)
+            manifest["partitions"].remove(partition)
+            messages.append(f"Deleted partition {partition} of a removed raw file.")
+        manifest["files"] = {
+            name: entry for name, entry in manifest["files"].items()
+            if entry["partition"] not in plan["removed_partitions"]
+        }
+
+        manifest["partitions"].sort()
+        outcome, msg = save_ingestion_manifest(project_id, bucket_name, processed_data_folder_path, manifest)
+        messages.append(msg)
+        return outcome, messages, False
+    except Exception as e:
+        messages.append(f"ERROR: Incremental ingestion failed. Details: {e}")
+        return False, messages, False
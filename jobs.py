@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from storage_backend import get_storage_backend
+from pipelines import run_load_and_process_data, run_train_model, run_build_score_index
+from pipeline_dag import run_pipeline_dag
+
+# Background jobs for the long running pipelines. Jobs run in a pool of worker processes,
+# so web workers return immediately and a slow training run cannot starve the prediction
+# endpoints of CPU.
+#
+# Job state is kept in the bucket, so every web worker and instance sees the same jobs:
+#   jobs/records/<job_id>.json     - the status of a job, written only by the process that
+#                                    accepted it, which refreshes heartbeat_at while it runs.
+#   jobs/active/<pipeline>-<hash>.json - the queued or running job of a pipeline and its
+#                                    parameters, created with if_generation_match="0", so a
+#                                    duplicate submission anywhere finds it and is coalesced.
+#   jobs/slots/<n>.json            - one of JOB_MAX_WORKERS run slots, taken the same way
+#                                    before a job starts, so the limit holds across processes.
+# A job whose record stops getting heartbeats for JOB_STALE_SECONDS lost its process (for
+# example a restarted web worker); it is reported as failed and its active key and slot
+# are taken over by the next submission. The last JOB_HISTORY_LIMIT jobs are kept.
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "2"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "100"))
+JOB_STATE_FOLDER_PATH = os.getenv("JOB_STATE_FOLDER_PATH", "jobs/")
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+JOB_LOCK_RETRIES = 5
+
+PIPELINES = {
+    "lnp_data": run_load_and_process_data,
+    "train": run_train_model,
+    "score_index": run_build_score_index,
+    "pipeline": run_pipeline_dag,
+}
+
+# Jobs accepted by this process, job id -> {"record", "future", "slot"}.
+_jobs_lock = threading.Lock()
+_owned_jobs = {}
+_executor = None
+_dispatcher = {"pid": None, "wake": threading.Event()}
+
+
+def _get_backend():
+    return get_storage_backend(
+        os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        os.getenv("BUCKET_NAME", "customer-churn-demo")
+    )
+
+
+def _record_name(job_id: str) -> str:
+    return f"{JOB_STATE_FOLDER_PATH}records/{job_id}.json"
+
+
+def _active_name(pipeline: str, params: dict) -> str:
+    params_hash = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{JOB_STATE_FOLDER_PATH}active/{pipeline}-{params_hash}.json"
+
+
+def _slot_name(slot: int) -> str:
+    return f"{JOB_STATE_FOLDER_PATH}slots/{slot}.json"
+
+
+def _read_json(backend, name: str):
+    """Function to read a JSON object with its generation, (None, None) if it does not exist."""
+
+    for attempt in range(JOB_LOCK_RETRIES):
+        blob = backend.stat(name)
+        if blob is None:
+            return None, None
+        try:
+            return json.loads(backend.read_bytes(name, generation=blob.generation)), blob.generation
+        except FileNotFoundError:
+            # Replaced (e.g. by a heartbeat) or deleted since the stat.
+            pass
+    return None, None
+
+
+def _write_record(backend, record: dict):
+    backend.write_bytes(_record_name(record["job_id"]), json.dumps(record).encode(), content_type="application/json")
+
+
+def _is_alive(record: dict) -> bool:
+    """Function to check if a job is queued or running in a process that still sends heartbeats."""
+
+    return record["status"] in ("queued", "running") and time.time() - record["heartbeat_at"] <= JOB_STALE_SECONDS
+
+
+def _acquire_lock(backend, name: str, job_id: str):
+    """Function to take a lock object for a job, returning (acquired, record of the live job holding it).
+
+    The lock is created with if_generation_match="0"; a lock held by a finished or lost job
+    is taken over with the generation it was read at, so only one contender wins.
+    """
+
+    payload = json.dumps({"job_id": job_id}).encode()
+    for attempt in range(JOB_LOCK_RETRIES):
+        try:
+            backend.write_bytes(name, payload, content_type="application/json", if_generation_match="0")
+            return True, None
+        except FileExistsError:
+            pass
+        holder, generation = _read_json(backend, name)
+        if holder is None:
+            continue
+        holder_record, _ = _read_json(backend, _record_name(holder["job_id"]))
+        if holder_record is not None and _is_alive(holder_record):
+            return False, holder_record
+        try:
+            backend.write_bytes(name, payload, content_type="application/json", if_generation_match=generation)
+            print(f"Took over {backend.uri(name)} from job {holder['job_id']}, which is no longer active.")
+            return True, None
+        except FileExistsError:
+            pass
+    raise RuntimeError(f"Failed to acquire {backend.uri(name)} after {JOB_LOCK_RETRIES} attempts.")
+
+
+def _release_lock(backend, name: str, job_id: str):
+    """Function to delete a lock object if it is still held by the job."""
+
+    holder, generation = _read_json(backend, name)
+    if holder is not None and holder["job_id"] == job_id:
+        try:
+            backend.delete(name, if_generation_match=generation)
+        except FileExistsError:
+            pass
+
+
+def _run_pipeline(pipeline: str, params: dict) -> dict:
+    """Function to run a pipeline inside a job worker process and time it."""
+
+    started_at = time.time()
+    outcome, messages = PIPELINES[pipeline](**params)
+    return {"outcome": outcome, "messages": messages, "started_at": started_at, "finished_at": time.time()}
+
+
+def _get_executor():
+    """Function to get the job process pool, created on first use or after it broke."""
+
+    global _executor
+    if _executor is None:
+        # Fresh interpreters instead of forks of a multi-threaded web worker.
+        _executor = ProcessPoolExecutor(max_workers=JOB_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _dispatch_jobs():
+    """Function to start the queued jobs of this process for which a run slot is free."""
+
+    backend = _get_backend()
+    started = []
+    with _jobs_lock:
+        for job_id, job in _owned_jobs.items():
+            if job["future"] is not None:
+                continue
+            slot = None
+            for candidate in range(JOB_MAX_WORKERS):
+                if _acquire_lock(backend, _slot_name(candidate), job_id)[0]:
+                    slot = candidate
+                    break
+            if slot is None:
+                break
+            record = job["record"]
+            record["status"] = "running"
+            record["started_at"] = record["heartbeat_at"] = time.time()
+            _write_record(backend, record)
+            job["slot"] = slot
+            job["future"] = _get_executor().submit(_run_pipeline, record["pipeline"], record["params"])
+            started.append((job_id, job["future"]))
+
+    # Outside the lock: the callback runs right away if the job already finished.
+    for job_id, future in started:
+        future.add_done_callback(lambda future, job_id=job_id: _finish_job(job_id, future))
+
+
+def _send_heartbeats():
+    """Function to refresh heartbeat_at on the records of the jobs this process runs or queues."""
+
+    backend = _get_backend()
+    with _jobs_lock:
+        for job in _owned_jobs.values():
+            job["record"]["heartbeat_at"] = time.time()
+            _write_record(backend, job["record"])
+
+
+def _run_dispatcher(pid: int):
+    """Function run by the dispatcher thread: start queued jobs and send heartbeats."""
+
+    wake = _dispatcher["wake"]
+    while _dispatcher["pid"] == pid:
+        wake.wait(JOB_HEARTBEAT_SECONDS)
+        wake.clear()
+        try:
+            _dispatch_jobs()
+            _send_heartbeats()
+        except Exception as e:
+            print(f"ERROR: Job dispatcher failed, retrying in {JOB_HEARTBEAT_SECONDS}s. Details: {e}")
+
+
+def _ensure_dispatcher():
+    """Function to start the dispatcher thread of this process, once per process (also after a fork)."""
+
+    with _jobs_lock:
+        if _dispatcher["pid"] == os.getpid():
+            return
+        _dispatcher["pid"] = os.getpid()
+    threading.Thread(target=_run_dispatcher, args=(os.getpid(),), name="job-dispatcher", daemon=True).start()
+
+
+def _trim_job_history(backend):
+    """Function to delete the oldest finished job records beyond JOB_HISTORY_LIMIT."""
+
+    records = backend.list(f"{JOB_STATE_FOLDER_PATH}records/")
+    # Job ids start with their submission time, so name order is submission order.
+    for blob in records[:max(0, len(records) - JOB_HISTORY_LIMIT)]:
+        record, generation = _read_json(backend, blob.name)
+        if record is not None and not _is_alive(record):
+            try:
+                backend.delete(blob.name, if_generation_match=generation)
+            except FileExistsError:
+                pass
+
+
+def _finish_job(job_id: str, future):
+    """Function to record the result of a finished job future and free its slot and active key."""
+
+    global _executor
+    backend = _get_backend()
+    with _jobs_lock:
+        job = _owned_jobs.pop(job_id)
+        record = job["record"]
+        try:
+            result = future.result()
+            record["status"] = "succeeded" if result["outcome"] else "failed"
+            record["started_at"] = result["started_at"]
+            record["finished_at"] = result["finished_at"]
+            record["result"] = {"messages": result["messages"]}
+        except Exception as e:
+            record["status"] = "failed"
+            record["finished_at"] = time.time()
+            record["error"] = f"{type(e).__name__}: {e}"
+            if isinstance(e, BrokenProcessPool) and _executor is not None:
+                # A worker died (e.g. out of memory). The pool cannot run anything anymore:
+                # shut it down and start a new one for the next job.
+                _executor.shutdown(wait=False, cancel_futures=True)
+                _executor = None
+        record["duration_seconds"] = round(record["finished_at"] - record["started_at"], 3)
+        record["queue_seconds"] = round(record["started_at"] - record["submitted_at"], 3)
+        record["heartbeat_at"] = time.time()
+        print(f"Job {job_id} ({record['pipeline']}) {record['status']} in {record['duration_seconds']}s.")
+
+    try:
+        _write_record(backend, record)
+        _release_lock(backend, _active_name(record["pipeline"], record["params"]), job_id)
+        _release_lock(backend, _slot_name(job["slot"]), job_id)
+        _trim_job_history(backend)
+    except Exception as e:
+        # The record goes stale without heartbeats, so the job is reported as failed.
+        print(f"ERROR: Failed to store the result of job {job_id}. Details: {e}")
+    _dispatcher["wake"].set()
+
+
+def submit_job(pipeline: str, **params):
+    """Function to submit a pipeline run, returning (job, coalesced).
+
+    When the same pipeline with the same parameters is already queued or running in any
+    process, no new job is started and that job is returned with coalesced=True.
+    """
+
+    if pipeline not in PIPELINES:
+        raise ValueError(f"Unknown pipeline: {pipeline}")
+
+    backend = _get_backend()
+    submitted_at = time.time()
+    job_id = f"{time.strftime('%Y%m%d%H%M%S', time.gmtime(submitted_at))}-{uuid.uuid4().hex[:12]}"
+    record = {
+        "job_id": job_id,
+        "pipeline": pipeline,
+        "params": params,
+        "status": "queued",
+        "submitted_at": submitted_at,
+        "started_at": None,
+        "finished_at": None,
+        "duration_seconds": None,
+        "queue_seconds": None,
+        "result": None,
+        "error": None,
+        "owner": f"{socket.gethostname()}:{os.getpid()}",
+        "heartbeat_at": submitted_at,
+    }
+    # The record exists before the active key points to it, so a duplicate submission
+    # never mistakes this job for a lost one.
+    _write_record(backend, record)
+    acquired, active_record = _acquire_lock(backend, _active_name(pipeline, params), job_id)
+    if not acquired:
+        backend.delete(_record_name(job_id))
+        return _job_status(active_record), True
+
+    with _jobs_lock:
+        _owned_jobs[job_id] = {"record": record, "future": None, "slot": None}
+    print(f"Job {job_id} ({pipeline}) submitted with {params}.")
+    _ensure_dispatcher()
+    try:
+        _dispatch_jobs()
+    except Exception as e:
+        # The dispatcher thread tries again.
+        print(f"ERROR: Failed to start job {job_id}, retrying in the background. Details: {e}")
+    with _jobs_lock:
+        return _job_status(record), False
+
+
+def _job_status(record: dict) -> dict:
+    """Function to get the status of a job from its record, a lost job reported as failed."""
+
+    status = dict(record)
+    if status["status"] in ("queued", "running") and not _is_alive(record):
+        status["status"] = "failed"
+        status["error"] = f"Job lost: no heartbeat from {record['owner']} for more than {JOB_STALE_SECONDS}s."
+    return status
+
+
+def get_job(job_id: str):
+    """Function to get the status of a job, None if it is unknown."""
+
+    if "/" in job_id:
+        return None
+    record, _ = _read_json(_get_backend(), _record_name(job_id))
+    return None if record is None else _job_status(record)
+
+
+def list_jobs() -> list:
+    """Function to get the status of all known jobs, most recent first."""
+
+    backend = _get_backend()
+    blobs = backend.list(f"{JOB_STATE_FOLDER_PATH}records/")
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(blobs)))) as executor:
+        records = [record for record, _ in executor.map(lambda blob: _read_json(backend, blob.name), blobs)]
+    return sorted((_job_status(record) for record in records if record is not None), key=lambda job: job["submitted_at"], reverse=True)
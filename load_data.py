@@ -1,17 +1,137 @@
 import subprocess
 import os
 import sys
+import time
 import pandas as pd
-from google.cloud import storage
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 
+from schema import get_parse_dtypes, concat_compact, log_memory_usage
+from storage_backend import get_storage_backend
+from metrics import timed_stage
+
+LOAD_DATA_MAX_WORKERS = int(os.getenv("LOAD_DATA_MAX_WORKERS", "8"))
+
+
+@timed_stage("load_raw_file")
+def read_raw_file(
+        backend,
+        blob_name: str,
+        blob_size: int = None,
+        dtype: dict = None,
+        usecols: list = None,
+    ):
+    """Function to read a single raw CSV file from storage, returning the data and a timing report."""
+
+    start = time.perf_counter()
+    with backend.open_read(blob_name) as file:
+        df = pd.read_csv(file, dtype=dtype, usecols=usecols)
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "file": blob_name,
+        "records": len(df),
+        "bytes": blob_size,
+        "seconds": round(elapsed, 4),
+        "mb_per_second": round(blob_size / elapsed / 1e6, 2) if blob_size and elapsed > 0 else None,
+    }
+    print(f"Loaded {len(df)} records ({blob_size} bytes) from {blob_name} in {elapsed:.3f}s.")
+    return df, report
+
+
+def list_raw_files(
+        project_id: str,
+        bucket_name: str,
+        raw_data_folder_path: str,
+    ):
+    """Function to list the raw CSV blobs (with size, generation and checksum) in name order."""
+
+    backend = get_storage_backend(project_id, bucket_name)
+    return [blob for blob in backend.list(raw_data_folder_path) if blob.name.endswith('.csv')]
+
+
+def load_raw_files(
+        project_id: str,
+        bucket_name: str,
+        csv_blobs: list,
+        max_workers: int = None,
+        dtype: dict = None,
+        usecols: list = None,
+    ) -> pd.DataFrame:
+    """Function to load the given raw CSV blobs concurrently into one DataFrame.
+
+    Files are fetched and parsed by up to max_workers threads (1 reads them one after
+    another) and concatenated in the order given, so the output does not depend on which
+    download finishes first. The per-file timing and byte-count report is kept in the
+    returned DataFrame's attrs["ingestion_report"].
+    """
+    if not csv_blobs:
+        return pd.DataFrame()
+
+    if max_workers is None:
+        max_workers = LOAD_DATA_MAX_WORKERS
+    if dtype is None:
+        dtype = get_parse_dtypes()
+    if usecols is None:
+        usecols = list(dtype)
+
+    backend = get_storage_backend(project_id, bucket_name)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(csv_blobs)))) as executor:
+        # map() yields results in submission order regardless of completion order.
+        results = list(executor.map(
+            lambda blob: read_raw_file(backend, blob.name, blob.size, dtype=dtype, usecols=usecols),
+            csv_blobs
+        ))
+    elapsed = time.perf_counter() - start
+
+    data_frames = [df for df, report in results]
+    ingestion_report = [report for df, report in results]
+
+    combined_data = concat_compact(data_frames)
+    total_bytes = sum(report["bytes"] or 0 for report in ingestion_report)
+    print(f"Loaded {len(combined_data)} records ({total_bytes} bytes) from {len(csv_blobs)} files in {elapsed:.3f}s.")
+
+    combined_data.attrs["ingestion_report"] = ingestion_report
+    log_memory_usage("load raw files", combined_data)
+    return combined_data
+
+
+def iter_raw_file_chunks(
+        project_id: str,
+        bucket_name: str,
+        csv_blobs: list,
+        chunk_size: int,
+        dtype: dict = None,
+        usecols: list = None,
+    ):
+    """Function to read the given raw CSV blobs one after another as DataFrame chunks of chunk_size records."""
+
+    if dtype is None:
+        dtype = get_parse_dtypes()
+    if usecols is None:
+        usecols = list(dtype)
+
+    backend = get_storage_backend(project_id, bucket_name)
+    for blob in csv_blobs:
+        with backend.open_read(blob.name) as file, pd.read_csv(file, dtype=dtype, usecols=usecols, chunksize=chunk_size) as reader:
+            yield from reader
+
+
+@timed_stage("load_data")
 def load_data(
         project_id: str,
         bucket_name: str,
         raw_data_folder_path: str,
+        max_workers: int = None,
+        dtype: dict = None,
+        usecols: list = None,
     ) -> pd.DataFrame:
-    """Function to load data from GCS bucket."""
+    """Function to load data from GCS bucket.
+
+    All CSV files of the folder are loaded with load_raw_files, in blob name order.
+    """
     if not all([project_id, bucket_name, raw_data_folder_path]):
         print("Error: Missing one or more required environment variables.")
         return pd.DataFrame()
@@ -23,22 +143,10 @@ def load_data(
     print("---------------------")
 
     #1. Read all the CSV files from the specified GCS folder
-    storage_client = storage.Client(project=project_id)
-    bucket = storage_client.bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=raw_data_folder_path)
-    csv_files = [blob.name for blob in blobs if blob.name.endswith('.csv')]
-    print(f"Found {len(csv_files)} CSV files in the specified GCS folder.")
-
-    data_frames = []
-    for file in csv_files:
-        df = pd.read_csv(f"gs://{bucket_name}/{file}")
-        print(f"Loaded {len(df)} records from {file}.")
-        data_frames.append(df)
-
-    combined_data = pd.concat(data_frames, ignore_index=True)
-    print(f"Loaded {len(combined_data)} records from {len(csv_files)} files.")
-
-    return combined_data 
+    csv_blobs = list_raw_files(project_id, bucket_name, raw_data_folder_path)
+    print(f"Found {len(csv_blobs)} CSV files in the specified GCS folder.")
+
+    return load_raw_files(project_id, bucket_name, csv_blobs, max_workers=max_workers, dtype=dtype, usecols=usecols)
 
 
 # --- Example Usage ---
@@ -0,0 +1,137 @@
+import os
+import time
+import bisect
+import functools
+import threading
+import contextlib
+
+# Process-wide latency histograms and counters, exposed in the Prometheus text format by
+# the /metrics endpoint. Stages are timed with timed_span / timed_stage; every metric is
+# keyed by its name and labels.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Printing DataFrames costs milliseconds per call (most of a single row prediction), so
+# they are off unless a developer sets DEBUG_DATAFRAME_PRINTS=1.
+DEBUG_DATAFRAME_PRINTS = os.getenv("DEBUG_DATAFRAME_PRINTS", "0") == "1"
+
+METRIC_HELP = {
+    "churn_stage_duration_seconds": ("histogram", "Time spent in each pipeline stage."),
+    "churn_stage_errors_total": ("counter", "Pipeline stages that raised an exception."),
+    "churn_http_request_duration_seconds": ("histogram", "Time spent handling HTTP requests, by endpoint."),
+    "churn_http_requests_total": ("counter", "HTTP requests handled, by endpoint and status code."),
+    "churn_predictions_total": ("counter", "Records scored, by scoring path."),
+    "churn_prediction_cache_lookups_total": ("counter", "Prediction cache lookups of /predict requests, by hit or miss."),
+    "churn_storage_bytes_total": ("counter", "Bytes read from and written to storage by whole object transfers."),
+}
+
+_metrics_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+def _metric_key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, value: float, **labels):
+    """Function to record one observation in a latency histogram."""
+
+    key = _metric_key(name, labels)
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        position = bisect.bisect_left(LATENCY_BUCKETS, value)
+        if position < len(LATENCY_BUCKETS):
+            histogram["buckets"][position] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def increment_counter(name: str, amount: float = 1, **labels):
+    """Function to add to a counter."""
+
+    key = _metric_key(name, labels)
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextlib.contextmanager
+def timed_span(stage: str, **labels):
+    """Function to time a block as one observation of a stage; exceptions are counted and re-raised."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment_counter("churn_stage_errors_total", stage=stage, **labels)
+        raise
+    finally:
+        observe("churn_stage_duration_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def timed_stage(stage: str):
+    """Function to decorate a function so every call is timed as a stage."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed_span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def print_dataframe(label, df):
+    """Function to print a DataFrame for debugging, unless DEBUG_DATAFRAME_PRINTS is switched off."""
+
+    if DEBUG_DATAFRAME_PRINTS:
+        print(f"{label}{df}" if label else df)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra: dict = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Function to render all metrics in the Prometheus text exposition format."""
+
+    with _metrics_lock:
+        histograms = {key: dict(value, buckets=list(value["buckets"])) for key, value in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    names = sorted({name for name, labels in histograms} | {name for name, labels in counters})
+    for name in names:
+        metric_type, help_text = METRIC_HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for (metric_name, labels), histogram in sorted(histograms.items()):
+            if metric_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        for (metric_name, labels), value in sorted(counters.items()):
+            if metric_name == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    """Function to drop all recorded metrics."""
+
+    with _metrics_lock:
+        _histograms.clear()
+        _counters.clear()
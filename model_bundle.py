@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import threading
+import joblib
+
+from categorical_encoding import encoder_from_dict
+from scoring_kernel import upgrade_scoring_kernel
+from schema import COMPACT_DTYPES
+
+# A model bundle packs everything serving needs for one trained model into a single
+# versioned file next to the model: the model, the scaler and categorical encoder it was
+# trained with, the scoring kernel (when one was compiled), the feature schema and the
+# evaluation metrics. It is an uncompressed joblib file, so serving processes copy it to
+# MODEL_BUNDLE_LOCAL_DIR once per generation and load it with mmap_mode="r": the NumPy
+# arrays (coefficients, trees, kernel weights) stay in the page cache and are shared by
+# every worker process of the host instead of being copied into each of them.
+MODEL_BUNDLE_LOCAL_DIR = os.getenv("MODEL_BUNDLE_LOCAL_DIR") or os.path.join(tempfile.gettempdir(), "model_bundles")
+
+BUNDLE_FORMAT_VERSION = 1
+
+
+def get_bundle_name(model_name: str) -> str:
+    """Function to get the bundle object name of a model_<algorithm>_<timestamp>.joblib object name."""
+
+    folder, _, file_name = model_name.rpartition("/")
+    bundle_file_name = file_name.replace("model_", "model_bundle_", 1).replace(".joblib", ".bundle")
+    return f"{folder}/{bundle_file_name}" if folder else bundle_file_name
+
+
+def build_model_bundle(algorithm: str, timestamp: str, model, scaler, encoder, kernel: dict = None, metrics: list = None) -> dict:
+    """Function to pack a trained model and the artifacts it was trained with into a bundle."""
+
+    return {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "algorithm": algorithm,
+        "timestamp": timestamp,
+        "feature_schema": {
+            "input_dtypes": dict(COMPACT_DTYPES),
+            "feature_names": [str(name) for name in getattr(model, "feature_names_in_", [])],
+        },
+        "metrics": metrics or [],
+        "model": model,
+        "scaler": scaler,
+        # The encoder is kept in its JSON layout, so bundles do not depend on the class pickle.
+        "encoder": encoder.to_dict(),
+        "kernel": kernel,
+    }
+
+
+def dump_model_bundle(bundle: dict, file):
+    """Function to write a bundle to an open binary file; uncompressed, so it can be memory-mapped."""
+
+    joblib.dump(bundle, file)
+
+
+def load_model_bundle(path: str) -> dict:
+    """Function to load a bundle from a local file with its arrays memory-mapped read-only.
+
+    Returns the artifacts dict of the serving cache: model, scaler, encoder and kernel, plus
+    the bundle metadata.
+    """
+
+    bundle = joblib.load(path, mmap_mode="r")
+    if bundle.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported model bundle format version: {bundle.get('format_version')}")
+    input_dtypes = bundle["feature_schema"]["input_dtypes"]
+    if input_dtypes != dict(COMPACT_DTYPES):
+        raise ValueError(f"Model bundle was built for input columns {input_dtypes}, this service expects {dict(COMPACT_DTYPES)}.")
+
+    return {
+        "model": bundle["model"],
+        "scaler": bundle["scaler"],
+        "encoder": encoder_from_dict(bundle["encoder"]),
+        "kernel": upgrade_scoring_kernel(bundle["kernel"]),
+        "metadata": {
+            "algorithm": bundle["algorithm"],
+            "timestamp": bundle["timestamp"],
+            "feature_schema": bundle["feature_schema"],
+            "metrics": bundle["metrics"],
+        },
+    }
+
+
+def fetch_model_bundle(backend, blob, local_dir: str = None) -> dict:
+    """Function to copy a bundle at its generation to the local directory once, then load it memory-mapped."""
+
+    local_dir = os.path.join(local_dir or MODEL_BUNDLE_LOCAL_DIR, blob.generation)
+    local_path = os.path.join(local_dir, blob.name.rsplit("/", 1)[-1])
+    if not os.path.exists(local_path):
+        # Other worker processes of the host reuse the copy instead of downloading it again.
+        os.makedirs(local_dir, exist_ok=True)
+        temp_path = f"{local_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with backend.open_read(blob.name, generation=blob.generation) as source, open(temp_path, "wb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(temp_path, local_path)
+    return load_model_bundle(local_path)
+
+
+def remove_stale_bundle_copies(keep_generation: str):
+    """Function to delete the local copies of every other bundle generation."""
+
+    if not os.path.isdir(MODEL_BUNDLE_LOCAL_DIR):
+        return
+    for generation in os.listdir(MODEL_BUNDLE_LOCAL_DIR):
+        if generation != keep_generation:
+            # Memory-mapped files stay readable for processes still serving them after they are unlinked.
+            shutil.rmtree(os.path.join(MODEL_BUNDLE_LOCAL_DIR, generation), ignore_errors=True)
@@ -0,0 +1,177 @@
+import os
+import io
+import csv
+import json
+from datetime import datetime, timezone
+
+from storage_backend import get_storage_backend
+
+# The model registry is a single small JSON object recording every trained model version
+# (model_<algorithm>_<timestamp>): its artifacts in the stage and prod folders with their
+# generations, and its evaluation metrics for the positive class. Two pointers name the
+# versions in use:
+#   latest     - the version /publish compares and promotes, set by /train to its best candidate.
+#   production - the version served, set by /publish once the artifacts are copied to prod.
+# Publishing and serving resolve the current models with one read of the registry instead of
+# listing the model folders. Every update is a read-modify-write conditioned on the generation
+# that was read, retried when another process updated the registry in between.
+MODEL_REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "model/registry.json")
+MODEL_REGISTRY_UPDATE_RETRIES = int(os.getenv("MODEL_REGISTRY_UPDATE_RETRIES", "5"))
+
+REGISTRY_FORMAT_VERSION = 1
+
+# Artifact name -> prefix and extension of the file, e.g. model_kernel_<version>.npz.
+ARTIFACT_FILES = {
+    "model": ("model_", ".joblib"),
+    "evaluation": ("model_evaluation_", ".csv"),
+    "kernel": ("model_kernel_", ".npz"),
+    "bundle": ("model_bundle_", ".bundle"),
+}
+METRIC_COLUMNS = ("Precision", "Recall", "F1-Score", "Accuracy")
+
+
+def empty_registry() -> dict:
+    """Function to create a registry with no model versions."""
+
+    return {
+        "format_version": REGISTRY_FORMAT_VERSION,
+        "latest": None,
+        "production": None,
+        "models": {},
+    }
+
+
+def get_model_version_id(blob_name: str) -> str:
+    """Function to get the version id <algorithm>_<timestamp> of any artifact of a model."""
+
+    file_name = blob_name.rsplit("/", 1)[-1]
+    for prefix, extension in sorted(ARTIFACT_FILES.values(), key=lambda entry: -len(entry[0])):
+        if file_name.startswith(prefix) and file_name.endswith(extension):
+            return file_name[len(prefix):-len(extension)]
+    raise ValueError(f"Not a model artifact: {blob_name}")
+
+
+def get_artifact_name(folder_path: str, artifact: str, version_id: str) -> str:
+    """Function to get the object name of an artifact of a model version in a folder."""
+
+    prefix, extension = ARTIFACT_FILES[artifact]
+    return f"{folder_path}{prefix}{version_id}{extension}"
+
+
+def load_registry(backend, registry_path: str = None):
+    """Function to read the registry, returning (registry, generation); generation "0" when there is none yet."""
+
+    registry_path = registry_path or MODEL_REGISTRY_PATH
+    blob = backend.stat(registry_path)
+    if blob is None:
+        return empty_registry(), "0"
+    try:
+        return json.loads(backend.read_bytes(registry_path, generation=blob.generation)), blob.generation
+    except FileNotFoundError:
+        # Replaced between the stat and the read: the stale generation makes the update retry.
+        return json.loads(backend.read_bytes(registry_path)), blob.generation
+
+
+def update_registry(backend, update, registry_path: str = None) -> dict:
+    """Function to apply update(registry) and write the registry only if nobody else wrote it meanwhile.
+
+    update changes the registry dict in place and is called again on the fresh registry
+    after a conflict. Returns the written registry.
+    """
+
+    registry_path = registry_path or MODEL_REGISTRY_PATH
+    for attempt in range(MODEL_REGISTRY_UPDATE_RETRIES):
+        registry, generation = load_registry(backend, registry_path)
+        update(registry)
+        try:
+            backend.write_bytes(
+                registry_path,
+                json.dumps(registry, indent=2).encode(),
+                content_type="application/json",
+                if_generation_match=generation
+            )
+            return registry
+        except FileExistsError:
+            print(f"Model registry changed while updating it, retrying ({attempt + 1}/{MODEL_REGISTRY_UPDATE_RETRIES}).")
+    raise RuntimeError(f"Failed to update {backend.uri(registry_path)} after {MODEL_REGISTRY_UPDATE_RETRIES} attempts.")
+
+
+def _describe_artifacts(backend, folder_path: str, version_id: str) -> dict:
+    """Function to record the name and generation of every existing artifact of a model version in a folder."""
+
+    artifacts = {}
+    for artifact in ARTIFACT_FILES:
+        blob = backend.stat(get_artifact_name(folder_path, artifact, version_id))
+        artifacts[artifact] = None if blob is None else {"name": blob.name, "generation": blob.generation}
+    return artifacts
+
+
+def _describe_metrics(backend, evaluation_name: str) -> dict:
+    """Function to get the positive class metrics of an evaluation CSV."""
+
+    for record in csv.DictReader(io.StringIO(backend.read_bytes(evaluation_name).decode())):
+        if int(record["Class"]) == 1:
+            return {metric: float(record[metric]) for metric in METRIC_COLUMNS if metric in record}
+    return {}
+
+
+def register_staged_models(
+        project_id: str,
+        bucket_name: str,
+        stage_model_folder_path: str,
+        version_ids: list,
+        latest: str):
+    """Function to record exported model versions with their stage artifacts and metrics, and point latest at one of them."""
+
+    backend = get_storage_backend(project_id, bucket_name)
+    registered_at = datetime.now(timezone.utc).isoformat()
+
+    def update(registry):
+        for version_id, description in described.items():
+            entry = registry["models"].setdefault(version_id, {"prod": None, "promoted_at": None})
+            entry.update(description, registered_at=registered_at)
+        registry["latest"] = latest
+
+    try:
+        described = {}
+        for version_id in version_ids:
+            artifacts = _describe_artifacts(backend, stage_model_folder_path, version_id)
+            described[version_id] = {"stage": artifacts, "metrics": _describe_metrics(backend, artifacts["evaluation"]["name"])}
+        update_registry(backend, update)
+        return True, f"SUCCESS: Registered {len(version_ids)} model version(s) in {backend.uri(MODEL_REGISTRY_PATH)}, latest {latest}."
+    except Exception as e:
+        return False, f"ERROR: Failed to register model versions in {backend.uri(MODEL_REGISTRY_PATH)}. Details: {e}"
+
+
+def record_promotion(backend, version_id: str, prod_artifacts: dict, metrics: dict = None) -> dict:
+    """Function to record the prod artifacts (name -> StorageObject) of a version and make it the production version."""
+
+    promoted_at = datetime.now(timezone.utc).isoformat()
+
+    def update(registry):
+        # Versions trained before the registry existed are registered when they are promoted.
+        entry = registry["models"].setdefault(
+            version_id, {"stage": None, "metrics": metrics or {}, "registered_at": promoted_at}
+        )
+        entry["prod"] = {
+            name: None if blob is None else {"name": blob.name, "generation": blob.generation}
+            for name, blob in prod_artifacts.items()
+        }
+        entry["promoted_at"] = promoted_at
+        registry["production"] = version_id
+
+    return update_registry(backend, update)
+
+
+def get_registered_version(backend, pointer: str):
+    """Function to get (version_id, entry) of the version a pointer (latest or production) names, (None, None) if unset."""
+
+    # A single read; only updates need the generation.
+    try:
+        registry = json.loads(backend.read_bytes(MODEL_REGISTRY_PATH))
+    except FileNotFoundError:
+        return None, None
+    version_id = registry.get(pointer)
+    if version_id is None or version_id not in registry["models"]:
+        return None, None
+    return version_id, registry["models"][version_id]
@@ -0,0 +1,212 @@
+import os
+import io
+import json
+import time
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from storage_backend import get_storage_backend
+from load_data import list_raw_files, iter_raw_file_chunks
+from schema import get_rss_bytes
+from model_registry import get_model_version_id, get_artifact_name
+from consume_model import resolve_model_artifact_blobs, resolve_prod_artifact_blobs, load_model_artifacts, score_input_chunk
+
+# Before /publish promotes a stage model it is benchmarked against the production model on
+# the same replay set, each in a fresh process: load time, single-row p50 / p99 latency,
+# batch throughput and the resident memory the loaded model adds to a serving process.
+# Promotion is blocked when a number regresses beyond its budget relative to production:
+# more than max_ratio times the production value (and by more than tolerance, so noise on
+# sub-millisecond numbers does not block), or for throughput less than min_ratio times it.
+# The numbers are recorded as model_performance_<version>.json next to the evaluation CSV.
+PERF_GATE_ENABLED = os.getenv("PERF_GATE_ENABLED", "1") != "0"
+# The replay set is drawn once from the raw data and stored, so every publish replays the same rows.
+PERF_REPLAY_SET_PATH = os.getenv("PERF_REPLAY_SET_PATH", "model/perf_replay.csv")
+PERF_REPLAY_ROWS = int(os.getenv("PERF_REPLAY_ROWS", "1000"))
+PERF_SINGLE_ROW_REQUESTS = int(os.getenv("PERF_SINGLE_ROW_REQUESTS", "200"))
+PERF_BATCH_REPEATS = int(os.getenv("PERF_BATCH_REPEATS", "3"))
+
+PERFORMANCE_BUDGETS = {
+    "load_seconds": {
+        "max_ratio": float(os.getenv("PERF_MAX_LOAD_TIME_RATIO", "2.0")),
+        "tolerance": float(os.getenv("PERF_LOAD_TIME_TOLERANCE_SECONDS", "0.5")),
+    },
+    "p50_latency_ms": {
+        "max_ratio": float(os.getenv("PERF_MAX_P50_LATENCY_RATIO", "1.5")),
+        "tolerance": float(os.getenv("PERF_LATENCY_TOLERANCE_MS", "0.5")),
+    },
+    "p99_latency_ms": {
+        "max_ratio": float(os.getenv("PERF_MAX_P99_LATENCY_RATIO", "2.0")),
+        "tolerance": float(os.getenv("PERF_LATENCY_TOLERANCE_MS", "0.5")),
+    },
+    "batch_rows_per_second": {
+        "min_ratio": float(os.getenv("PERF_MIN_THROUGHPUT_RATIO", "0.5")),
+    },
+    "rss_mb": {
+        "max_ratio": float(os.getenv("PERF_MAX_RSS_RATIO", "1.5")),
+        "tolerance": float(os.getenv("PERF_RSS_TOLERANCE_MB", "32")),
+    },
+}
+
+
+def get_performance_report_name(stage_model_folder_path: str, version_id: str) -> str:
+    """Function to get the object name of the performance report of a model version."""
+
+    return f"{stage_model_folder_path}model_performance_{version_id}.json"
+
+
+def load_replay_set(project_id: str, bucket_name: str, raw_data_folder_path: str) -> pd.DataFrame:
+    """Function to load the replay set, drawing it from the first complete raw records when there is none yet."""
+
+    backend = get_storage_backend(project_id, bucket_name)
+    try:
+        return pd.read_csv(io.BytesIO(backend.read_bytes(PERF_REPLAY_SET_PATH)))
+    except FileNotFoundError:
+        pass
+
+    raw_files = list_raw_files(project_id, bucket_name, raw_data_folder_path)
+    rows = []
+    num_rows = 0
+    for chunk in iter_raw_file_chunks(project_id, bucket_name, raw_files, chunk_size=PERF_REPLAY_ROWS):
+        # Requests carry complete records, rows with missing values are not replayed.
+        chunk = chunk.dropna()
+        rows.append(chunk.iloc[:PERF_REPLAY_ROWS - num_rows])
+        num_rows += len(rows[-1])
+        if num_rows >= PERF_REPLAY_ROWS:
+            break
+    if num_rows == 0:
+        raise ValueError(f"No complete raw records in {backend.uri(raw_data_folder_path)} to build the replay set from.")
+
+    replay_df = pd.concat(rows, ignore_index=True)
+    backend.write_bytes(PERF_REPLAY_SET_PATH, replay_df.to_csv(index=False).encode(), content_type="text/csv")
+    print(f"Replay set of {len(replay_df)} records saved to {backend.uri(PERF_REPLAY_SET_PATH)}.")
+    return pd.read_csv(io.BytesIO(backend.read_bytes(PERF_REPLAY_SET_PATH)))
+
+
+def benchmark_model_artifacts(project_id: str, bucket_name: str, blobs: dict, replay_df: pd.DataFrame) -> dict:
+    """Function to load model artifacts and replay requests against them, returning the performance numbers.
+
+    Meant to run in a fresh process, so the load time and memory are those of a cold
+    serving process. Bundles are copied to a temporary directory instead of the shared one.
+    """
+
+    backend = get_storage_backend(project_id, bucket_name)
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as bundle_dir:
+        rss_before, peak_rss = get_rss_bytes()
+        start = time.perf_counter()
+        artifacts = load_model_artifacts(backend, blobs, bundle_dir=bundle_dir)
+        load_seconds = time.perf_counter() - start
+
+        single_rows = [replay_df.iloc[[index % len(replay_df)]] for index in range(PERF_SINGLE_ROW_REQUESTS)]
+        # The first request pays for lazy initialisation, like the warm-up request of a serving process.
+        score_input_chunk(artifacts, single_rows[0])
+        latencies = []
+        for row in single_rows:
+            start = time.perf_counter()
+            score_input_chunk(artifacts, row)
+            latencies.append(time.perf_counter() - start)
+
+        batch_seconds = []
+        for repeat in range(PERF_BATCH_REPEATS):
+            start = time.perf_counter()
+            score_input_chunk(artifacts, replay_df)
+            batch_seconds.append(time.perf_counter() - start)
+        rss_after, peak_rss = get_rss_bytes()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "load_seconds": round(load_seconds, 4),
+        "p50_latency_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p99_latency_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+        "batch_rows_per_second": round(len(replay_df) / min(batch_seconds), 1),
+        "rss_mb": round((rss_after - rss_before) / 1e6, 2) if rss_before is not None else None,
+        "single_row_requests": len(latencies),
+        "batch_rows": len(replay_df),
+    }
+
+
+def _benchmark_in_fresh_process(project_id: str, bucket_name: str, blobs: dict, replay_df: pd.DataFrame) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(benchmark_model_artifacts, project_id, bucket_name, blobs, replay_df).result()
+
+
+def check_performance_budgets(stage_numbers: dict, prod_numbers: dict) -> list:
+    """Function to list the numbers of the stage model that regress beyond their budget relative to production."""
+
+    violations = []
+    for metric, budget in PERFORMANCE_BUDGETS.items():
+        stage_value, prod_value = stage_numbers.get(metric), prod_numbers.get(metric)
+        if stage_value is None or prod_value is None:
+            continue
+        if "max_ratio" in budget:
+            limit = max(prod_value * budget["max_ratio"], prod_value + budget["tolerance"])
+            if stage_value > limit:
+                violations.append(f"{metric} {stage_value} exceeds {limit:.4g} (production {prod_value}, max ratio {budget['max_ratio']})")
+        elif stage_value < prod_value * budget["min_ratio"]:
+            violations.append(
+                f"{metric} {stage_value} is below {prod_value * budget['min_ratio']:.4g} (production {prod_value}, min ratio {budget['min_ratio']})"
+            )
+    return violations
+
+
+def run_performance_gate(
+        project_id: str,
+        bucket_name: str,
+        stage_model_folder_path: str,
+        prod_model_folder_path: str,
+        processed_data_folder_path: str,
+        raw_data_folder_path: str,
+        stage_eval_blob,
+        compare_with_prod: bool = True):
+    """Function to benchmark the stage model against the production model and record the numbers.
+
+    Returns (outcome, message, passed). passed is False when a number regresses beyond its
+    budget; without compare_with_prod only the stage model is benchmarked and recorded.
+    """
+
+    try:
+        backend = get_storage_backend(project_id, bucket_name)
+        version_id = get_model_version_id(stage_eval_blob.name)
+        stage_blobs = resolve_model_artifact_blobs(
+            backend,
+            processed_data_folder_path,
+            backend.stat(get_artifact_name(stage_model_folder_path, "model", version_id)),
+            kernel_blob=backend.stat(get_artifact_name(stage_model_folder_path, "kernel", version_id)),
+            bundle_blob=backend.stat(get_artifact_name(stage_model_folder_path, "bundle", version_id))
+        )
+        replay_df = load_replay_set(project_id, bucket_name, raw_data_folder_path)
+
+        report = {
+            "version_id": version_id,
+            "benchmarked_at": datetime.now(timezone.utc).isoformat(),
+            "replay_set": backend.uri(PERF_REPLAY_SET_PATH),
+            "stage": _benchmark_in_fresh_process(project_id, bucket_name, stage_blobs, replay_df),
+            "production": None,
+            "budgets": PERFORMANCE_BUDGETS,
+            "violations": [],
+        }
+        if compare_with_prod:
+            prod_blobs = resolve_prod_artifact_blobs(backend, prod_model_folder_path, processed_data_folder_path)
+            prod_blob = prod_blobs.get("bundle") or prod_blobs["model"]
+            report["production"] = {
+                "version_id": get_model_version_id(prod_blob.name),
+                **_benchmark_in_fresh_process(project_id, bucket_name, prod_blobs, replay_df),
+            }
+            report["violations"] = check_performance_budgets(report["stage"], report["production"])
+        report["passed"] = not report["violations"]
+
+        report_name = get_performance_report_name(stage_model_folder_path, version_id)
+        backend.write_bytes(report_name, json.dumps(report, indent=2).encode(), content_type="application/json")
+        print(f"Performance report saved to {backend.uri(report_name)}: {report}")
+
+        numbers = ", ".join(f"{metric}={report['stage'][metric]}" for metric in PERFORMANCE_BUDGETS)
+        if report["violations"]:
+            return True, f"Stage model performance regressed beyond budget: {'; '.join(report['violations'])}.", False
+        return True, f"Stage model performance within budget ({numbers}), recorded in {report_name}.", True
+    except Exception as e:
+        return False, f"ERROR: Failed to benchmark the stage model. Details: {e}", False
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import hashlib
+from datetime import datetime, timezone
+
+from storage_backend import get_storage_backend, split_storage_path
+from load_data import list_raw_files
+from categorical_encoding import ENCODER_FILE_NAME
+from ingestion_manifest import load_ingestion_manifest
+from model_registry import MODEL_REGISTRY_PATH
+from score_index import SCORE_INDEX_FOLDER_PATH
+from pipelines import run_load_and_process_data, run_train_model, publish_model, run_build_score_index, get_processed_data_file_path
+
+# Runs load + preprocess -> train -> publish -> score index as one DAG, skipping every stage
+# whose inputs have not changed since it last ran. Inputs and outputs are fingerprinted by
+# the generation and MD5 checksum of the blobs they consist of (raw files, processed data,
+# scaler / encoder, registry pointers, score index) plus the settings of the stage, and
+# hashed. A stage is skipped when the hash of its inputs equals the one recorded for its
+# last successful run and its recorded outputs are still in place; the state is kept in
+# PIPELINE_STATE_PATH.
+PIPELINE_STATE_PATH = os.getenv("PIPELINE_STATE_PATH", "pipeline/state.json")
+
+PIPELINE_STATE_VERSION = 1
+
+
+def _content_hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _blob_fingerprint(blob):
+    return None if blob is None else [blob.name, str(blob.generation), blob.md5_hash]
+
+
+def _settings(*names) -> dict:
+    return {name: os.getenv(name) for name in names}
+
+
+def _backend():
+    return get_storage_backend(os.getenv("PROJECT_ID", "nimble-octagon-253816"), os.getenv("BUCKET_NAME", "customer-churn-demo"))
+
+
+def raw_data_fingerprint():
+    """Function to fingerprint the raw files."""
+
+    raw_files = list_raw_files(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        raw_data_folder_path=os.getenv("RAW_DATA_FOLDER_PATH", "data/raw/")
+    )
+    return [_blob_fingerprint(blob) for blob in raw_files]
+
+
+def processed_data_fingerprint():
+    """Function to fingerprint the processed data file, its incremental partitions and the scaler and encoder."""
+
+    backend = _backend()
+    processed_data_folder_path = os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/")
+    manifest = load_ingestion_manifest(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        processed_data_folder_path=processed_data_folder_path
+    )
+    bucket_name, processed_data_file_name = split_storage_path(get_processed_data_file_path())
+    names = [processed_data_file_name] + manifest["partitions"] + [
+        f"{processed_data_folder_path}scaler.pkl",
+        f"{processed_data_folder_path}{ENCODER_FILE_NAME}",
+    ]
+    return [_blob_fingerprint(backend.stat(name)) for name in names]
+
+
+def _registry_pointer(pointer: str):
+    """Function to fingerprint the version a registry pointer names, with the generation of its evaluation."""
+
+    try:
+        registry = json.loads(_backend().read_bytes(MODEL_REGISTRY_PATH))
+    except FileNotFoundError:
+        return None
+    version_id = registry.get(pointer)
+    entry = registry["models"].get(version_id) if version_id else None
+    artifacts = entry and entry["stage" if pointer == "latest" else "prod"]
+    return [version_id, artifacts["evaluation"]["generation"] if artifacts and artifacts["evaluation"] else None]
+
+
+def latest_model_fingerprint():
+    """Function to fingerprint the latest trained model version."""
+
+    return _registry_pointer("latest")
+
+
+def production_model_fingerprint():
+    """Function to fingerprint the production model version."""
+
+    return _registry_pointer("production")
+
+
+def score_index_fingerprint():
+    """Function to fingerprint the current score index build."""
+
+    return _blob_fingerprint(_backend().stat(f"{SCORE_INDEX_FOLDER_PATH}current.json"))
+
+
+def _run_publish():
+    outcome, messages, promoted = publish_model()
+    return outcome, messages
+
+
+# Stages in dependency order. inputs and outputs return JSON serializable fingerprints.
+PIPELINE_STAGES = [
+    {
+        "name": "lnp_data",
+        "depends_on": [],
+        "inputs": lambda: {
+            "raw": raw_data_fingerprint(),
+            "settings": _settings("LNP_DATA_MODE", "PREPROCESS_CHUNK_SIZE", "PROCESSED_DATA_FILE_NAME", "COMPACT_DTYPES", "UNSEEN_CATEGORY_POLICY"),
+        },
+        "run": run_load_and_process_data,
+        "outputs": processed_data_fingerprint,
+    },
+    {
+        "name": "train",
+        "depends_on": ["lnp_data"],
+        "inputs": lambda: {
+            "processed": processed_data_fingerprint(),
+            "settings": _settings(
+                "TRAIN_MODE", "TRAIN_ALGORITHMS", "TRAIN_SELECTION_METRIC", "TRAIN_STREAMING_ALGORITHM",
+                "TRAIN_CHUNK_SIZE", "TRAIN_EPOCHS", "TRAIN_TEST_FRACTION"
+            ),
+        },
+        "run": run_train_model,
+        "outputs": latest_model_fingerprint,
+    },
+    {
+        # The outcome of a comparison only depends on the stage model, as long as the
+        # production model is still the one this stage left in place (its output).
+        "name": "publish",
+        "depends_on": ["train"],
+        "inputs": lambda: {
+            "latest": latest_model_fingerprint(),
+            "settings": _settings(
+                "PERF_GATE_ENABLED", "PERF_MAX_LOAD_TIME_RATIO", "PERF_MAX_P50_LATENCY_RATIO",
+                "PERF_MAX_P99_LATENCY_RATIO", "PERF_MIN_THROUGHPUT_RATIO", "PERF_MAX_RSS_RATIO"
+            ),
+        },
+        "run": _run_publish,
+        "outputs": production_model_fingerprint,
+    },
+    {
+        "name": "score_index",
+        "depends_on": ["publish"],
+        "inputs": lambda: {"production": production_model_fingerprint(), "raw": raw_data_fingerprint()},
+        "run": run_build_score_index,
+        "outputs": score_index_fingerprint,
+    },
+]
+
+
+def load_pipeline_state(backend) -> dict:
+    """Function to load the recorded stage runs, an empty state if the pipeline never ran."""
+
+    try:
+        return json.loads(backend.read_bytes(PIPELINE_STATE_PATH))
+    except FileNotFoundError:
+        return {"version": PIPELINE_STATE_VERSION, "stages": {}}
+
+
+def save_pipeline_state(backend, state: dict):
+    """Function to save the recorded stage runs."""
+
+    backend.write_bytes(PIPELINE_STATE_PATH, json.dumps(state, indent=2).encode(), content_type="application/json")
+
+
+def run_pipeline_dag(force: bool = False):
+    """Function to run the pipeline stages in order, skipping the unchanged ones, returning (outcome, messages).
+
+    force runs every stage. A stage whose upstream stage failed is not run. The messages
+    report which stages ran or were skipped and how long each took, followed by the
+    messages of the stages that ran.
+    """
+
+    messages = ["Pipeline Started"]
+    stage_messages = []
+    backend = _backend()
+    state = load_pipeline_state(backend)
+    statuses = {}
+
+    for stage in PIPELINE_STAGES:
+        name = stage["name"]
+        start = time.perf_counter()
+        if any(statuses[upstream] in ("failed", "blocked") for upstream in stage["depends_on"]):
+            statuses[name] = "blocked"
+            messages.append(f"Stage {name}: not run, an upstream stage failed.")
+            continue
+
+        try:
+            input_hash = _content_hash(stage["inputs"]())
+            record = state["stages"].get(name)
+            if not force and record is not None and record["input_hash"] == input_hash:
+                if record["output_hash"] == _content_hash(stage["outputs"]()):
+                    statuses[name] = "skipped"
+                    messages.append(f"Stage {name}: skipped, inputs unchanged ({input_hash}), checked in {time.perf_counter() - start:.3f}s.")
+                    continue
+
+            outcome, run_messages = stage["run"]()
+            stage_messages.extend(run_messages)
+            if outcome is False:
+                statuses[name] = "failed"
+                messages.append(f"Stage {name}: failed after {time.perf_counter() - start:.3f}s.")
+                continue
+
+            seconds = time.perf_counter() - start
+            state["stages"][name] = {
+                "input_hash": input_hash,
+                "output_hash": _content_hash(stage["outputs"]()),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+                "seconds": round(seconds, 3),
+            }
+            save_pipeline_state(backend, state)
+            statuses[name] = "ran"
+            messages.append(f"Stage {name}: ran in {seconds:.3f}s.")
+        except Exception as e:
+            statuses[name] = "failed"
+            messages.append(f"Stage {name}: failed after {time.perf_counter() - start:.3f}s. Details: {e}")
+
+    messages.extend(stage_messages)
+    return all(status in ("ran", "skipped") for status in statuses.values()), messages
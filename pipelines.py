@@ -0,0 +1,479 @@
+import os
+import numpy as np
+from datetime import datetime
+
+from storage_backend import get_storage_backend
+from load_data import list_raw_files, load_raw_files, iter_raw_file_chunks
+from preprocess_data import preprocess_data, preprocess_data_streaming, save_processed_data, save_processed_data_chunks, save_scalar, save_encoder
+from train_model import load_processed_data, iter_processed_data_chunks, train_model, train_model_streaming, export_model, export_model_perormance, export_scoring_kernel, export_model_bundle
+from training_engine import get_train_algorithms, train_candidates
+from consume_model import predict_batch_using_pretrained_model, get_prod_model_version
+from model_registry import register_staged_models
+from host_model import get_model_evaluation_metrics, move_model_from_stage_to_prod, compare_model_performances
+from performance_gate import run_performance_gate, PERF_GATE_ENABLED
+from score_index import build_score_index_arrays, write_score_index, SCORE_INDEX_FOLDER_PATH, SCORE_INDEX_CHUNK_SIZE
+from ingestion_manifest import run_incremental_ingestion, record_full_rebuild, load_ingestion_manifest, get_processed_partition_paths
+
+# The long running pipelines behind /lnp_data and /train. They only depend on their
+# arguments and the environment, so they can run inline in a request or in a job process.
+
+
+def get_processed_data_file_path() -> str:
+    """Function to get the gs:// path of the processed data file /lnp_data writes and /train reads."""
+
+    return "gs://{}/{}{}".format(
+        os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        os.getenv("PROCESSED_DATA_FILE_NAME", "processed_data.csv")
+    )
+
+
+def run_load_and_process_data(mode: str = None, chunk_size: int = None):
+    """Function to load and preprocess the raw data, returning (outcome, messages).
+
+    mode is incremental or full (default LNP_DATA_MODE), chunk_size > 0 streams a full
+    rebuild in chunks of that many records (default PREPROCESS_CHUNK_SIZE).
+    """
+
+    if mode is None:
+        mode = os.getenv("LNP_DATA_MODE", "incremental")
+    messages = ["Load and Process Data", f"Mode: {mode}"]
+
+    if mode == "incremental":
+        incremental_outcome, incremental_messages, needs_full_rebuild = run_incremental_ingestion(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            raw_data_folder_path=os.getenv("RAW_DATA_FOLDER_PATH", "data/raw/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+            file_name=os.getenv("PROCESSED_DATA_FILE_NAME", "processed_data.csv")
+        )
+        messages.extend(incremental_messages)
+        if incremental_outcome is False:
+            return False, messages
+        if needs_full_rebuild is False:
+            return True, messages
+        messages.append("Running full rebuild.")
+    elif mode != "full":
+        messages.append(f"Unknown mode: {mode}. Use incremental or full.")
+        return False, messages
+
+    raw_files = list_raw_files(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        raw_data_folder_path=os.getenv("RAW_DATA_FOLDER_PATH", "data/raw/")
+    )
+    if chunk_size is None:
+        chunk_size = int(os.getenv("PREPROCESS_CHUNK_SIZE", "0"))
+    if chunk_size > 0:
+        # Out-of-core: two passes over the raw files, memory bounded by chunk_size.
+        messages.append(f"Streaming preprocessing of {len(raw_files)} files in chunks of {chunk_size} records.")
+        processed_chunks, scaler, le = preprocess_data_streaming(
+            read_chunks=lambda: iter_raw_file_chunks(
+                project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+                bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+                csv_blobs=raw_files,
+                chunk_size=chunk_size
+            )
+        )
+        outcome, msg, processed_records = save_processed_data_chunks(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+            chunks=processed_chunks,
+            file_name=os.getenv("PROCESSED_DATA_FILE_NAME", "processed_data.csv")
+        )
+        if outcome:
+            messages.append(f"Processed data saved successfully. After preprocessing data has {processed_records} records.")
+        else:
+            messages.append(msg)
+            return False, messages
+        ingestion_report = []
+    else:
+        raw_data = load_raw_files(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            csv_blobs=raw_files
+        )
+
+        if raw_data.empty is True:
+            messages.append("No data loaded.")
+            return False, messages
+        messages.append(f"Loaded {len(raw_data)} records.")
+
+        processed_data, scaler, le = preprocess_data(
+            df=raw_data, input_scalar=None, input_encoder=None, log_memory=True
+        )
+
+        if processed_data.empty is True:
+            messages.append("No data after preprocessing.")
+            return False, messages
+        messages.append(f"Loaded {len(raw_data)} records. After preprocessing data has {len(processed_data)} records.")
+
+        outcome, msg = save_processed_data(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+            df=processed_data,
+            file_name=os.getenv("PROCESSED_DATA_FILE_NAME", "processed_data.csv")
+        )
+        if outcome:
+            messages.append("Processed data saved successfully.")
+        else:
+            messages.append(msg)
+            return False, messages
+        ingestion_report = raw_data.attrs.get("ingestion_report", [])
+    
+    save_scalar_outcome, save_scalar_message = save_scalar(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        scaler=scaler
+    )
+    if save_scalar_outcome:
+        messages.append("Scalar saved successfully.")
+    else:
+        messages.append(save_scalar_message)
+        return False, messages
+    
+    save_encoder_outcome, save_encoder_message = save_encoder(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        encoder=le
+    )
+    if save_encoder_outcome:
+        messages.append("Encoder saved successfully.")
+    else:
+        messages.append(save_encoder_message)
+        return False, messages
+
+    manifest_outcome, manifest_message = record_full_rebuild(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        csv_blobs=raw_files,
+        base_file_name=os.getenv("PROCESSED_DATA_FILE_NAME", "processed_data.csv"),
+        ingestion_report=ingestion_report
+    )
+    messages.append(manifest_message)
+    if manifest_outcome is False:
+        return False, messages
+
+    return True, messages
+
+
+def export_candidate(algorithm: str, timestamp: str, model, X_test, y_test, messages: list, y_pred=None) -> bool:
+    """Function to export a trained model and its evaluation to the stage folder, appending to messages."""
+
+    export_model_outcome, export_model_msg = export_model(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        algorithm=algorithm,
+        timestamp=timestamp,
+        model=model
+    )
+    if export_model_outcome is False:
+        messages.append(export_model_msg)
+        return False
+    messages.append(f"Model exported successfully.{export_model_msg}")
+
+    export_model_perormance_outcome, export_model_perormance_msg = export_model_perormance(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        algorithm=algorithm,
+        timestamp=timestamp,
+        model=model,
+        X_test=X_test,
+        y_test=y_test,
+        y_pred=y_pred
+    )
+    if export_model_perormance_outcome is False:
+        messages.append(export_model_perormance_msg)
+        return False
+    messages.append(f"Model evaluation exported successfully.{export_model_perormance_msg}")
+    return True
+
+
+def train_in_memory(df, messages: list):
+    """Function to train the TRAIN_ALGORITHMS candidates on a loaded DataFrame, appending to messages.
+
+    Returns (outcome, msg, candidates, X_test, y_test) with the candidates best first.
+    """
+
+    algorithms = get_train_algorithms()
+    if len(algorithms) == 1:
+        train_model_outcome, train_msg, *trained = train_model(
+            df=df,
+            algorithm=algorithms[0]
+        )
+        if train_model_outcome is False:
+            return False, train_msg, [], None, None
+        model, X_test, y_test = trained
+        return True, train_msg, [{"algorithm": algorithms[0], "model": model}], X_test, y_test
+
+    train_model_outcome, train_msg, candidates, X_test, y_test = train_candidates(df=df, algorithms=algorithms)
+    for candidate in candidates:
+        if candidate["model"] is None:
+            messages.append(f"Candidate {candidate['algorithm']} failed: {candidate['error']}")
+        else:
+            messages.append(
+                f"Candidate {candidate['algorithm']} trained in {candidate['fit_seconds']}s, "
+                f"F1-Score {candidate['metrics']['F1-Score']:.4f}, Accuracy {candidate['metrics']['Accuracy']:.4f}."
+            )
+    if train_model_outcome is False:
+        return False, train_msg, candidates, X_test, y_test
+    candidates = [candidate for candidate in candidates if candidate["model"] is not None]
+    messages.append(f"Best candidate: {candidates[0]['algorithm']}.")
+    return True, train_msg, candidates, X_test, y_test
+
+
+def run_train_model(mode: str = None, epochs: int = None):
+    """Function to train, export and evaluate a model on the processed data, returning (outcome, messages).
+
+    mode is in_memory or streaming (default TRAIN_MODE). In memory, several TRAIN_ALGORITHMS
+    are trained in parallel and all of them are exported, the best one last so that
+    /publish picks it up. Streaming trains TRAIN_STREAMING_ALGORITHM with partial_fit for
+    epochs passes (default TRAIN_EPOCHS) over chunks of TRAIN_CHUNK_SIZE records.
+    """
+
+    if mode is None:
+        mode = os.getenv("TRAIN_MODE", "in_memory")
+    messages = ["Train Model Started", f"Mode: {mode}"]
+    manifest = load_ingestion_manifest(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/")
+    )
+    processed_data_file_path = get_processed_data_file_path()
+    partition_file_paths = get_processed_partition_paths(os.getenv("BUCKET_NAME", "customer-churn-demo"), manifest)
+
+    if mode == "streaming":
+        if epochs is None:
+            epochs = int(os.getenv("TRAIN_EPOCHS", "5"))
+        algorithm = os.getenv("TRAIN_STREAMING_ALGORITHM", "sgd_classifier")
+        chunk_size = int(os.getenv("TRAIN_CHUNK_SIZE", "100000"))
+        messages.append(f"Streaming training of {algorithm} for {epochs} epochs in chunks of {chunk_size} records.")
+        train_model_outcome, train_msg, *trained = train_model_streaming(
+            read_chunks=lambda: iter_processed_data_chunks(
+                project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+                processed_data_file_paths=[processed_data_file_path] + partition_file_paths,
+                chunk_size=chunk_size
+            ),
+            algorithm=algorithm,
+            epochs=epochs,
+            test_fraction=float(os.getenv("TRAIN_TEST_FRACTION", "0.2"))
+        )
+        if train_model_outcome is False:
+            messages.append(train_msg)
+            return False, messages
+        model, X_test, y_test, y_pred = trained
+        candidates = [{"algorithm": algorithm, "model": model, "y_pred": y_pred}]
+        messages.append(f"Model trained successfully.{train_msg}")
+    elif mode != "in_memory":
+        messages.append(f"Unknown mode: {mode}. Use in_memory or streaming.")
+        return False, messages
+    else:
+        load_processed_data_outcome, load_msg, df = load_processed_data(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            processed_data_file_path=processed_data_file_path,
+            partition_file_paths=partition_file_paths
+        )
+        if load_processed_data_outcome is False:
+            return False, ["No data loaded."]
+        messages.append(f"Processed data loaded successfully. Loaded {len(df)} records.")
+        train_model_outcome, train_msg, candidates, X_test, y_test = train_in_memory(df, messages)
+        if train_model_outcome is False:
+            messages.append(train_msg)
+            return False, messages
+        messages.append(f"Model trained successfully.{train_msg}")
+
+    timestamp = f"{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+    # /publish promotes the most recently exported evaluation, so the best candidate goes last.
+    for candidate in reversed(candidates):
+        if export_candidate(candidate["algorithm"], timestamp, candidate["model"], X_test, y_test, messages, candidate.get("y_pred")) is False:
+            return False, messages
+    best = candidates[0]
+
+    # The scoring kernel is an optimization for serving, the joblib model remains the fallback.
+    export_scoring_kernel_outcome, export_scoring_kernel_msg = export_scoring_kernel(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        algorithm=best["algorithm"],
+        timestamp=timestamp,
+        model=best["model"],
+        X_test=X_test
+    )
+    if export_scoring_kernel_outcome is False:
+        messages.append(export_scoring_kernel_msg)
+    else:
+        messages.append(f"Scoring kernel exported successfully.{export_scoring_kernel_msg}")
+
+    # Serving loads the bundle in one fetch; without it, it falls back to the separate files.
+    export_model_bundle_outcome, export_model_bundle_msg = export_model_bundle(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+        algorithm=best["algorithm"],
+        timestamp=timestamp,
+        model=best["model"]
+    )
+    if export_model_bundle_outcome is False:
+        messages.append(export_model_bundle_msg)
+    else:
+        messages.append(f"Model bundle exported successfully.{export_model_bundle_msg}")
+
+    # /publish promotes the version the registry points latest at, so it has to point at this run's best.
+    register_outcome, register_msg = register_staged_models(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        version_ids=[f"{candidate['algorithm']}_{timestamp}" for candidate in candidates],
+        latest=f"{best['algorithm']}_{timestamp}"
+    )
+    messages.append(register_msg)
+    if register_outcome is False:
+        return False, messages
+
+    return True, messages
+
+
+def run_build_score_index():
+    """Function to score the latest raw data with the production model into the CustomerID score index, returning (outcome, messages)."""
+
+    messages = ["Build Score Index Started"]
+    try:
+        backend = get_storage_backend(
+            os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            os.getenv("BUCKET_NAME", "customer-churn-demo")
+        )
+        raw_files = list_raw_files(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            raw_data_folder_path=os.getenv("RAW_DATA_FOLDER_PATH", "data/raw/")
+        )
+        # Resolved first, so the version matches the artifacts the batch scoring pins below.
+        model_version = get_prod_model_version(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/")
+        )
+        results = predict_batch_using_pretrained_model(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+            input_chunks=(
+                chunk.dropna()
+                for chunk in iter_raw_file_chunks(
+                    project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+                    bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+                    csv_blobs=raw_files,
+                    chunk_size=SCORE_INDEX_CHUNK_SIZE
+                )
+            )
+        )
+        customer_ids, predictions, probabilities = [], [], []
+        for result in results:
+            customer_ids.append(result['CustomerID'].to_numpy())
+            predictions.append(result['Prediction'].to_numpy())
+            # Models without predict_proba only have predictions.
+            probabilities.append(result['Probability'].to_numpy() if 'Probability' in result else np.full(len(result), np.nan))
+        if not customer_ids:
+            messages.append(f"No records to score in {len(raw_files)} raw files.")
+            return False, messages
+
+        arrays, offset = build_score_index_arrays(
+            np.concatenate(customer_ids), np.concatenate(predictions), np.concatenate(probabilities)
+        )
+        pointer = write_score_index(backend, SCORE_INDEX_FOLDER_PATH, arrays, offset, model_version)
+        messages.append(
+            f"Scored {sum(len(ids) for ids in customer_ids)} records from {len(raw_files)} raw files into "
+            f"{pointer['records']} customers, model version {model_version}, layout {pointer['layout']}."
+        )
+        messages.append(f"Score index written to {backend.uri(pointer['folder'])}")
+        return True, messages
+    except Exception as e:
+        messages.append(f"ERROR: Failed to build the score index. Details: {e}")
+        return False, messages
+
+
+def publish_model():
+    """Function to compare the latest stage model with the production model and promote it if it is better.
+
+    A stage model that is better is only promoted when its load time, latency, throughput and
+    memory stay within the budgets of performance_gate.py. Returns (outcome, messages, promoted).
+    """
+
+    messages = ["Publish Model Started"]
+    prod_eval_load_outcome, prod_model_evaluation_df, prod_model_evaluation_blob = get_model_evaluation_metrics(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+        registry_pointer="production"
+    )
+
+    stage_eval_load_outcome, stage_model_evaluation_df, stage_model_evaluation_blob = get_model_evaluation_metrics(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        registry_pointer="latest"
+    )
+
+    if prod_model_evaluation_df.empty is True:
+        messages.append("No production model evaluation data found so publishing the latest stage model as is.")
+    else:
+        messages.append("Production model evaluation data found. Comparing stage and production model evaluations.")
+        do_promote_new_model_to_prod, comparison_message = compare_model_performances(
+            prod_model_evaluation_df=prod_model_evaluation_df,
+            stage_model_evaluation_df=stage_model_evaluation_df,
+            comparison_metric=["Accuracy", "F1-Score"]
+        )
+        messages.append(comparison_message)
+        if not do_promote_new_model_to_prod:
+            messages.append("Stage model is not bettter, so NOT promoted to production.")
+            messages.append("Current Model Served in Production:SAME AS BEFORE")
+            return True, messages, False
+
+    if PERF_GATE_ENABLED:
+        gate_outcome, gate_message, within_budget = run_performance_gate(
+            project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+            bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+            stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+            prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/"),
+            processed_data_folder_path=os.getenv("PROCESSED_DATA_FOLDER_PATH", "data/processed/"),
+            raw_data_folder_path=os.getenv("RAW_DATA_FOLDER_PATH", "data/raw/"),
+            stage_eval_blob=stage_model_evaluation_blob,
+            compare_with_prod=prod_model_evaluation_df.empty is False
+        )
+        messages.append(gate_message)
+        if gate_outcome is False:
+            return False, messages, False
+        if not within_budget:
+            messages.append("Stage model is slower or heavier than the budget allows, so NOT promoted to production.")
+            messages.append("Current Model Served in Production:SAME AS BEFORE")
+            return True, messages, False
+
+    if prod_model_evaluation_df.empty is False:
+        messages.append("Promoting stage model to production.")
+
+    movement_outcome, movement_messgae, live_model = move_model_from_stage_to_prod(
+        project_id=os.getenv("PROJECT_ID", "nimble-octagon-253816"),
+        bucket_name=os.getenv("BUCKET_NAME", "customer-churn-demo"),
+        stage_model_folder_path=os.getenv("STAGE_MODEL_FOLDER_PATH", "model/stage/"),
+        stage_eval_blob=stage_model_evaluation_blob,
+        prod_model_folder_path=os.getenv("PROD_MODEL_FOLDER_PATH", "model/prod/")
+    )
+    if movement_outcome is False:
+        messages.append(movement_messgae)
+        return False, messages, False
+    messages.append("Stage model promoted to production successfully.")
+    messages.append(f"Current Model Served in Production:{live_model}")
+    return True, messages, True
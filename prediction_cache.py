@@ -0,0 +1,121 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from schema import COMPACT_DTYPES
+from metrics import increment_counter
+
+# Process-wide LRU cache of /predict results. Entries are keyed by a fingerprint of the
+# typed feature values of a row and belong to one production model version; when the
+# version changes (a new model was published) every entry is dropped. At most
+# PREDICTION_CACHE_MAX_ENTRIES rows are kept, each for PREDICTION_CACHE_TTL_SECONDS;
+# PREDICTION_CACHE_MAX_ENTRIES=0 turns the cache off.
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "100000"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "600"))
+
+# CustomerID does not change the prediction and Churn is the label, neither is part of the key.
+FEATURE_COLUMNS = [col for col in COMPACT_DTYPES if col not in ("CustomerID", "Churn")]
+
+_prediction_cache_lock = threading.Lock()
+_prediction_cache = {
+    "model_version": None,
+    "entries": OrderedDict(),
+}
+_prediction_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "expired": 0,
+    "evictions": 0,
+    "invalidations": 0,
+}
+
+
+def feature_fingerprints(input_columns: dict):
+    """Function to fingerprint every row of typed input columns (name -> 1-D array), None if a feature is missing."""
+
+    if any(col not in input_columns for col in FEATURE_COLUMNS):
+        return None
+    rows = zip(*(input_columns[col].tolist() for col in FEATURE_COLUMNS))
+    return [hashlib.blake2b(repr(row).encode(), digest_size=16).digest() for row in rows]
+
+
+def _use_model_version(model_version: str):
+    """Function to drop all entries when the model version changed. Must be called holding the lock."""
+
+    if _prediction_cache["model_version"] != model_version:
+        if _prediction_cache["entries"]:
+            _prediction_cache_stats["invalidations"] += 1
+            print(f"Prediction cache invalidated, model version {_prediction_cache['model_version']} -> {model_version}.")
+        _prediction_cache["entries"].clear()
+        _prediction_cache["model_version"] = model_version
+
+
+def get_cached_predictions(model_version: str, fingerprints: list):
+    """Function to get the cached results of all rows, None unless every row is cached for this model version."""
+
+    if PREDICTION_CACHE_MAX_ENTRIES <= 0 or not fingerprints:
+        return None
+
+    now = time.monotonic()
+    results = []
+    with _prediction_cache_lock:
+        _use_model_version(model_version)
+        entries = _prediction_cache["entries"]
+        for fingerprint in fingerprints:
+            entry = entries.get(fingerprint)
+            if entry is not None and entry[0] <= now:
+                del entries[fingerprint]
+                _prediction_cache_stats["expired"] += 1
+                entry = None
+            if entry is None:
+                _prediction_cache_stats["misses"] += 1
+                increment_counter("churn_prediction_cache_lookups_total", result="miss")
+                return None
+            entries.move_to_end(fingerprint)
+            results.append(entry[1])
+        _prediction_cache_stats["hits"] += 1
+        increment_counter("churn_prediction_cache_lookups_total", result="hit")
+    return results
+
+
+def store_predictions(model_version: str, fingerprints: list, results: list):
+    """Function to cache one result per row for this model version, evicting the least recently used rows."""
+
+    if PREDICTION_CACHE_MAX_ENTRIES <= 0 or not fingerprints:
+        return
+
+    expires_at = time.monotonic() + PREDICTION_CACHE_TTL_SECONDS
+    with _prediction_cache_lock:
+        _use_model_version(model_version)
+        entries = _prediction_cache["entries"]
+        for fingerprint, result in zip(fingerprints, results):
+            entries[fingerprint] = (expires_at, result)
+            entries.move_to_end(fingerprint)
+        while len(entries) > PREDICTION_CACHE_MAX_ENTRIES:
+            entries.popitem(last=False)
+            _prediction_cache_stats["evictions"] += 1
+
+
+def get_prediction_cache_stats():
+    """Function to get the prediction cache counters and size."""
+
+    with _prediction_cache_lock:
+        stats = dict(_prediction_cache_stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = len(_prediction_cache["entries"])
+        stats["max_entries"] = PREDICTION_CACHE_MAX_ENTRIES
+        stats["ttl_seconds"] = PREDICTION_CACHE_TTL_SECONDS
+        stats["model_version"] = _prediction_cache["model_version"]
+        return stats
+
+
+def clear_prediction_cache():
+    """Function to drop all cached predictions."""
+
+    with _prediction_cache_lock:
+        if _prediction_cache["entries"]:
+            _prediction_cache_stats["invalidations"] += 1
+        _prediction_cache["entries"].clear()
@@ -1,16 +1,55 @@
 import pandas as pd
 import pickle
-import io
 from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import LabelEncoder
-from google.cloud import storage
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from storage_backend import get_storage_backend
+from categorical_encoding import CategoricalEncoder, ENCODER_FILE_NAME, LEGACY_ENCODER_FILE_NAME, dump_encoder, load_encoder_payload
+from metrics import timed_stage, print_dataframe, DEBUG_DATAFRAME_PRINTS
+from schema import apply_compact_dtypes, log_memory_usage, COMPACT_DTYPES_ENABLED, FEATURE_DTYPE, FLAG_DTYPE, CODE_DTYPE
+
+# Feature engineering rules: derived column -> (source column, comparison, threshold).
+# Shared with the compiled scoring kernel so both apply the exact same rules.
+FEATURE_RULE_OPERATORS = {
+    "lt": np.less,
+    "gt": np.greater,
+}
+ENGINEERED_FEATURES = {
+    'RecentlyActive': ('Last Interaction', 'lt', 5),
+    'HighSupportUser': ('Support Calls', 'gt', 5),
+}
+
+def add_engineered_features(df: pd.DataFrame):
+    """Function to add the engineered feature columns in place."""
+
+    flag_dtype = FLAG_DTYPE if COMPACT_DTYPES_ENABLED else 'int64'
+    for feature, (source_col, operator, threshold) in ENGINEERED_FEATURES.items():
+        df[feature] = FEATURE_RULE_OPERATORS[operator](df[source_col], threshold).astype(flag_dtype)
+
+
+def get_numerical_columns(df: pd.DataFrame):
+    """Function to get the numerical columns to scale, i.e. all but the label and engineered flags."""
+
+    numerical_cols = df.select_dtypes(include=['number']).columns
+    numerical_cols = numerical_cols.drop('Churn')
+    numerical_cols = numerical_cols.drop(list(ENGINEERED_FEATURES))
+    return numerical_cols
+
+
+@timed_stage("preprocess")
 def preprocess_data(
         df: pd.DataFrame,
         input_scalar: any = None,
-        input_encoder: any = None
+        input_encoder: any = None,
+        log_memory: bool = False
     ):
-    """Function to preprocess data."""
+    """Function to preprocess data.
+
+    log_memory prints the DataFrame size and process RSS after each step. Pipeline stages
+    turn it on; the prediction paths leave it off, a deep memory scan per request is too slow.
+    """
 
     if df.empty is True:
         print("Error: Input DataFrame is empty.")
@@ -22,124 +61,279 @@ def preprocess_data(
     df = df.dropna()
     print(f"Dropped missing values. Remaining records: {len(df)}")
 
-    df = df.drop_duplicates()
+    # From here on df is a private copy, so the remaining steps can work in place.
+    df = apply_compact_dtypes(df)
+    if log_memory:
+        log_memory_usage("preprocess: dropna + compact dtypes", df)
+
+    df.drop_duplicates(inplace=True)
     print(f"Dropped duplicate records. Remaining records: {len(df)}")
 
-    df = df.drop(['CustomerID'], axis=1)
+    df.drop(columns=['CustomerID'], inplace=True)
     print(f"Dropped CustomerID column. Remaining records: {len(df)}")
 
-    print(df.head(5))
+    print_dataframe("", df.head(5))
 
     # Feature Engineering:
-    df['RecentlyActive'] = (df['Last Interaction'] < 5).astype(int)
-    df['HighSupportUser'] = (df['Support Calls'] > 5).astype(int)
+    add_engineered_features(df)
 
-    numerical_cols = df.select_dtypes(include=['number']).columns
-    numerical_cols = numerical_cols.drop('Churn')
-    numerical_cols = numerical_cols.drop('RecentlyActive')
-    numerical_cols = numerical_cols.drop('HighSupportUser')
+    numerical_cols = get_numerical_columns(df)
 
-    print(numerical_cols)
+    if DEBUG_DATAFRAME_PRINTS:
+        print(numerical_cols)
+    features = df[numerical_cols].astype(FEATURE_DTYPE if COMPACT_DTYPES_ENABLED else 'float64')
     if input_scalar is not None:
         print("Using provided scaler for normalization.")
         scaler = input_scalar
-        scaled_data = scaler.transform(df[numerical_cols])
+        scaled_data = scaler.transform(features)
     else:
         scaler = StandardScaler()
-        scaled_data = scaler.fit_transform(df[numerical_cols])
+        scaled_data = scaler.fit_transform(features)
 
-    # 3. Convert the resulting NumPy array back into a DataFrame, 
-    #    using the original index and column names
-    scaled_df = pd.DataFrame(
-        scaled_data, 
-        columns=numerical_cols, 
-        index=df.index
-    )
+    # Replace the numerical columns one by one with their scaled values,
+    # without building an intermediate scaled DataFrame
+    for position, col in enumerate(numerical_cols):
+        df[col] = scaled_data[:, position]
+    del features, scaled_data
 
-    df[numerical_cols] = scaled_df[numerical_cols]
-
-    print(df.head(5))
+    print_dataframe("", df.head(5))
     print(f"Normalized numerical columns. Remaining records: {len(df)}")
+    if log_memory:
+        log_memory_usage("preprocess: scale", df)
 
-    categorical_cols = df.select_dtypes(include=['object']).columns
-    print(categorical_cols)
+    categorical_cols = df.select_dtypes(include=['object', 'category']).columns
+    if DEBUG_DATAFRAME_PRINTS:
+        print(categorical_cols)
     
     if input_encoder is not None:
         print("Using provided encoder for categorical encoding.")
-        le = input_encoder
+        encoder = input_encoder
     else:
-        le = LabelEncoder()
+        encoder = CategoricalEncoder.fit(df, categorical_cols)
 
-    for col in categorical_cols:
-        # Apply Label Encoding to each categorical column
-        df[col] = le.fit_transform(df[col])
+    # Codes are looked up in the fitted classes of every column, the encoder itself is never refitted.
+    code_dtype = CODE_DTYPE if COMPACT_DTYPES_ENABLED else 'int64'
+    df = encoder.transform(df, categorical_cols, code_dtype)
 
-    print(df.head(5))
+    print_dataframe("", df.head(5))
     print(f"Encoded categorical columns. Remaining records: {len(df)}")
+    if log_memory:
+        log_memory_usage("preprocess: encode", df)
 
     print("--- Preprocessing Complete ---")
 
-    return df, scaler,le
+    return df, scaler, encoder
+
+def _drop_seen_duplicates(df: pd.DataFrame, seen_runs: list) -> pd.DataFrame:
+    """Function to drop rows already seen in earlier chunks (or earlier in this chunk).
+
+    Rows are tracked by their 64-bit content hash, so the state kept across chunks is
+    8 bytes per distinct record rather than the records themselves. The hashes are kept
+    in sorted runs that are merged like a binary counter: a new run absorbs the previous
+    ones while they are no larger, so there are O(log chunks) runs to search and every
+    hash is merged O(log chunks) times instead of once per later chunk.
+    """
+
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    seen_before = np.zeros(len(hashes), dtype=bool)
+    for run in seen_runs:
+        positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+        seen_before |= run[positions] == hashes
+    keep = ~seen_before & ~pd.Series(hashes).duplicated().to_numpy()
+
+    run = np.sort(hashes[keep])
+    if len(run):
+        while seen_runs and len(seen_runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([seen_runs.pop(), run]))
+        seen_runs.append(run)
+    return df[keep]
+
+
+def _iter_clean_chunks(read_chunks):
+    """Function to yield raw chunks without missing values and without duplicates across chunks."""
+
+    seen_runs = []
+    for chunk in read_chunks():
+        chunk = chunk.dropna()
+        chunk = _drop_seen_duplicates(chunk, seen_runs)
+        if chunk.empty is False:
+            yield chunk
+
+
+def fit_preprocessing_streaming(read_chunks):
+    """Function to fit the scaler and categorical classes over raw chunks without loading them all.
+
+    read_chunks is a callable returning a fresh iterator of raw DataFrame chunks. The scaler
+    statistics are accumulated with StandardScaler.partial_fit and the categorical classes
+    from the value counts summed over every chunk.
+    """
+
+    scaler = StandardScaler()
+    categorical_counts = {}
+    records = 0
+    for chunk in _iter_clean_chunks(read_chunks):
+        chunk = chunk.drop(['CustomerID'], axis=1)
+        add_engineered_features(chunk)
+        chunk = apply_compact_dtypes(chunk)
+        numerical_cols = get_numerical_columns(chunk)
+        scaler.partial_fit(chunk[numerical_cols].astype(FEATURE_DTYPE if COMPACT_DTYPES_ENABLED else 'float64'))
+        for col in chunk.select_dtypes(include=['object', 'category']).columns:
+            counts = categorical_counts.setdefault(col, {})
+            for value, count in chunk[col].value_counts(sort=False).items():
+                if count > 0:
+                    counts[value] = counts.get(value, 0) + int(count)
+        records += len(chunk)
+        print(f"Fitted preprocessing on {records} records.")
+
+    return scaler, CategoricalEncoder.fit_counts(categorical_counts), records
+
+
+def preprocess_data_streaming(read_chunks):
+    """Function to preprocess data chunk by chunk, keeping memory bounded by the chunk size.
+
+    A first pass over read_chunks() fits the scaler and categorical classes, a second pass
+    transforms every chunk with preprocess_data using them. The result is the same as
+    preprocess_data on the concatenated data, up to floating point rounding of the
+    incrementally computed scaler statistics. Returns a generator of processed chunks
+    together with the fitted scaler and encoder.
+    """
+
+    print("--- Preprocessing Data (streaming) ---")
+    scaler, encoder, records = fit_preprocessing_streaming(read_chunks)
+    print(f"First pass complete: fitted scaler and {len(encoder.column_classes_)} categorical columns on {records} records.")
+
+    def transform_chunks():
+        for chunk in _iter_clean_chunks(read_chunks):
+            processed_chunk, chunk_scaler, chunk_encoder = preprocess_data(df=chunk, input_scalar=scaler, input_encoder=encoder)
+            yield processed_chunk
+
+    return transform_chunks(), scaler, encoder
+
+
+def write_processed_data(
+        df: pd.DataFrame,
+        output_path: str,
+        compression: str = "zstd",
+        row_group_size: int = 100_000,
+        file=None
+    ):
+    """Function to write processed data in the format given by the extension of output_path.
+
+    The data goes to file when an open binary file is given, otherwise to output_path itself.
+    """
+
+    target = output_path if file is None else file
+    if output_path.endswith(".parquet"):
+        df.to_parquet(target, index=False, compression=compression, row_group_size=row_group_size)
+    elif output_path.endswith((".arrow", ".feather")):
+        df.reset_index(drop=True).to_feather(target, compression=compression, chunksize=row_group_size)
+    else:
+        df.to_csv(target, index=False)
+
 
 def save_processed_data(
         project_id: str,
         bucket_name: str,
         processed_data_folder_path: str,
         df: pd.DataFrame,
-        file_name: str = "processed_data.csv"
+        file_name: str = "processed_data.csv",
+        compression: str = "zstd",
+        row_group_size: int = 100_000
     ):
-    """Function to save processed data to a CSV file."""
+    """Function to save processed data to storage.
+
+    The format follows the file extension: .csv (text), .parquet (columnar, compressed,
+    split into row groups of row_group_size records) or .arrow / .feather (Arrow IPC,
+    compressed record batches of row_group_size records). The upload replaces any
+    previous file only once it is complete.
+    """
 
     if df.empty is True:
         return False, "Error: Input DataFrame is empty. Cannot save."
 
+    backend = get_storage_backend(project_id, bucket_name)
+    blob_name = f"{processed_data_folder_path}{file_name}"
+    output_path = backend.uri(blob_name)
     try:    
-        output_path = f"gs://{bucket_name}/{processed_data_folder_path}{file_name}"
-        blob_name = f"{processed_data_folder_path}{file_name}"
-        client = storage.Client(project=project_id)
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        if blob.exists():
-            print(f"File already exists at {bucket_name}/{blob_name}. Deleting old file...")
-            blob.delete()
-            print("Old file deleted successfully.")
-            
-        df.to_csv(output_path, index=False)
+        with backend.open_write(blob_name) as file:
+            write_processed_data(df, blob_name, compression=compression, row_group_size=row_group_size, file=file)
         return True, f"Processed data saved to {output_path}"
     except Exception as e:
         return False, f"ERROR: Failed to save processed data to {output_path}. Details: {e}"
     
 
+def save_processed_data_chunks(
+        project_id: str,
+        bucket_name: str,
+        processed_data_folder_path: str,
+        chunks,
+        file_name: str = "processed_data.csv",
+        compression: str = "zstd",
+        row_group_size: int = 100_000
+    ):
+    """Function to stream processed data chunks into a single file in storage.
+
+    Chunks are written as they arrive (CSV rows, Parquet row groups or Arrow record
+    batches), so only one chunk is held in memory. Returns the number of records written.
+    """
+
+    backend = get_storage_backend(project_id, bucket_name)
+    blob_name = f"{processed_data_folder_path}{file_name}"
+    output_path = backend.uri(blob_name)
+    records = 0
+    try:
+        with backend.open_write(blob_name) as file:
+            if file_name.endswith((".parquet", ".arrow", ".feather")):
+                writer, schema = None, None
+                for chunk in chunks:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        schema = table.schema
+                        if file_name.endswith(".parquet"):
+                            writer = pq.ParquetWriter(file, schema, compression=compression)
+                        else:
+                            options = pa.ipc.IpcWriteOptions(compression=compression)
+                            writer = pa.ipc.new_file(file, schema, options=options)
+                    table = table.cast(schema)
+                    if file_name.endswith(".parquet"):
+                        writer.write_table(table, row_group_size=row_group_size)
+                    else:
+                        writer.write_table(table, max_chunksize=row_group_size)
+                    records += len(chunk)
+                if writer is not None:
+                    writer.close()
+            else:
+                for chunk in chunks:
+                    chunk.to_csv(file, index=False, header=(records == 0))
+                    records += len(chunk)
+
+            if records == 0:
+                # Abort the upload so an empty file does not replace the previous one.
+                raise ValueError("no processed records to save")
+        return True, f"Processed data saved to {output_path}", records
+    except Exception as e:
+        return False, f"ERROR: Failed to save processed data to {output_path}. Details: {e}", records
+
+
 def save_scalar(
     project_id: str,
     bucket_name: str,
     processed_data_folder_path: str,
     scaler
 ):
-    """Function to save scaler object to GCS."""
+    """Function to save scaler object to storage."""
 
     file_name = "scaler.pkl"
-    print(f"Saving scaler to gs://{bucket_name}/{processed_data_folder_path}{file_name}")
+    backend = get_storage_backend(project_id, bucket_name)
+    blob_name = f"{processed_data_folder_path}{file_name}"
+    print(f"Saving scaler to {backend.uri(blob_name)}")
     
     try:
-        client = storage.Client(project=project_id)
-        bucket = client.bucket(bucket_name)
-        blob_name = f"{processed_data_folder_path}{file_name}"
-        blob = bucket.blob(blob_name)
-        
-        if blob.exists():
-            print(f"File already exists at {bucket_name}/{blob_name}. Deleting old file...")
-            blob.delete()
-            print("Old file deleted successfully.")
-        
-        buffer = io.BytesIO()
-        pickle.dump(scaler, buffer)
-        buffer.seek(0)
-        blob.upload_from_file(buffer, content_type='application/octet-stream')
-
-        return True, f"SUCCESS: {file_name} saved to gs://{bucket_name}/{blob_name}"
+        # A single upload replaces the old file, no need to check for and delete it first.
+        backend.write_bytes(blob_name, pickle.dumps(scaler), content_type='application/octet-stream')
+        return True, f"SUCCESS: {file_name} saved to {backend.uri(blob_name)}"
     except Exception as e:
-        return False, f"ERROR: Failed to save {file_name} to GCS. Details: {e}"
+        return False, f"ERROR: Failed to save {file_name} to storage. Details: {e}"
 
 def save_encoder(
     project_id: str,
@@ -147,27 +341,51 @@ def save_encoder(
     processed_data_folder_path: str,
     encoder
 ):
-    """Function to save scaler object to GCS."""
+    """Function to save the categorical encoder to storage as compact JSON."""
 
-    file_name = "encoder.pkl"
-    print(f"Saving encoder to gs://{bucket_name}/{processed_data_folder_path}{file_name}")
+    file_name = ENCODER_FILE_NAME
+    backend = get_storage_backend(project_id, bucket_name)
+    blob_name = f"{processed_data_folder_path}{file_name}"
+    print(f"Saving encoder to {backend.uri(blob_name)}")
     
     try:
-        client = storage.Client(project=project_id)
-        bucket = client.bucket(bucket_name)
-        blob_name = f"{processed_data_folder_path}{file_name}"
-        blob = bucket.blob(blob_name)
+        backend.write_bytes(blob_name, dump_encoder(encoder), content_type='application/json')
+        # Readers fall back to the pickled encoder of earlier builds, which must not outlive this one.
+        backend.delete(f"{processed_data_folder_path}{LEGACY_ENCODER_FILE_NAME}")
+        return True, f"SUCCESS: {file_name} saved to {backend.uri(blob_name)}"
+    except Exception as e:
+        return False, f"ERROR: Failed to save {file_name} to storage. Details: {e}"
 
-        if blob.exists():
-            print(f"File already exists at {bucket_name}/{blob_name}. Deleting old file...")
-            blob.delete()
-            print("Old file deleted successfully.")
+def load_scalar(
+    project_id: str,
+    bucket_name: str,
+    processed_data_folder_path: str
+):
+    """Function to load scaler object from storage."""
 
-        buffer = io.BytesIO()
-        pickle.dump(encoder, buffer)
-        buffer.seek(0)
-        blob.upload_from_file(buffer, content_type='application/octet-stream')
+    file_name = "scaler.pkl"
+    try:
+        backend = get_storage_backend(project_id, bucket_name)
+        blob_name = f"{processed_data_folder_path}{file_name}"
+        scaler = pickle.loads(backend.read_bytes(blob_name))
+        return True, f"SUCCESS: {file_name} loaded from {backend.uri(blob_name)}", scaler
+    except Exception as e:
+        return False, f"ERROR: Failed to load {file_name} from storage. Details: {e}", None
+
+def load_encoder(
+    project_id: str,
+    bucket_name: str,
+    processed_data_folder_path: str
+):
+    """Function to load the categorical encoder from storage, falling back to the pickled encoder of earlier builds."""
 
-        return True, f"SUCCESS: {file_name} saved to gs://{bucket_name}/{blob_name}"
+    file_name = ENCODER_FILE_NAME
+    try:
+        backend = get_storage_backend(project_id, bucket_name)
+        if backend.stat(f"{processed_data_folder_path}{file_name}") is None:
+            file_name = LEGACY_ENCODER_FILE_NAME
+        blob_name = f"{processed_data_folder_path}{file_name}"
+        encoder = load_encoder_payload(backend.read_bytes(blob_name), file_name)
+        return True, f"SUCCESS: {file_name} loaded from {backend.uri(blob_name)}", encoder
     except Exception as e:
-        return False, f"ERROR: Failed to save {file_name} to GCS. Details: {e}"
\ No newline at end of file
+        return False, f"ERROR: Failed to load {file_name} from storage. Details: {e}", None
\ No newline at end of file
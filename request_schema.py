@@ -0,0 +1,159 @@
+import os
+import json
+import numpy as np
+
+from schema import COMPACT_DTYPES, numpy_dtype
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Schema of the typed POST /predict request, compiled once from schema.py: the NumPy type
+# of every input column. Every feature column is required; CustomerID is optional and only
+# echoed back, Churn is the label and ignored. A body is decoded and validated straight into
+# one NumPy array per column, which is what the scoring kernel and the prediction cache take,
+# so no DataFrame is built on the request path.
+#
+# Accepted bodies, by content type:
+#   application/json, application/msgpack - one record, an array of records, or an object
+#                                           of column arrays.
+#   application/vnd.apache.arrow.stream,
+#   application/vnd.apache.arrow.file     - an Arrow IPC stream / file with one column per input column.
+PREDICT_MAX_RECORDS = int(os.getenv("PREDICT_MAX_RECORDS", "1000"))
+
+PREDICT_REQUEST_SCHEMA = {col: np.dtype(numpy_dtype(col)) for col in COMPACT_DTYPES if col != "Churn"}
+OPTIONAL_COLUMNS = ("CustomerID",)
+REQUIRED_COLUMNS = [col for col in PREDICT_REQUEST_SCHEMA if col not in OPTIONAL_COLUMNS]
+
+JSON_CONTENT_TYPES = ("application/json",)
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+ARROW_STREAM_CONTENT_TYPES = ("application/vnd.apache.arrow.stream",)
+ARROW_FILE_CONTENT_TYPES = ("application/vnd.apache.arrow.file",)
+
+
+class RequestValidationError(ValueError):
+    """A request body that does not match the predict request schema."""
+
+
+def _columns_from_document(document) -> dict:
+    """Function to turn a decoded JSON / msgpack document (record, records or columns) into column lists."""
+
+    if isinstance(document, dict):
+        if document and all(isinstance(values, list) for values in document.values()):
+            return document
+        document = [document]
+    if not isinstance(document, list) or not all(isinstance(record, dict) for record in document):
+        raise RequestValidationError("Body must be a record, an array of records or an object of column arrays.")
+    return {col: [record.get(col) for record in document] for col in PREDICT_REQUEST_SCHEMA if any(col in record for record in document)}
+
+
+def _columns_from_arrow(body: bytes, file_format: bool) -> dict:
+    """Function to read the input columns of an Arrow IPC stream or file as NumPy arrays."""
+
+    import pyarrow as pa
+
+    reader = pa.ipc.open_file(pa.py_buffer(body)) if file_format else pa.ipc.open_stream(pa.py_buffer(body))
+    table = reader.read_all()
+    return {
+        col: table.column(col).to_numpy(zero_copy_only=False)
+        for col in PREDICT_REQUEST_SCHEMA if col in table.column_names
+    }
+
+
+def _validate_column(col: str, values, dtype: np.dtype) -> np.ndarray:
+    """Function to convert the values of one column to its schema type, raising on missing or invalid values."""
+
+    if dtype == object:
+        values = np.asarray(values, dtype=object)
+        invalid = [index for index, value in enumerate(values) if not isinstance(value, str)]
+        if invalid:
+            raise RequestValidationError(f"Column {col}: expected strings, got {values[invalid[0]]!r} in record {invalid[0]}.")
+        return values
+
+    if not isinstance(values, np.ndarray) or values.dtype == object:
+        # NumPy would silently turn booleans into 0 / 1 and numeric strings into numbers.
+        invalid = [index for index, value in enumerate(values) if isinstance(value, (bool, np.bool_, str, bytes))]
+        if invalid:
+            raise RequestValidationError(f"Column {col}: expected numbers, got {values[invalid[0]]!r} in record {invalid[0]}.")
+        try:
+            values = np.asarray(values)
+        except ValueError:
+            raise RequestValidationError(f"Column {col}: expected one number per record.") from None
+    if values.ndim != 1:
+        raise RequestValidationError(f"Column {col}: expected one number per record, got values of shape {values.shape}.")
+    if values.dtype.kind in "bSU":
+        raise RequestValidationError(f"Column {col}: expected numbers, got {values.dtype} values.")
+    if values.dtype.kind in "iu" and dtype.kind in "iu":
+        # Integers are range-checked as they are, large CustomerIDs would lose digits as floats.
+        limits = np.iinfo(dtype)
+        invalid = (values < limits.min) | (values > limits.max)
+        if invalid.any():
+            index = int(np.argmax(invalid))
+            raise RequestValidationError(f"Column {col}: expected an integer in [{limits.min}, {limits.max}], got {values[index]} in record {index}.")
+        return values.astype(dtype)
+
+    try:
+        numbers = values.astype(np.float64)
+    except (TypeError, ValueError):
+        raise RequestValidationError(f"Column {col}: expected numbers.") from None
+    missing = ~np.isfinite(numbers)
+    if missing.any():
+        raise RequestValidationError(f"Column {col}: missing or non-numeric value in record {int(np.argmax(missing))}.")
+    if dtype.kind in "iu":
+        limits = np.iinfo(dtype)
+        invalid = (numbers != np.round(numbers)) | (numbers < limits.min) | (numbers > limits.max)
+        if invalid.any():
+            index = int(np.argmax(invalid))
+            raise RequestValidationError(f"Column {col}: expected an integer in [{limits.min}, {limits.max}], got {numbers[index]} in record {index}.")
+    return numbers.astype(dtype)
+
+
+def validate_input_columns(columns: dict) -> dict:
+    """Function to validate input columns (name -> values) against the schema into NumPy arrays of the schema types."""
+
+    missing = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing:
+        raise RequestValidationError(f"Missing required columns: {missing}")
+    lengths = {len(columns[col]) for col in PREDICT_REQUEST_SCHEMA if col in columns}
+    if len(lengths) != 1:
+        raise RequestValidationError("All columns must have the same number of values.")
+    num_records = lengths.pop()
+    if num_records == 0:
+        raise RequestValidationError("Body has no records.")
+    if num_records > PREDICT_MAX_RECORDS:
+        raise RequestValidationError(f"Body has {num_records} records, at most {PREDICT_MAX_RECORDS} are accepted; use /predict_batch.")
+
+    return {
+        col: _validate_column(col, columns[col], dtype)
+        for col, dtype in PREDICT_REQUEST_SCHEMA.items() if col in columns
+    }
+
+
+def parse_predict_request(body: bytes, content_type: str) -> dict:
+    """Function to decode and validate a /predict request body into typed input columns (name -> NumPy array)."""
+
+    if content_type in JSON_CONTENT_TYPES:
+        try:
+            document = json.loads(body)
+        except ValueError as e:
+            raise RequestValidationError(f"Invalid JSON body: {e}") from None
+        columns = _columns_from_document(document)
+    elif content_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise RequestValidationError("msgpack bodies need the msgpack package, which is not installed.")
+        try:
+            document = msgpack.unpackb(body)
+        except ValueError as e:
+            raise RequestValidationError(f"Invalid msgpack body: {e!r}") from None
+        columns = _columns_from_document(document)
+    elif content_type in ARROW_STREAM_CONTENT_TYPES + ARROW_FILE_CONTENT_TYPES:
+        try:
+            columns = _columns_from_arrow(body, file_format=content_type in ARROW_FILE_CONTENT_TYPES)
+        except Exception as e:
+            raise RequestValidationError(f"Invalid Arrow IPC body: {e}") from None
+    else:
+        supported = JSON_CONTENT_TYPES + MSGPACK_CONTENT_TYPES + ARROW_STREAM_CONTENT_TYPES + ARROW_FILE_CONTENT_TYPES
+        raise RequestValidationError(f"Unsupported content type: {content_type}. Use one of {', '.join(supported)}.")
+
+    return validate_input_columns(columns)
@@ -0,0 +1,100 @@
+import os
+import resource
+import pandas as pd
+
+# Single definition of the churn columns and their types, shared by loading, preprocessing
+# and serving. Raw files are parsed with NaN-capable types (raw drops can contain empty
+# rows); once preprocess_data has dropped missing values the columns are narrowed to the
+# compact types. Categorical text columns use the pandas category dtype throughout.
+RAW_SCHEMA = {
+    # column: (parse dtype, compact dtype)
+    'CustomerID': ('float64', 'int64'),
+    'Age': ('float32', 'int16'),
+    'Gender': ('category', 'category'),
+    'Tenure': ('float32', 'int16'),
+    'Usage Frequency': ('float32', 'int16'),
+    'Support Calls': ('float32', 'int16'),
+    'Payment Delay': ('float32', 'int16'),
+    'Subscription Type': ('category', 'category'),
+    'Contract Length': ('category', 'category'),
+    'Total Spend': ('float32', 'float32'),
+    'Last Interaction': ('float32', 'int16'),
+    'Churn': ('float32', 'int8'),
+}
+
+# Types of the derived columns produced by preprocess_data.
+FEATURE_DTYPE = 'float32'
+FLAG_DTYPE = 'int8'
+CODE_DTYPE = 'int8'
+
+# COMPACT_DTYPES=0 falls back to the default pandas types (int64 / float64 / object).
+COMPACT_DTYPES_ENABLED = os.getenv("COMPACT_DTYPES", "1") != "0"
+
+PARSE_DTYPES = {col: parse_dtype for col, (parse_dtype, compact_dtype) in RAW_SCHEMA.items()}
+COMPACT_DTYPES = {col: compact_dtype for col, (parse_dtype, compact_dtype) in RAW_SCHEMA.items()}
+LEGACY_PARSE_DTYPES = {col: ('object' if dtype == 'category' else 'float64') for col, dtype in PARSE_DTYPES.items()}
+
+
+def get_parse_dtypes() -> dict:
+    """Function to get the types raw files are parsed with."""
+
+    return PARSE_DTYPES if COMPACT_DTYPES_ENABLED else LEGACY_PARSE_DTYPES
+
+
+def numpy_dtype(col: str) -> str:
+    """Function to get the NumPy type of a raw column (category columns are plain object arrays)."""
+
+    dtype = COMPACT_DTYPES.get(col, 'object')
+    return 'object' if dtype == 'category' else dtype
+
+
+def apply_compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Function to narrow the raw columns of a DataFrame without missing values to the compact types."""
+
+    if not COMPACT_DTYPES_ENABLED:
+        return df
+    changed = {col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df.columns and df[col].dtype != dtype}
+    return df.astype(changed, copy=False) if changed else df
+
+
+def concat_compact(data_frames: list) -> pd.DataFrame:
+    """Function to concatenate DataFrames without losing the category dtype.
+
+    pd.concat turns category columns into object columns when the frames have different
+    category sets, so the categories are unified first.
+    """
+
+    category_cols = [col for col in data_frames[0].columns if isinstance(data_frames[0][col].dtype, pd.CategoricalDtype)]
+    for col in category_cols:
+        categories = pd.api.types.union_categoricals([df[col] for df in data_frames]).categories
+        for df in data_frames:
+            df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(data_frames, ignore_index=True)
+
+
+def get_rss_bytes():
+    """Function to get the current and peak resident set size of this process in bytes."""
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open("/proc/self/statm") as statm:
+            current_rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        current_rss = None
+    return current_rss, peak_rss
+
+
+def log_memory_usage(stage: str, df: pd.DataFrame = None) -> dict:
+    """Function to print and return the DataFrame size and process RSS after a pipeline stage."""
+
+    current_rss, peak_rss = get_rss_bytes()
+    report = {
+        "stage": stage,
+        "dataframe_bytes": int(df.memory_usage(deep=True).sum()) if df is not None else None,
+        "rss_bytes": current_rss,
+        "peak_rss_bytes": peak_rss,
+    }
+    dataframe_mb = f"{report['dataframe_bytes'] / 1e6:.1f}MB" if df is not None else "-"
+    current_mb = f"{current_rss / 1e6:.1f}MB" if current_rss is not None else "-"
+    print(f"[memory] {stage}: dataframe={dataframe_mb} rss={current_mb} peak_rss={peak_rss / 1e6:.1f}MB")
+    return report
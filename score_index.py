@@ -0,0 +1,220 @@
+import os
+import io
+import json
+import time
+import shutil
+import tempfile
+import threading
+import numpy as np
+from datetime import datetime, timezone
+
+from storage_backend import get_storage_backend
+
+# Precomputed churn scores of the whole customer base, written by the score_index job after
+# a model is published and served by /score/<customer_id>. An index build is a folder of
+# .npy files under SCORE_INDEX_FOLDER_PATH plus the current.json pointer, written last, so
+# serving processes never see a half written index. Serving processes copy the current build
+# to SCORE_INDEX_LOCAL_DIR once and memory-map it; lookups only index NumPy arrays.
+SCORE_INDEX_FOLDER_PATH = os.getenv("SCORE_INDEX_FOLDER_PATH", "score_index/")
+SCORE_INDEX_LOCAL_DIR = os.getenv("SCORE_INDEX_LOCAL_DIR") or os.path.join(tempfile.gettempdir(), "score_index")
+SCORE_INDEX_REFRESH_SECONDS = float(os.getenv("SCORE_INDEX_REFRESH_SECONDS", "60"))
+SCORE_INDEX_CHUNK_SIZE = int(os.getenv("SCORE_INDEX_CHUNK_SIZE", "100000"))
+
+# CustomerIDs spanning at most this many slots per customer get a direct-address slot table
+# (O(1) lookups), sparser ones are binary searched in the sorted ids.
+DIRECT_LAYOUT_MAX_SLOTS_PER_RECORD = 4
+
+_score_index_lock = threading.Lock()
+_score_index = {
+    "pointer_generation": None,
+    "index": None,
+    "refresher": None,
+}
+
+
+def build_score_index_arrays(customer_ids, predictions, probabilities):
+    """Function to build the index arrays and CustomerID offset from scored records; the last score of a repeated CustomerID wins."""
+
+    customer_ids = np.asarray(customer_ids, dtype=np.int64)
+    # Stable sort, then keep the last record of every CustomerID (the most recent raw file).
+    order = np.argsort(customer_ids, kind="stable")
+    sorted_ids = customer_ids[order]
+    last = np.append(sorted_ids[1:] != sorted_ids[:-1], True) if len(sorted_ids) else np.zeros(0, dtype=bool)
+    order = order[last]
+
+    arrays = {
+        "customer_ids": sorted_ids[last],
+        "predictions": np.asarray(predictions)[order].astype(np.int8),
+        "probabilities": np.asarray(probabilities, dtype=np.float32)[order],
+    }
+    ids = arrays["customer_ids"]
+    offset = int(ids[0]) if len(ids) else 0
+    span = int(ids[-1]) - offset + 1 if len(ids) else 0
+    if span <= DIRECT_LAYOUT_MAX_SLOTS_PER_RECORD * max(len(ids), 1):
+        slots = np.full(span, -1, dtype=np.int32 if len(ids) < 2**31 else np.int64)
+        slots[ids - offset] = np.arange(len(ids))
+        arrays["slots"] = slots
+    return arrays, offset
+
+
+def write_score_index(backend, index_folder_path: str, arrays: dict, offset: int, model_version: str) -> dict:
+    """Function to write an index build to a new folder and point current.json at it."""
+
+    built_at = datetime.now(timezone.utc)
+    build_folder = f"{index_folder_path}{built_at.strftime('%Y%m%d%H%M%S%f')}/"
+    for name, array in arrays.items():
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        backend.write_bytes(f"{build_folder}{name}.npy", buffer.getvalue(), content_type='application/octet-stream')
+
+    pointer_name = f"{index_folder_path}current.json"
+    previous = None
+    try:
+        previous = json.loads(backend.read_bytes(pointer_name))
+    except FileNotFoundError:
+        pass
+    pointer = {
+        "folder": build_folder,
+        "model_version": model_version,
+        "records": int(len(arrays["customer_ids"])),
+        "layout": "direct" if "slots" in arrays else "sorted",
+        "offset": offset,
+        "arrays": sorted(arrays),
+        "built_at": built_at.isoformat(),
+        # Kept until the next build: processes that read the old current.json may still be copying it.
+        "previous": None if previous is None else {"folder": previous["folder"], "arrays": previous.get("arrays", [])},
+    }
+    backend.write_bytes(pointer_name, json.dumps(pointer, indent=2).encode(), content_type='application/json')
+
+    # Only the build before the previous one is deleted.
+    expired = None if previous is None else previous.get("previous")
+    if expired is not None and expired["folder"] not in (build_folder, previous["folder"]):
+        for name in expired["arrays"]:
+            backend.delete(f"{expired['folder']}{name}.npy")
+    return pointer
+
+
+def load_score_index(backend, index_folder_path: str) -> dict:
+    """Function to copy the current index build to the local directory and memory-map it, None if there is none."""
+
+    pointer_name = f"{index_folder_path}current.json"
+    pointer_blob = backend.stat(pointer_name)
+    if pointer_blob is None:
+        return None
+    pointer = json.loads(backend.read_bytes(pointer_name, generation=pointer_blob.generation))
+
+    local_dir = os.path.join(SCORE_INDEX_LOCAL_DIR, pointer_blob.generation)
+    os.makedirs(local_dir, exist_ok=True)
+    index = dict(pointer, pointer_generation=pointer_blob.generation, local_dir=local_dir)
+    for name in pointer["arrays"]:
+        local_path = os.path.join(local_dir, f"{name}.npy")
+        if not os.path.exists(local_path):
+            temp_path = f"{local_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with backend.open_read(f"{pointer['folder']}{name}.npy") as source, open(temp_path, "wb") as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            os.replace(temp_path, local_path)
+        index[name] = np.load(local_path, mmap_mode="r")
+    return index
+
+
+def refresh_score_index(project_id: str, bucket_name: str, index_folder_path: str = None) -> bool:
+    """Function to swap in the current index build if it changed, returning True when a new build was loaded."""
+
+    index_folder_path = index_folder_path or SCORE_INDEX_FOLDER_PATH
+    backend = get_storage_backend(project_id, bucket_name)
+    pointer_blob = backend.stat(f"{index_folder_path}current.json")
+    if pointer_blob is None or pointer_blob.generation == _score_index["pointer_generation"]:
+        return False
+
+    index = load_score_index(backend, index_folder_path)
+    if index is None:
+        return False
+    previous = _score_index["index"]
+    with _score_index_lock:
+        # A single reference swap: lookups see either the old or the new build, never a mix.
+        _score_index["index"] = index
+        _score_index["pointer_generation"] = index["pointer_generation"]
+    print(f"Score index loaded: {index['records']} customers, model version {index['model_version']}, layout {index['layout']}.")
+
+    if previous is not None and previous["local_dir"] != index["local_dir"]:
+        # Memory-mapped files stay readable for in-flight lookups after they are unlinked.
+        shutil.rmtree(previous["local_dir"], ignore_errors=True)
+    return True
+
+
+def _refresh_score_index_forever(project_id: str, bucket_name: str, index_folder_path: str):
+    while True:
+        time.sleep(SCORE_INDEX_REFRESH_SECONDS)
+        try:
+            refresh_score_index(project_id, bucket_name, index_folder_path)
+        except Exception as e:
+            print(f"ERROR: Failed to refresh the score index. Details: {e}")
+
+
+def start_score_index_refresher(project_id: str, bucket_name: str, index_folder_path: str = None):
+    """Function to load the score index and start the background thread picking up new builds, once per process."""
+
+    with _score_index_lock:
+        refresher = _score_index["refresher"]
+        if refresher is not None and refresher[0] == os.getpid():
+            return
+        _score_index["refresher"] = (os.getpid(), None)
+
+    try:
+        refresh_score_index(project_id, bucket_name, index_folder_path)
+    except Exception as e:
+        print(f"ERROR: Failed to load the score index. Details: {e}")
+    thread = threading.Thread(
+        target=_refresh_score_index_forever,
+        args=(project_id, bucket_name, index_folder_path or SCORE_INDEX_FOLDER_PATH),
+        name="score-index-refresher",
+        daemon=True,
+    )
+    thread.start()
+    _score_index["refresher"] = (os.getpid(), thread)
+
+
+def lookup_customer_score(customer_id: int):
+    """Function to get the indexed score of a customer as a dict, None if the customer (or any index) is missing."""
+
+    index = _score_index["index"]
+    if index is None:
+        return None
+
+    if index["layout"] == "direct":
+        slot = customer_id - index["offset"]
+        if slot < 0 or slot >= len(index["slots"]):
+            return None
+        position = int(index["slots"][slot])
+        if position < 0:
+            return None
+    else:
+        customer_ids = index["customer_ids"]
+        position = int(np.searchsorted(customer_ids, customer_id))
+        if position >= len(customer_ids) or int(customer_ids[position]) != customer_id:
+            return None
+
+    return {
+        "CustomerID": customer_id,
+        "Prediction": int(index["predictions"][position]),
+        "Probability": float(index["probabilities"][position]),
+        "model_version": index["model_version"],
+        "built_at": index["built_at"],
+    }
+
+
+def get_score_index_stats():
+    """Function to get the metadata of the loaded score index."""
+
+    index = _score_index["index"]
+    if index is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "records": index["records"],
+        "model_version": index["model_version"],
+        "layout": index["layout"],
+        "built_at": index["built_at"],
+        "pointer_generation": index["pointer_generation"],
+        "refresh_interval_seconds": SCORE_INDEX_REFRESH_SECONDS,
+    }
@@ -0,0 +1,215 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+
+import categorical_encoding
+from preprocess_data import ENGINEERED_FEATURES, FEATURE_RULE_OPERATORS
+
+# A scoring kernel is the trained LogisticRegression folded together with the fitted
+# StandardScaler, the categorical encodings and the feature engineering rules into a
+# handful of NumPy arrays. Scoring is then a weighted sum over the raw input columns,
+# with no DataFrame construction and no refitting on the request path.
+KERNEL_FORMAT_VERSION = 1
+
+# Largest difference to the sklearn probabilities a kernel may have. The kernel scores in
+# float64 while the model sees float32 features.
+KERNEL_TOLERANCE = 1e-5
+
+
+def compile_scoring_kernel(model, scaler, encoder) -> dict:
+    """Function to compile a fitted linear model, scaler and categorical encoder into a scoring kernel."""
+
+    if not hasattr(model, "coef_") or model.coef_.shape[0] != 1:
+        raise ValueError(f"Scoring kernel needs a binary linear model, got {type(model).__name__}.")
+
+    coefficients = dict(zip(model.feature_names_in_, model.coef_[0].astype(np.float64)))
+    intercept = float(model.intercept_[0])
+    scaler_columns = list(scaler.feature_names_in_)
+
+    numeric_columns, numeric_weights = [], []
+    rule_columns, rule_operators, rule_thresholds, rule_weights = [], [], [], []
+    categorical_columns, categories, category_weights, most_frequent_codes = [], [], [], []
+
+    for feature, coefficient in coefficients.items():
+        if feature in scaler_columns:
+            # coef * (x - mean) / scale == (coef / scale) * x - coef * mean / scale
+            position = scaler_columns.index(feature)
+            mean = float(scaler.mean_[position]) if scaler.with_mean else 0.0
+            scale = float(scaler.scale_[position]) if scaler.with_std else 1.0
+            numeric_columns.append(feature)
+            numeric_weights.append(coefficient / scale)
+            intercept -= coefficient * mean / scale
+        elif feature in encoder.column_classes_:
+            # Codes are the positions in the sorted classes.
+            classes = encoder.column_classes_[feature]
+            categorical_columns.append(feature)
+            categories.append(np.asarray(classes, dtype=str))
+            category_weights.append(coefficient * np.arange(len(classes), dtype=np.float64))
+            most_frequent = encoder.most_frequent_.get(feature)
+            most_frequent_codes.append(classes.index(most_frequent) if most_frequent in classes else -1)
+        elif feature in ENGINEERED_FEATURES:
+            source_col, operator, threshold = ENGINEERED_FEATURES[feature]
+            rule_columns.append(source_col)
+            rule_operators.append(operator)
+            rule_thresholds.append(threshold)
+            rule_weights.append(coefficient)
+        else:
+            raise ValueError(f"Scoring kernel cannot compile feature: {feature}")
+
+    kernel = {
+        "format_version": KERNEL_FORMAT_VERSION,
+        "intercept": intercept,
+        "classes": np.asarray(model.classes_),
+        "numeric_columns": numeric_columns,
+        "numeric_weights": np.asarray(numeric_weights, dtype=np.float64),
+        "rule_columns": rule_columns,
+        "rule_operators": rule_operators,
+        "rule_thresholds": np.asarray(rule_thresholds, dtype=np.float64),
+        "rule_weights": np.asarray(rule_weights, dtype=np.float64),
+        "categorical_columns": categorical_columns,
+        "categories": categories,
+        "category_weights": category_weights,
+        "most_frequent_codes": most_frequent_codes,
+    }
+    return kernel
+
+
+def score_with_kernel(kernel: dict, columns: dict, unseen_policy: str = None):
+    """Function to score raw input columns (name -> 1-D array or list) with a compiled kernel.
+
+    Returns predictions, positive class probabilities and a mask of the rows that
+    could be scored. Rows with missing values are marked invalid, their prediction and
+    probability must be ignored. Unseen categories follow unseen_policy (default
+    UNSEEN_CATEGORY_POLICY of this process) like preprocess_data: the row is invalid
+    (drop), encoded as the most frequent class (most_frequent) or a ValueError is raised.
+    """
+
+    unseen_policy = unseen_policy or categorical_encoding.UNSEEN_CATEGORY_POLICY
+
+    size = len(next(iter(columns.values())))
+    decision = np.full(size, kernel["intercept"], dtype=np.float64)
+    valid = np.ones(size, dtype=bool)
+
+    for col, weight in zip(kernel["numeric_columns"], kernel["numeric_weights"]):
+        values = np.asarray(columns[col], dtype=np.float64)
+        valid &= np.isfinite(values)
+        decision += weight * values
+
+    rules = zip(kernel["rule_columns"], kernel["rule_operators"], kernel["rule_thresholds"], kernel["rule_weights"])
+    for col, operator, threshold, weight in rules:
+        values = np.asarray(columns[col], dtype=np.float64)
+        valid &= np.isfinite(values)
+        decision += weight * FEATURE_RULE_OPERATORS[operator](values, threshold)
+
+    categorical = zip(kernel["categorical_columns"], kernel["categories"], kernel["category_weights"], kernel["most_frequent_codes"])
+    for col, classes, weights, most_frequent_code in categorical:
+        raw_values = np.asarray(columns[col])
+        # Missing values are dropped under every policy, they are not an unseen category.
+        present = ~pd.isna(raw_values)
+        valid &= present
+        values = raw_values.astype(str)
+        codes = np.searchsorted(classes, values)
+        codes = np.minimum(codes, len(classes) - 1)
+        known = (classes[codes] == values) | ~present
+        if not known.all() and unseen_policy == "error":
+            raise ValueError(f"Unseen categories in column {col}: {sorted(set(values[~known]))}")
+        if unseen_policy == "most_frequent" and most_frequent_code >= 0:
+            decision += np.where(known, weights[codes], weights[most_frequent_code])
+        else:
+            valid &= known
+            decision += np.where(known, weights[codes], 0.0)
+
+    probabilities = 1.0 / (1.0 + np.exp(-decision))
+    predictions = kernel["classes"][(decision > 0).astype(np.intp)]
+    return predictions, probabilities, valid
+
+
+def verify_scoring_kernel(kernel: dict, model, scaler, X_test, tolerance: float = KERNEL_TOLERANCE):
+    """Function to check that a kernel reproduces model.predict / predict_proba on processed rows.
+
+    The raw inputs are reconstructed from the processed test rows (inverse scaling,
+    rounding integer columns, decoding categories) and scored by the kernel.
+    """
+
+    scaled = X_test[list(scaler.feature_names_in_)]
+    raw_numeric = scaler.inverse_transform(scaled)
+    columns = {}
+    for position, col in enumerate(scaler.feature_names_in_):
+        values = raw_numeric[:, position]
+        rounded = np.round(values)
+        # Integer raw columns come back with floating point noise from the inverse transform,
+        # up to ~1e-5 when the features were stored as float32.
+        columns[col] = rounded if np.allclose(values, rounded, rtol=0.0, atol=1e-3) else values
+    for col, classes in zip(kernel["categorical_columns"], kernel["categories"]):
+        columns[col] = classes[X_test[col].to_numpy().astype(np.intp)]
+
+    predictions, probabilities, valid = score_with_kernel(kernel, columns)
+    expected_probabilities = model.predict_proba(X_test)[:, 1]
+    expected_predictions = model.predict(X_test)
+
+    if not valid.all():
+        return False, f"Scoring kernel rejected {int((~valid).sum())} of {len(valid)} verification rows."
+    max_difference = float(np.max(np.abs(probabilities - expected_probabilities))) if len(valid) else 0.0
+    if max_difference > tolerance:
+        return False, f"Scoring kernel probabilities differ from the model by up to {max_difference}."
+    # Only rows sitting on the decision boundary may flip because of rounding.
+    mismatched = (predictions != expected_predictions) & (np.abs(expected_probabilities - 0.5) > tolerance)
+    if mismatched.any():
+        return False, f"Scoring kernel predictions differ from the model on {int(mismatched.sum())} rows."
+    return True, f"Scoring kernel matches the model on {len(valid)} rows (max probability difference {max_difference})."
+
+
+def dump_scoring_kernel(kernel: dict) -> bytes:
+    """Function to serialize a scoring kernel to a compact .npz payload."""
+
+    layout = {
+        "format_version": kernel["format_version"],
+        "numeric_columns": kernel["numeric_columns"],
+        "rule_columns": kernel["rule_columns"],
+        "rule_operators": kernel["rule_operators"],
+        "categorical_columns": kernel["categorical_columns"],
+        "most_frequent_codes": kernel["most_frequent_codes"],
+    }
+    arrays = {
+        "layout": np.asarray(json.dumps(layout)),
+        "intercept": np.asarray(kernel["intercept"], dtype=np.float64),
+        "classes": kernel["classes"],
+        "numeric_weights": kernel["numeric_weights"],
+        "rule_thresholds": kernel["rule_thresholds"],
+        "rule_weights": kernel["rule_weights"],
+    }
+    for position in range(len(kernel["categorical_columns"])):
+        arrays[f"categories_{position}"] = kernel["categories"][position]
+        arrays[f"category_weights_{position}"] = kernel["category_weights"][position]
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def load_scoring_kernel(payload: bytes) -> dict:
+    """Function to deserialize a scoring kernel written by dump_scoring_kernel."""
+
+    with np.load(io.BytesIO(payload), allow_pickle=False) as arrays:
+        layout = json.loads(str(arrays["layout"]))
+        if layout["format_version"] != KERNEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported scoring kernel format version: {layout['format_version']}")
+        kernel = dict(layout)
+        kernel["intercept"] = float(arrays["intercept"])
+        for name in ("classes", "numeric_weights", "rule_thresholds", "rule_weights"):
+            kernel[name] = arrays[name]
+        kernel["categories"] = [arrays[f"categories_{i}"] for i in range(len(layout["categorical_columns"]))]
+        kernel["category_weights"] = [arrays[f"category_weights_{i}"] for i in range(len(layout["categorical_columns"]))]
+    return upgrade_scoring_kernel(kernel)
+
+
+def upgrade_scoring_kernel(kernel: dict) -> dict:
+    """Function to fill in the fields a kernel exported by an earlier build (or packed in its model bundle) lacks."""
+
+    if kernel is not None and "most_frequent_codes" not in kernel:
+        # Kernels exported before the unseen-category policy have no most frequent classes,
+        # later ones had them as unseen_codes when they were compiled under most_frequent.
+        kernel = dict(kernel)
+        kernel["most_frequent_codes"] = kernel.pop("unseen_codes", [-1] * len(kernel["categorical_columns"]))
+    return kernel
@@ -0,0 +1,333 @@
+import os
+import fcntl
+import threading
+import contextlib
+import google.auth
+import requests
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from google.cloud import storage
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.auth.transport.requests import AuthorizedSession
+
+from metrics import timed_span, increment_counter
+
+# Storage layer shared by every pipeline step. STORAGE_BACKEND selects where the bucket lives:
+#   gcs   - Google Cloud Storage through one long-lived client per process (default).
+#   local - a directory per bucket under LOCAL_STORAGE_ROOT, to run and benchmark the
+#           whole pipeline offline.
+# Object names are the same for both, e.g. data/raw/customer_churn.csv.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "local_storage")
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "16"))
+
+_LOCAL_TEMP_MARKER = ".storage-tmp-"
+
+
+@dataclass(frozen=True)
+class StorageObject:
+    """Metadata of a stored object, the same for every backend."""
+
+    name: str
+    size: int
+    generation: str
+    md5_hash: str = None
+    time_created: datetime = None
+
+
+class GCSStorageBackend:
+    """Storage backend for one GCS bucket, sharing a pooled client with every other GCS backend of the process."""
+
+    backend_name = "gcs"
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, project_id: str, bucket_name: str):
+        self.project_id = project_id
+        self.bucket_name = bucket_name
+
+    @classmethod
+    def get_client(cls, project_id: str):
+        """Function to get the process-wide GCS client of a project, created on first use."""
+
+        # Clients hold open connections, which must not be shared with forked worker processes.
+        key = (project_id, os.getpid())
+        with cls._clients_lock:
+            client = cls._clients.get(key)
+            if client is None:
+                # The client uses our own authorized session, with one connection per concurrent
+                # download / upload thread instead of the default 10.
+                credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+                session = AuthorizedSession(credentials)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=STORAGE_POOL_SIZE, pool_maxsize=STORAGE_POOL_SIZE)
+                session.mount("https://", adapter)
+                client = storage.Client(project=project_id, credentials=credentials, _http=session)
+                cls._clients[key] = client
+            return client
+
+    @property
+    def bucket(self):
+        return self.get_client(self.project_id).bucket(self.bucket_name)
+
+    @staticmethod
+    def _to_object(blob) -> StorageObject:
+        return StorageObject(
+            name=blob.name,
+            size=blob.size,
+            generation=str(blob.generation),
+            md5_hash=blob.md5_hash,
+            time_created=blob.time_created,
+        )
+
+    def uri(self, name: str) -> str:
+        return f"gs://{self.bucket_name}/{name}"
+
+    def list(self, prefix: str) -> list:
+        """Function to list the objects under a prefix in name order (one listing call, no per-object lookups)."""
+
+        with timed_span("listing", backend=self.backend_name):
+            blobs = self.get_client(self.project_id).list_blobs(self.bucket_name, prefix=prefix)
+            return sorted((self._to_object(blob) for blob in blobs), key=lambda obj: obj.name)
+
+    def stat(self, name: str):
+        """Function to get the metadata of an object, None if it does not exist."""
+
+        with timed_span("stat", backend=self.backend_name):
+            blob = self.bucket.get_blob(name)
+        return None if blob is None else self._to_object(blob)
+
+    def open_read(self, name: str, generation: str = None):
+        """Function to open an object (optionally pinned to a generation) as a binary stream."""
+
+        blob = self.bucket.blob(name, generation=int(generation) if generation else None)
+        try:
+            return blob.open("rb")
+        except NotFound as e:
+            raise FileNotFoundError(self.uri(name)) from e
+
+    def read_bytes(self, name: str, generation: str = None) -> bytes:
+        """Function to read a whole object (optionally pinned to a generation)."""
+
+        blob = self.bucket.blob(name, generation=int(generation) if generation else None)
+        try:
+            with timed_span("download", backend=self.backend_name):
+                data = blob.download_as_bytes()
+        except NotFound as e:
+            raise FileNotFoundError(self.uri(name)) from e
+        increment_counter("churn_storage_bytes_total", len(data), backend=self.backend_name, direction="read")
+        return data
+
+    @contextlib.contextmanager
+    def open_write(self, name: str, content_type: str = None, if_generation_match: str = None):
+        """Function to open an object for a streamed write; it only replaces the object once closed without error.
+
+        if_generation_match="0" only writes when the object does not exist yet; a write losing
+        the race raises FileExistsError, like the local backend.
+        """
+
+        upload_kwargs = {"content_type": content_type} if content_type else {}
+        if if_generation_match is not None:
+            upload_kwargs["if_generation_match"] = int(if_generation_match)
+        # The upload is aborted when the block raises, leaving the previous object in place.
+        try:
+            with timed_span("upload", backend=self.backend_name), self.bucket.blob(name).open("wb", ignore_flush=True, **upload_kwargs) as file:
+                yield file
+        except PreconditionFailed as e:
+            raise FileExistsError(f"{self.uri(name)} is not at generation {if_generation_match}") from e
+
+    def write_bytes(self, name: str, data: bytes, content_type: str = None, if_generation_match: str = None) -> StorageObject:
+        """Function to write a whole object in a single upload, replacing any existing version."""
+
+        blob = self.bucket.blob(name)
+        upload_kwargs = {"if_generation_match": int(if_generation_match)} if if_generation_match is not None else {}
+        try:
+            with timed_span("upload", backend=self.backend_name):
+                blob.upload_from_string(data, content_type=content_type or "application/octet-stream", **upload_kwargs)
+        except PreconditionFailed as e:
+            raise FileExistsError(f"{self.uri(name)} is not at generation {if_generation_match}") from e
+        increment_counter("churn_storage_bytes_total", len(data), backend=self.backend_name, direction="write")
+        return self._to_object(blob)
+
+    def copy(self, source_name: str, destination_name: str) -> StorageObject:
+        """Function to copy an object server side."""
+
+        bucket = self.bucket
+        with timed_span("copy", backend=self.backend_name):
+            return self._to_object(bucket.copy_blob(bucket.blob(source_name), bucket, destination_name))
+
+    def delete(self, name: str, if_generation_match: str = None):
+        """Function to delete an object, doing nothing if it does not exist.
+
+        With if_generation_match the object is only deleted at that generation, otherwise
+        FileExistsError is raised.
+        """
+
+        delete_kwargs = {"if_generation_match": int(if_generation_match)} if if_generation_match is not None else {}
+        try:
+            self.bucket.blob(name).delete(**delete_kwargs)
+        except NotFound:
+            pass
+        except PreconditionFailed as e:
+            raise FileExistsError(f"{self.uri(name)} is not at generation {if_generation_match}") from e
+
+
+class LocalStorageBackend:
+    """Storage backend keeping a bucket as a local directory, LOCAL_STORAGE_ROOT/<bucket name>/<object name>.
+
+    The generation of a file is its modification time in nanoseconds, and writes go to a
+    temporary file that replaces the object once complete, like a GCS upload. Writes and
+    deletes with if_generation_match hold an exclusive lock on the bucket directory, so the
+    generation check and the change are atomic across processes.
+    """
+
+    backend_name = "local"
+
+    def __init__(self, bucket_name: str, root: str = None):
+        self.bucket_name = bucket_name
+        self.directory = os.path.abspath(os.path.join(root or LOCAL_STORAGE_ROOT, bucket_name))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, *name.split("/"))
+
+    def _to_object(self, name: str, stat_result) -> StorageObject:
+        return StorageObject(
+            name=name,
+            size=stat_result.st_size,
+            generation=str(stat_result.st_mtime_ns),
+            time_created=datetime.fromtimestamp(stat_result.st_mtime_ns / 1e9, tz=timezone.utc),
+        )
+
+    def uri(self, name: str) -> str:
+        return self._path(name)
+
+    def list(self, prefix: str) -> list:
+        """Function to list the objects under a prefix in name order."""
+
+        objects = []
+        with timed_span("listing", backend=self.backend_name):
+            for directory, sub_directories, file_names in os.walk(self.directory):
+                for file_name in file_names:
+                    if _LOCAL_TEMP_MARKER in file_name:
+                        continue
+                    path = os.path.join(directory, file_name)
+                    name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                    if name.startswith(prefix):
+                        objects.append(self._to_object(name, os.stat(path)))
+        return sorted(objects, key=lambda obj: obj.name)
+
+    def stat(self, name: str):
+        """Function to get the metadata of an object, None if it does not exist."""
+
+        try:
+            return self._to_object(name, os.stat(self._path(name)))
+        except FileNotFoundError:
+            return None
+
+    def open_read(self, name: str, generation: str = None):
+        """Function to open an object as a binary stream, failing if it no longer has the given generation."""
+
+        file = open(self._path(name), "rb")
+        if generation is not None and str(os.fstat(file.fileno()).st_mtime_ns) != str(generation):
+            file.close()
+            raise FileNotFoundError(f"{self.uri(name)} generation {generation}")
+        return file
+
+    def read_bytes(self, name: str, generation: str = None) -> bytes:
+        """Function to read a whole object."""
+
+        with timed_span("download", backend=self.backend_name), self.open_read(name, generation) as file:
+            data = file.read()
+        increment_counter("churn_storage_bytes_total", len(data), backend=self.backend_name, direction="read")
+        return data
+
+    @contextlib.contextmanager
+    def open_write(self, name: str, content_type: str = None, if_generation_match: str = None):
+        """Function to open an object for a streamed write; it only replaces the object once closed without error."""
+
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}{_LOCAL_TEMP_MARKER}{os.getpid()}-{threading.get_ident()}"
+        try:
+            with timed_span("upload", backend=self.backend_name), open(temp_path, "wb") as file:
+                yield file
+            with self._generation_lock(if_generation_match):
+                self._check_generation(name, if_generation_match)
+                os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @contextlib.contextmanager
+    def _generation_lock(self, if_generation_match: str):
+        """Function to hold the bucket lock file while a conditional change is checked and applied."""
+
+        if if_generation_match is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f"{_LOCAL_TEMP_MARKER}lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _check_generation(self, name: str, if_generation_match: str):
+        if if_generation_match is None:
+            return
+        current = self.stat(name)
+        current_generation = "0" if current is None else current.generation
+        if current_generation != str(if_generation_match):
+            raise FileExistsError(f"{self.uri(name)} is at generation {current_generation}, expected {if_generation_match}")
+
+    def write_bytes(self, name: str, data: bytes, content_type: str = None, if_generation_match: str = None) -> StorageObject:
+        """Function to write a whole object, replacing any existing version."""
+
+        data = data.encode() if isinstance(data, str) else data
+        with self.open_write(name, content_type, if_generation_match) as file:
+            file.write(data)
+        increment_counter("churn_storage_bytes_total", len(data), backend=self.backend_name, direction="write")
+        return self.stat(name)
+
+    def copy(self, source_name: str, destination_name: str) -> StorageObject:
+        """Function to copy an object."""
+
+        return self.write_bytes(destination_name, self.read_bytes(source_name))
+
+    def delete(self, name: str, if_generation_match: str = None):
+        """Function to delete an object, doing nothing if it does not exist; only at if_generation_match if given."""
+
+        with self._generation_lock(if_generation_match):
+            if if_generation_match is not None and self.stat(name) is not None:
+                self._check_generation(name, if_generation_match)
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_storage_backend(project_id: str, bucket_name: str):
+    """Function to get the configured storage backend of a bucket, one instance per bucket and process."""
+
+    key = (STORAGE_BACKEND, project_id, bucket_name)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            if STORAGE_BACKEND == "gcs":
+                backend = GCSStorageBackend(project_id, bucket_name)
+            elif STORAGE_BACKEND == "local":
+                backend = LocalStorageBackend(bucket_name)
+            else:
+                raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+            _backends[key] = backend
+        return backend
+
+
+def split_storage_path(path: str):
+    """Function to split a gs://<bucket>/<object name> path, (None, path) for any other path."""
+
+    if path.startswith("gs://"):
+        bucket_name, _, name = path[len("gs://"):].partition("/")
+        return bucket_name, name
+    return None, path
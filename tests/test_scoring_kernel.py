@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+import storage_backend
+import categorical_encoding
+from synthetic_data import make_churn_data
+from preprocess_data import preprocess_data, save_processed_data, save_scalar, save_encoder
+from train_model import train_model, export_model, export_model_perormance, export_scoring_kernel
+from host_model import get_model_evaluation_metrics, move_model_from_stage_to_prod
+from scoring_kernel import KERNEL_TOLERANCE
+from consume_model import (
+    INPUT_DTYPE_MAPPING, clear_artifact_cache, load_prod_artifacts,
+    predict_using_pretrained_model, predict_using_scoring_kernel
+)
+
+PROJECT_ID = "test"
+BUCKET_NAME = "customer-churn-test"
+PROCESSED_DATA_FOLDER_PATH = "data/processed/"
+STAGE_MODEL_FOLDER_PATH = "model/stage/"
+PROD_MODEL_FOLDER_PATH = "model/prod/"
+LOCATION = (PROJECT_ID, BUCKET_NAME, PROD_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH)
+
+
+@pytest.fixture(scope="module")
+def published_model(tmp_path_factory):
+    """Train on synthetic data and publish model, scaler, encoder and scoring kernel to a local bucket."""
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(storage_backend, "STORAGE_BACKEND", "local")
+        monkeypatch.setattr(storage_backend, "LOCAL_STORAGE_ROOT", str(tmp_path_factory.mktemp("storage")))
+        monkeypatch.setattr(storage_backend, "_backends", {})
+        clear_artifact_cache()
+
+        processed_data, scaler, encoder = preprocess_data(make_churn_data(5000, seed=3))
+        assert save_processed_data(PROJECT_ID, BUCKET_NAME, PROCESSED_DATA_FOLDER_PATH, processed_data)[0]
+        assert save_scalar(PROJECT_ID, BUCKET_NAME, PROCESSED_DATA_FOLDER_PATH, scaler)[0]
+        assert save_encoder(PROJECT_ID, BUCKET_NAME, PROCESSED_DATA_FOLDER_PATH, encoder)[0]
+
+        outcome, message, model, X_test, y_test = train_model(processed_data)
+        assert outcome, message
+        timestamp = "20240101000000"
+        assert export_model(PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, "logistic_regression", timestamp, model)[0]
+        assert export_model_perormance(
+            PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, "logistic_regression", timestamp, model, X_test, y_test
+        )[0]
+        assert export_scoring_kernel(
+            PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, PROCESSED_DATA_FOLDER_PATH, "logistic_regression", timestamp, model, X_test
+        )[0]
+        outcome, stage_evaluation_df, stage_evaluation_blob = get_model_evaluation_metrics(PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH)
+        assert outcome
+        assert move_model_from_stage_to_prod(
+            PROJECT_ID, BUCKET_NAME, STAGE_MODEL_FOLDER_PATH, stage_evaluation_blob, PROD_MODEL_FOLDER_PATH
+        )[0]
+        yield
+        clear_artifact_cache()
+
+
+def score_with_sklearn(input_df):
+    """Rows kept, predictions and probabilities of the sklearn path: preprocess_data, then the model."""
+
+    userInput_df, processed_input, predictions = predict_using_pretrained_model(*LOCATION, userInput_df=input_df)
+    assert predictions is not None
+    model = load_prod_artifacts(*LOCATION)[0]
+    return processed_input.index.to_numpy(), predictions, model.predict_proba(processed_input)[:, 1]
+
+
+def score_with_kernel(input_df):
+    result = predict_using_scoring_kernel(*LOCATION, input_columns={col: input_df[col].to_numpy() for col in input_df.columns})
+    assert result is not None, "the published model has no scoring kernel"
+    predictions, probabilities, valid = result
+    return np.flatnonzero(valid), predictions[valid], probabilities[valid]
+
+
+def assert_same_scores(input_df):
+    kernel_rows, kernel_predictions, kernel_probabilities = score_with_kernel(input_df)
+    sklearn_rows, sklearn_predictions, sklearn_probabilities = score_with_sklearn(input_df)
+
+    np.testing.assert_array_equal(kernel_rows, sklearn_rows)
+    np.testing.assert_allclose(kernel_probabilities, sklearn_probabilities, rtol=0, atol=KERNEL_TOLERANCE)
+    np.testing.assert_array_equal(kernel_predictions, sklearn_predictions)
+    return kernel_rows
+
+
+def customers(num_rows: int):
+    return make_churn_data(num_rows, seed=11, first_customer_id=100000)[list(INPUT_DTYPE_MAPPING)].astype(INPUT_DTYPE_MAPPING)
+
+
+def customers_with_invalid_rows():
+    """Customers with a missing number (row 1), a missing category (row 3) and an unseen category (row 5)."""
+
+    input_df = customers(8)
+    input_df.loc[1, "Total Spend"] = np.nan
+    input_df["Gender"] = input_df["Gender"].astype(object)
+    input_df.loc[3, "Gender"] = None
+    input_df.loc[5, "Gender"] = "Unknown"
+    return input_df
+
+
+def test_kernel_matches_sklearn_on_a_batch(published_model):
+    kept_rows = assert_same_scores(customers(500))
+
+    assert len(kept_rows) == 500
+
+
+def test_kernel_matches_sklearn_on_single_rows(published_model):
+    input_df = customers(25)
+
+    for position in range(len(input_df)):
+        assert len(assert_same_scores(input_df.iloc[[position]].reset_index(drop=True))) == 1
+
+
+def test_kernel_drops_the_rows_sklearn_drops(published_model):
+    kept_rows = assert_same_scores(customers_with_invalid_rows())
+
+    assert kept_rows.tolist() == [0, 2, 4, 6, 7]
+
+
+def test_kernel_applies_the_unseen_category_policy_of_the_process(published_model, monkeypatch):
+    # The model was published under drop; the encoder and the kernel follow the current policy.
+    monkeypatch.setattr(categorical_encoding, "UNSEEN_CATEGORY_POLICY", "most_frequent")
+    clear_artifact_cache()
+    try:
+        kept_rows = assert_same_scores(customers_with_invalid_rows())
+    finally:
+        monkeypatch.undo()
+        clear_artifact_cache()
+
+    # The unseen category is scored as the most frequent class, missing values are still dropped.
+    assert kept_rows.tolist() == [0, 2, 4, 5, 6, 7]
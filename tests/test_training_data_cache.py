@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import training_data_cache
+from training_data_cache import load_cached_dataset, store_cached_dataset
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Point the training data cache at an empty directory."""
+
+    monkeypatch.setattr(training_data_cache, "TRAINING_DATA_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_processed_data(rows: int = 1000) -> pd.DataFrame:
+    rng = np.random.default_rng(5)
+    return pd.DataFrame({
+        "Age": rng.normal(size=rows),
+        "Tenure": rng.normal(size=rows),
+        "Gender": rng.integers(0, 2, size=rows).astype("int8"),
+        "Churn": rng.integers(0, 2, size=rows).astype("int8"),
+    })
+
+
+def test_cached_dataset_round_trips(cache_dir):
+    df = make_processed_data()
+    assert store_cached_dataset("key", df)
+
+    # copy() turns the memory-mapped columns back into plain arrays for the comparison.
+    pd.testing.assert_frame_equal(load_cached_dataset("key").copy(), df)
+    pd.testing.assert_frame_equal(load_cached_dataset("key", columns=["Tenure", "Churn"]).copy(), df[["Tenure", "Churn"]])
+    assert load_cached_dataset("missing") is None
+
+
+def test_cached_dataset_is_not_copied(cache_dir):
+    assert store_cached_dataset("key", make_processed_data())
+
+    cached = load_cached_dataset("key")
+    for col in cached.columns:
+        values = cached[col].to_numpy()
+        assert not values.flags.owndata
+        assert isinstance(values.base, np.memmap) or isinstance(values.base.base, np.memmap), col
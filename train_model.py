@@ -1,19 +1,110 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import joblib
-import os
+import pickle
 from sklearn.model_selection import train_test_split
-from google.cloud import storage
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier
 from datetime import datetime
 from sklearn.metrics import precision_recall_fscore_support, accuracy_score
+from scoring_kernel import compile_scoring_kernel, verify_scoring_kernel, dump_scoring_kernel, load_scoring_kernel
+from model_bundle import build_model_bundle, dump_model_bundle
+from storage_backend import get_storage_backend, split_storage_path
+from training_data_cache import get_cache_key, load_cached_dataset, store_cached_dataset, TRAINING_DATA_CACHE_MAX_BYTES
+from preprocess_data import load_encoder
+from metrics import timed_stage, print_dataframe
 
 
+def read_processed_file(file_path: str, columns: list = None, project_id: str = None) -> pd.DataFrame:
+    """Function to read one processed data file in the format given by its extension.
+
+    gs://<bucket>/<name> paths are read through the configured storage backend, any other
+    path from the local file system. Stored files go through the training data cache.
+    """
+
+    bucket_name, name = split_storage_path(file_path)
+    if bucket_name is None:
+        return read_processed_file_object(file_path, file_path, columns=columns)
+    backend = get_storage_backend(project_id, bucket_name)
+    if TRAINING_DATA_CACHE_MAX_BYTES <= 0:
+        with backend.open_read(name) as file:
+            return read_processed_file_object(file, name, columns=columns)
+
+    # Unchanged files are served from the local training data cache, without download or parse.
+    blob = backend.stat(name)
+    if blob is None:
+        raise FileNotFoundError(f"{backend.uri(name)} does not exist.")
+    cache_key = get_cache_key(bucket_name, blob)
+    df = load_cached_dataset(cache_key, columns=columns)
+    if df is not None:
+        print(f"Loaded {name} (generation {blob.generation}) from the training data cache.")
+        return df
+    with backend.open_read(name, generation=blob.generation) as file:
+        df = read_processed_file_object(file, name)
+    if store_cached_dataset(cache_key, df):
+        print(f"Cached {name} (generation {blob.generation}) in the training data cache.")
+    return df[columns] if columns else df
+
+
+def read_processed_file_object(file, file_name: str, columns: list = None) -> pd.DataFrame:
+    """Function to read processed data from a path or open binary file, in the format given by file_name."""
+
+    if file_name.endswith(".parquet"):
+        return pd.read_parquet(file, columns=columns)
+    elif file_name.endswith((".arrow", ".feather")):
+        return pd.read_feather(file, columns=columns)
+    return pd.read_csv(file, usecols=columns)
+
+
+def iter_processed_data_chunks(
+        project_id: str,
+        processed_data_file_paths: list,
+        chunk_size: int,
+        columns: list = None,
+    ):
+    """Function to read processed data files one after another as DataFrame chunks of at most chunk_size records.
+
+    Parquet is read row group batch by batch and Arrow / Feather record batch by record
+    batch, so only one chunk of any format is held in memory at a time.
+    """
+
+    for file_path in processed_data_file_paths:
+        bucket_name, name = split_storage_path(file_path)
+        file = open(name, "rb") if bucket_name is None else get_storage_backend(project_id, bucket_name).open_read(name)
+        with file:
+            if name.endswith(".parquet"):
+                for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size, columns=columns):
+                    yield batch.to_pandas()
+            elif name.endswith((".arrow", ".feather")):
+                reader = pa.ipc.open_file(file)
+                for index in range(reader.num_record_batches):
+                    batch = reader.get_batch(index)
+                    if columns:
+                        batch = batch.select(columns)
+                    for start in range(0, batch.num_rows, chunk_size):
+                        yield batch.slice(start, chunk_size).to_pandas()
+            else:
+                with pd.read_csv(file, usecols=columns, chunksize=chunk_size) as reader:
+                    yield from reader
+
+
+@timed_stage("load_processed_data")
 def load_processed_data(
         project_id: str,
         bucket_name: str,
         processed_data_file_path: str,
+        columns: list = None,
+        partition_file_paths: list = None,
     ) -> pd.DataFrame:
-    """Function to load data from GCS bucket."""
+    """Function to load data from GCS bucket.
+
+    The format follows the file extension (.csv, .parquet, .arrow / .feather). Only the
+    given columns are read when columns is set; columnar formats skip the others entirely
+    and come back with the types they were saved with. Incremental partitions listed in
+    partition_file_paths are appended after the base file.
+    """
     try:
     
         if not all([project_id, bucket_name, processed_data_file_path]):
@@ -26,16 +117,20 @@ def load_processed_data(
         print(f"Processed Data File Path: {processed_data_file_path}")
         print("---------------------")
 
-        storage_client = storage.Client(project=project_id)
-        bucket = storage_client.bucket(bucket_name)
-        df = pd.read_csv(processed_data_file_path)
+        df = read_processed_file(processed_data_file_path, columns=columns, project_id=project_id)
         print(f"Loaded {len(df)} records from {processed_data_file_path}.")
 
+        if partition_file_paths:
+            partitions = [read_processed_file(path, columns=columns, project_id=project_id) for path in partition_file_paths]
+            df = pd.concat([df] + partitions, ignore_index=True)
+            print(f"Loaded {len(df)} records including {len(partition_file_paths)} incremental partitions.")
+
         return True, "Data loaded successfully.", df
     except Exception as e:
         return False, f"ERROR: Failed to load data from {processed_data_file_path}. Details: {e}", pd.DataFrame()
 
 
+@timed_stage("train")
 def train_model(
     df: pd.DataFrame,
     algorithm: str = "logistic_regression" 
@@ -56,14 +151,95 @@ def train_model(
         return False, f"ERROR: Failed to train model. Details: {e}"
 
 
+def is_test_row(df: pd.DataFrame, test_fraction: float) -> np.ndarray:
+    """Function to assign rows to the test split by their content hash, the same way on every pass."""
+
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return (hashes % 1_000_000) < int(test_fraction * 1_000_000)
+
+
+@timed_stage("train_streaming")
+def train_model_streaming(
+    read_chunks,
+    algorithm: str = "sgd_classifier",
+    epochs: int = 5,
+    test_fraction: float = 0.2,
+    verify_rows: int = 10000
+):
+    """Function to train a model out of core with partial_fit over processed data chunks.
+
+    read_chunks is a callable returning a fresh iterator of processed DataFrame chunks; it is
+    called once per epoch and once more to evaluate. Rows are held out for testing by their
+    content hash, so no split is ever materialized. Returns (outcome, msg, model, X_test,
+    y_test, y_pred): y_test / y_pred cover the whole test split while X_test only holds its
+    first verify_rows rows, for checking the scoring kernel.
+    """
+
+    try:
+        if not 0 < test_fraction < 1:
+            raise ValueError(f"test_fraction must be between 0 and 1, got {test_fraction}")
+        model = get_model(algorithm)
+        if not hasattr(model, "partial_fit"):
+            raise ValueError(f"{algorithm} does not support incremental training with partial_fit")
+
+        classes = np.array([0, 1])
+        for epoch in range(epochs):
+            train_records = 0
+            for chunk in read_chunks():
+                train = chunk[~is_test_row(chunk, test_fraction)]
+                if train.empty is True:
+                    continue
+                # partial_fit does not shuffle, so shuffle within the chunk, differently every epoch.
+                train = train.sample(frac=1.0, random_state=epoch)
+                model.partial_fit(train.drop('Churn', axis=1), train['Churn'], classes=classes)
+                train_records += len(train)
+            print(f"Epoch {epoch + 1} of {epochs} trained on {train_records} records.")
+
+        y_test, y_pred, X_test = [], [], []
+        test_records = 0
+        for chunk in read_chunks():
+            test = chunk[is_test_row(chunk, test_fraction)]
+            if test.empty is True:
+                continue
+            X_chunk = test.drop('Churn', axis=1)
+            y_test.append(test['Churn'].to_numpy())
+            y_pred.append(model.predict(X_chunk))
+            if test_records < verify_rows:
+                X_test.append(X_chunk.iloc[:verify_rows - test_records])
+            test_records += len(test)
+        if test_records == 0:
+            raise ValueError("No records were held out for testing.")
+
+        return (
+            True,
+            f"Model training completed successfully. {epochs} epochs, {train_records} training and {test_records} test records.",
+            model,
+            pd.concat(X_test),
+            np.concatenate(y_test),
+            np.concatenate(y_pred),
+        )
+    except Exception as e:
+        return False, f"ERROR: Failed to train model. Details: {e}"
+
+
 def get_model(algorithm: str):
     """Function to get model."""
     if algorithm == "logistic_regression":
         return LogisticRegression(random_state=7)
+    elif algorithm == "logistic_regression_strong_l2":
+        return LogisticRegression(C=0.1, random_state=7)
+    elif algorithm == "logistic_regression_weak_l2":
+        return LogisticRegression(C=10.0, random_state=7)
+    elif algorithm == "sgd_classifier":
+        # log_loss keeps predict_proba and a linear model the scoring kernel can compile.
+        return SGDClassifier(loss="log_loss", random_state=7)
+    elif algorithm == "hist_gradient_boosting":
+        return HistGradientBoostingClassifier(random_state=7)
     else:
         raise ValueError(f"Unknown algorithm: {algorithm}")
     
 
+@timed_stage("model_export")
 def export_model(
         project_id: str,
         bucket_name: str,
@@ -71,31 +247,23 @@ def export_model(
         algorithm: str,
         timestamp: str,
         model):
-    """Function to export model to GCS."""
+    """Function to export model to storage."""
+
+    model_file_name = f"model_{algorithm}_{timestamp}.joblib"
+    backend = get_storage_backend(project_id, bucket_name)
+    model_path = backend.uri(f"{stage_model_folder_path}{model_file_name}")
     try:
 
         print("--- Configuration ---")
         print(f"Project ID: {project_id}")
         print(f"Bucket Name: {bucket_name}")
         print(f"Stage Model Folder Path: {stage_model_folder_path}")
-        model_file_name = f"model_{algorithm}_{timestamp}.joblib"
-        model_path = f"gs://{bucket_name}/{stage_model_folder_path}{model_file_name}"
         print(f"Model will be saved to: {model_path}")
 
-        # Save model locally first
-        joblib.dump(model, model_file_name)
-        print(f"Model saved locally to: {model_file_name}")
-
-        # Upload to GCS
-        storage_client = storage.Client(project=project_id)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(f"{stage_model_folder_path}{model_file_name}")
-        blob.upload_from_filename(model_file_name)
-        print(f"Model uploaded to GCS at: {model_path}")
-
-        # Clean up local file
-        os.remove(model_file_name)
-        print(f"Local file {model_file_name} deleted.")
+        # Stream the model straight into storage, no local copy needed
+        with backend.open_write(f"{stage_model_folder_path}{model_file_name}", content_type='application/octet-stream') as file:
+            joblib.dump(model, file)
+        print(f"Model uploaded to: {model_path}")
 
         return True, f"Model exported to {model_path}"
     except Exception as e:
@@ -103,6 +271,7 @@ def export_model(
     
 
 
+@timed_stage("evaluation_export")
 def export_model_perormance(
         project_id: str,
         bucket_name: str,
@@ -111,11 +280,16 @@ def export_model_perormance(
         timestamp: str,
         model,
         X_test,
-        y_test):
-    """Function to export model to GCS."""
+        y_test,
+        y_pred=None):
+    """Function to export model evaluation to storage.
+
+    y_pred skips predicting X_test, e.g. when the test split was scored chunk by chunk.
+    """
 
     model_evaluation_file_name = f"model_evaluation_{algorithm}_{timestamp}.csv"
-    model_evaluation_file_path = f"gs://{bucket_name}/{stage_model_folder_path}{model_evaluation_file_name}"
+    backend = get_storage_backend(project_id, bucket_name)
+    model_evaluation_file_path = backend.uri(f"{stage_model_folder_path}{model_evaluation_file_name}")
     
     try:
 
@@ -125,7 +299,8 @@ def export_model_perormance(
         print(f"Stage Model Folder Path: {stage_model_folder_path}")
         print(f"Model evaluation will be saved to: {model_evaluation_file_path}")
 
-        y_pred = model.predict(X_test)
+        if y_pred is None:
+            y_pred = model.predict(X_test)
         labels=[0, 1]
         
         precision, recall, f1_score, support = precision_recall_fscore_support(
@@ -144,11 +319,106 @@ def export_model_perormance(
         "timestamp": timestamp
         })
         
-        print(f"Metrics DataFrame:\n{evaluation_df}")
+        print_dataframe("Metrics DataFrame:\n", evaluation_df)
 
-        # Upload to GCS
-        evaluation_df.to_csv(model_evaluation_file_path, index=False)
-        print(f"Model evaluation uploaded to GCS at: {model_evaluation_file_path}")
+        # Upload to storage
+        backend.write_bytes(
+            f"{stage_model_folder_path}{model_evaluation_file_name}",
+            evaluation_df.to_csv(index=False).encode(),
+            content_type='text/csv'
+        )
+        print(f"Model evaluation uploaded to: {model_evaluation_file_path}")
         return True, f"Model evaluation exported to {model_evaluation_file_path}"
     except Exception as e:
-        return False, f"ERROR: Failed to export model evaluation to {model_evaluation_file_path}. Details: {e}"
\ No newline at end of file
+        return False, f"ERROR: Failed to export model evaluation to {model_evaluation_file_path}. Details: {e}"
+
+
+@timed_stage("kernel_export")
+def export_scoring_kernel(
+        project_id: str,
+        bucket_name: str,
+        stage_model_folder_path: str,
+        processed_data_folder_path: str,
+        algorithm: str,
+        timestamp: str,
+        model,
+        X_test):
+    """Function to compile the model with the saved scaler and encoder into a scoring kernel and export it to storage."""
+
+    kernel_file_name = f"model_kernel_{algorithm}_{timestamp}.npz"
+    backend = get_storage_backend(project_id, bucket_name)
+    kernel_path = backend.uri(f"{stage_model_folder_path}{kernel_file_name}")
+
+    try:
+
+        print("--- Configuration ---")
+        print(f"Project ID: {project_id}")
+        print(f"Bucket Name: {bucket_name}")
+        print(f"Stage Model Folder Path: {stage_model_folder_path}")
+        print(f"Scoring kernel will be saved to: {kernel_path}")
+
+        scaler = pickle.loads(backend.read_bytes(f"{processed_data_folder_path}scaler.pkl"))
+        encoder_outcome, encoder_msg, encoder = load_encoder(project_id, bucket_name, processed_data_folder_path)
+        if encoder_outcome is False:
+            return False, encoder_msg
+
+        kernel = compile_scoring_kernel(model, scaler, encoder)
+        verified, verify_msg = verify_scoring_kernel(kernel, model, scaler, X_test)
+        print(verify_msg)
+        if verified is False:
+            return False, f"ERROR: Scoring kernel not exported. {verify_msg}"
+
+        backend.write_bytes(
+            f"{stage_model_folder_path}{kernel_file_name}",
+            dump_scoring_kernel(kernel),
+            content_type='application/octet-stream'
+        )
+        print(f"Scoring kernel uploaded to: {kernel_path}")
+        return True, f"Scoring kernel exported to {kernel_path}. {verify_msg}"
+    except Exception as e:
+        return False, f"ERROR: Failed to export scoring kernel to {kernel_path}. Details: {e}"
+
+
+@timed_stage("bundle_export")
+def export_model_bundle(
+        project_id: str,
+        bucket_name: str,
+        stage_model_folder_path: str,
+        processed_data_folder_path: str,
+        algorithm: str,
+        timestamp: str,
+        model):
+    """Function to pack the model with the saved scaler, encoder, scoring kernel and evaluation into one bundle and export it to storage.
+
+    The scoring kernel and evaluation are the ones exported to the stage folder for the same
+    algorithm and timestamp; the kernel is optional.
+    """
+
+    bundle_file_name = f"model_bundle_{algorithm}_{timestamp}.bundle"
+    backend = get_storage_backend(project_id, bucket_name)
+    bundle_path = backend.uri(f"{stage_model_folder_path}{bundle_file_name}")
+
+    try:
+
+        print("--- Configuration ---")
+        print(f"Project ID: {project_id}")
+        print(f"Bucket Name: {bucket_name}")
+        print(f"Stage Model Folder Path: {stage_model_folder_path}")
+        print(f"Model bundle will be saved to: {bundle_path}")
+
+        scaler = pickle.loads(backend.read_bytes(f"{processed_data_folder_path}scaler.pkl"))
+        encoder_outcome, encoder_msg, encoder = load_encoder(project_id, bucket_name, processed_data_folder_path)
+        if encoder_outcome is False:
+            return False, encoder_msg
+        with backend.open_read(f"{stage_model_folder_path}model_evaluation_{algorithm}_{timestamp}.csv") as file:
+            metrics = pd.read_csv(file).to_dict(orient="records")
+        kernel_name = f"{stage_model_folder_path}model_kernel_{algorithm}_{timestamp}.npz"
+        kernel = load_scoring_kernel(backend.read_bytes(kernel_name)) if backend.stat(kernel_name) is not None else None
+
+        bundle = build_model_bundle(algorithm, timestamp, model, scaler, encoder, kernel, metrics)
+        with backend.open_write(f"{stage_model_folder_path}{bundle_file_name}", content_type='application/octet-stream') as file:
+            dump_model_bundle(bundle, file)
+        print(f"Model bundle uploaded to: {bundle_path}")
+        return True, f"Model bundle exported to {bundle_path}{' with scoring kernel' if kernel is not None else ''}."
+    except Exception as e:
+        return False, f"ERROR: Failed to export model bundle to {bundle_path}. Details: {e}"
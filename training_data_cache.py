@@ -0,0 +1,113 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+# Local on-disk cache of the processed data files /train reads. A file is cached under a key
+# derived from its bucket, name, generation and MD5 checksum, so a rewritten file is a new
+# entry and an unchanged one is never downloaded or parsed again. An entry is a directory
+# with one .npy file per column (the features and the Churn label) and a meta.json with the
+# column order; the arrays are loaded memory-mapped. Entries are evicted least recently used
+# first once the cache holds more than TRAINING_DATA_CACHE_MAX_BYTES;
+# TRAINING_DATA_CACHE_MAX_BYTES=0 turns the cache off.
+TRAINING_DATA_CACHE_DIR = os.getenv("TRAINING_DATA_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "training_data_cache")
+TRAINING_DATA_CACHE_MAX_BYTES = int(os.getenv("TRAINING_DATA_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+CACHE_FORMAT_VERSION = 1
+META_FILE_NAME = "meta.json"
+
+
+def get_cache_key(bucket_name: str, blob) -> str:
+    """Function to get the cache key of a stored object at its generation and checksum."""
+
+    identity = f"{CACHE_FORMAT_VERSION}:{bucket_name}/{blob.name}@{blob.generation}:{blob.md5_hash}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+def is_cacheable(df: pd.DataFrame) -> bool:
+    """Function to check that every column is a plain numeric NumPy array that can be saved as .npy and memory-mapped."""
+
+    return all(isinstance(dtype, np.dtype) and dtype.kind in "biuf" for dtype in df.dtypes)
+
+
+def load_cached_dataset(key: str, columns: list = None):
+    """Function to load a cached dataset as a DataFrame, reading only the given columns; None when it is not cached."""
+
+    entry_dir = os.path.join(TRAINING_DATA_CACHE_DIR, key)
+    try:
+        with open(os.path.join(entry_dir, META_FILE_NAME)) as meta_file:
+            meta = json.load(meta_file)
+        selected = columns or meta["columns"]
+        data = {
+            col: np.load(os.path.join(entry_dir, f"{meta['columns'].index(col)}.npy"), mmap_mode="r")
+            for col in selected
+        }
+    except (FileNotFoundError, ValueError):
+        return None
+    # The modification time of meta.json records the last use for the eviction.
+    os.utime(os.path.join(entry_dir, META_FILE_NAME))
+    # copy=False keeps one block per memory-mapped column instead of reading them all into a new one.
+    return pd.DataFrame(data, columns=selected, copy=False)
+
+
+def store_cached_dataset(key: str, df: pd.DataFrame) -> bool:
+    """Function to add a dataset to the cache and evict the least recently used ones beyond the size limit."""
+
+    if TRAINING_DATA_CACHE_MAX_BYTES <= 0 or not is_cacheable(df):
+        return False
+    if df.memory_usage(index=False).sum() > TRAINING_DATA_CACHE_MAX_BYTES:
+        print(f"Dataset {key} is larger than TRAINING_DATA_CACHE_MAX_BYTES, not cached.")
+        return False
+    entry_dir = os.path.join(TRAINING_DATA_CACHE_DIR, key)
+    os.makedirs(TRAINING_DATA_CACHE_DIR, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f".{key}.tmp-{os.getpid()}-{threading.get_ident()}-", dir=TRAINING_DATA_CACHE_DIR)
+    try:
+        # Columns are numbered, column names may not be valid file names.
+        for index, col in enumerate(df.columns):
+            np.save(os.path.join(temp_dir, f"{index}.npy"), df[col].to_numpy())
+        with open(os.path.join(temp_dir, META_FILE_NAME), "w") as meta_file:
+            json.dump({"format_version": CACHE_FORMAT_VERSION, "columns": [str(col) for col in df.columns], "rows": len(df)}, meta_file)
+        try:
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another process cached the same dataset meanwhile.
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    evict_cached_datasets(keep_key=key)
+    return True
+
+
+def _entry_bytes(entry_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def evict_cached_datasets(keep_key: str = None) -> int:
+    """Function to delete the least recently used datasets until the cache fits TRAINING_DATA_CACHE_MAX_BYTES, returning how many."""
+
+    entries = []
+    for entry in os.scandir(TRAINING_DATA_CACHE_DIR):
+        meta_path = os.path.join(entry.path, META_FILE_NAME)
+        if entry.is_dir() and os.path.exists(meta_path):
+            entries.append((os.stat(meta_path).st_mtime, entry.name, _entry_bytes(entry.path)))
+
+    total_bytes = sum(size for last_used, name, size in entries)
+    evicted = 0
+    for last_used, name, size in sorted(entries):
+        if total_bytes <= TRAINING_DATA_CACHE_MAX_BYTES:
+            break
+        if name == keep_key:
+            continue
+        # Processes still reading the memory-mapped arrays keep them until they are done.
+        shutil.rmtree(os.path.join(TRAINING_DATA_CACHE_DIR, name), ignore_errors=True)
+        total_bytes -= size
+        evicted += 1
+    if evicted:
+        print(f"Training data cache evicted {evicted} dataset(s), {total_bytes / 1e6:.1f}MB left.")
+    return evicted
+
@@ -0,0 +1,139 @@
+import os
+import time
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score, f1_score
+from threadpoolctl import threadpool_limits
+
+from train_model import get_model
+from metrics import observe
+
+# Trains several candidate models on the same processed data in a pool of worker processes.
+# The training matrix is written once to a .npy file that every worker memory-maps, so the
+# data is neither pickled to each worker nor copied per candidate.
+TRAIN_ALGORITHMS = os.getenv("TRAIN_ALGORITHMS", "logistic_regression")
+TRAIN_MAX_WORKERS = int(os.getenv("TRAIN_MAX_WORKERS", "0"))
+TRAIN_SELECTION_METRIC = os.getenv("TRAIN_SELECTION_METRIC", "F1-Score")
+TRAINING_MMAP_DIR = os.getenv("TRAINING_MMAP_DIR") or None
+
+SELECTION_METRICS = ("F1-Score", "Accuracy")
+
+
+def get_train_algorithms() -> list:
+    """Function to get the configured candidate algorithms, in order."""
+
+    return [algorithm.strip() for algorithm in TRAIN_ALGORITHMS.split(",") if algorithm.strip()]
+
+
+def write_training_matrix(df: pd.DataFrame, rows, directory: str, target: str = "Churn"):
+    """Function to write the given rows of the features and target as .npy files for memory-mapping.
+
+    Columns are copied one at a time, so only the file and one column are ever materialized.
+    Returns the file paths and the feature column names.
+    """
+
+    columns = [col for col in df.columns if col != target]
+    # The common type of the columns, e.g. float32 for compact processed data.
+    dtype = np.result_type(*[df[col].dtype for col in columns])
+    X_path = os.path.join(directory, "X_train.npy")
+    y_path = os.path.join(directory, "y_train.npy")
+
+    X = np.lib.format.open_memmap(X_path, mode="w+", dtype=dtype, shape=(len(rows), len(columns)))
+    for position, col in enumerate(columns):
+        X[:, position] = df[col].to_numpy()[rows]
+    X.flush()
+    del X
+    np.save(y_path, df[target].to_numpy()[rows])
+    return X_path, y_path, columns
+
+
+def _fit_candidate(algorithm: str, X_path: str, y_path: str, columns: list, threads: int):
+    """Function to fit one candidate inside a worker process on the memory-mapped training matrix."""
+
+    X = pd.DataFrame(np.load(X_path, mmap_mode="r"), columns=columns, copy=False)
+    y = np.load(y_path, mmap_mode="r")
+    model = get_model(algorithm)
+    start = time.perf_counter()
+    # Split the cores between the workers instead of every worker using all of them.
+    with threadpool_limits(limits=threads):
+        model.fit(X, y)
+    return model, time.perf_counter() - start
+
+
+def evaluate_candidate(model, X_test, y_test) -> dict:
+    """Function to compute the selection metrics of a fitted candidate on the test rows (positive class)."""
+
+    y_pred = model.predict(X_test)
+    return {
+        "Accuracy": float(accuracy_score(y_test, y_pred)),
+        "F1-Score": float(f1_score(y_test, y_pred, pos_label=1, zero_division=0)),
+    }
+
+
+def train_candidates(
+        df: pd.DataFrame,
+        algorithms: list = None,
+        max_workers: int = None,
+        selection_metric: str = None
+    ):
+    """Function to train several candidate models concurrently and rank them.
+
+    Every candidate is fitted on the same 80/20 split as train_model. Returns
+    (outcome, msg, candidates, X_test, y_test) where candidates are ordered best first by
+    selection_metric (ties broken by the other metric), each a dict with algorithm, model, fit_seconds,
+    metrics and error; candidates that failed to fit come last with model None.
+    """
+
+    algorithms = algorithms or get_train_algorithms()
+    selection_metric = selection_metric or TRAIN_SELECTION_METRIC
+    if selection_metric not in SELECTION_METRICS:
+        return False, f"ERROR: Unknown selection metric {selection_metric}. Use one of {SELECTION_METRICS}.", [], None, None
+    max_workers = max_workers or TRAIN_MAX_WORKERS or min(len(algorithms), os.cpu_count() or 1)
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+
+    try:
+        # Same rows as train_test_split(X, y, test_size=0.2, random_state=7) in train_model.
+        train_rows, test_rows = train_test_split(np.arange(len(df)), test_size=0.2, random_state=7)
+        X_test = df.iloc[test_rows].drop('Churn', axis=1)
+        y_test = df['Churn'].iloc[test_rows]
+
+        candidates = []
+        with tempfile.TemporaryDirectory(prefix="training-", dir=TRAINING_MMAP_DIR) as directory:
+            X_path, y_path, columns = write_training_matrix(df, train_rows, directory)
+            print(f"Training {len(algorithms)} candidates on {len(train_rows)} records with {max_workers} workers.")
+
+            # Fresh interpreters, like the job pool, so workers never inherit web server threads.
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = {
+                    executor.submit(_fit_candidate, algorithm, X_path, y_path, columns, threads): algorithm
+                    for algorithm in algorithms
+                }
+                for future in as_completed(futures):
+                    algorithm = futures[future]
+                    candidate = {"algorithm": algorithm, "model": None, "fit_seconds": None, "metrics": None, "error": None}
+                    try:
+                        model, fit_seconds = future.result()
+                        observe("churn_stage_duration_seconds", fit_seconds, stage="train", algorithm=algorithm)
+                        candidate.update(model=model, fit_seconds=round(fit_seconds, 3))
+                        candidate["metrics"] = evaluate_candidate(model, X_test, y_test)
+                        print(f"Candidate {algorithm} fitted in {fit_seconds:.3f}s: {candidate['metrics']}")
+                    except Exception as e:
+                        candidate["error"] = f"{type(e).__name__}: {e}"
+                        print(f"ERROR: Candidate {algorithm} failed. Details: {candidate['error']}")
+                    candidates.append(candidate)
+
+        other_metric = "Accuracy" if selection_metric != "Accuracy" else "F1-Score"
+        candidates.sort(key=lambda candidate: (
+            candidate["model"] is not None,
+            candidate["metrics"][selection_metric] if candidate["metrics"] else 0.0,
+            candidate["metrics"][other_metric] if candidate["metrics"] else 0.0,
+        ), reverse=True)
+        if candidates[0]["model"] is None:
+            return False, "ERROR: Failed to train any candidate model.", candidates, X_test, y_test
+        return True, f"Trained {sum(candidate['model'] is not None for candidate in candidates)} of {len(candidates)} candidate models.", candidates, X_test, y_test
+    except Exception as e:
+        return False, f"ERROR: Failed to train candidate models. Details: {e}", [], None, None